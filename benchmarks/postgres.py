@@ -0,0 +1,134 @@
+import os
+import time
+import subprocess
+import urllib.parse
+import psycopg2
+
+
+"""
+Finds a local Postgres server for the benchmarks: a server that is already
+running, the sales-db server started from sales-db/compose.yaml, or an
+embedded server from the pgserver package if it is installed.
+"""
+
+COMPOSE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'sales-db', 'compose.yaml')
+
+
+class Unavailable(Exception):
+    """ Raised when no Postgres server can be found or started. """
+
+
+def _reachable(server):
+    """ Returns True if the server accepts connections. """
+    try:
+        psycopg2.connect(
+            user=server['user'],
+            password=server['password'],
+            host=server['host'],
+            port=server['port'],
+            database='postgres',
+            connect_timeout=3
+        ).close()
+        return True
+    except psycopg2.OperationalError:
+        return False
+
+
+def _start_compose(server, compose_file, timeout):
+    """ Starts the sales-db service, and waits until it is reachable. """
+    try:
+        subprocess.run(
+            ['docker', 'compose', '-f', compose_file, 'up', '-d', 'sales-db'],
+            check=True,
+            capture_output=True,
+            timeout=timeout
+        )
+    except (OSError, subprocess.SubprocessError):
+        return False
+    deadline = time.monotonic() + timeout
+    while (time.monotonic() < deadline):
+        if (_reachable(server)):
+            return True
+        time.sleep(1)
+    return False
+
+
+def _start_embedded(data_dir):
+    """ Starts an embedded server with pgserver, if it is installed. """
+    try:
+        import pgserver
+    except ImportError:
+        return None
+    uri = urllib.parse.urlparse(pgserver.get_server(data_dir).get_uri())
+    query = urllib.parse.parse_qs(uri.query)
+    return {
+        'user': uri.username or 'postgres',
+        'password': uri.password or '',
+        'host': query.get('host', [uri.hostname])[0],
+        'port': uri.port or 5432,
+        'source': 'embedded'
+    }
+
+
+def create_database(server, database):
+    """ Drops and creates a database on the server. """
+    conn = psycopg2.connect(
+        user=server['user'],
+        password=server['password'],
+        host=server['host'],
+        port=server['port'],
+        database='postgres'
+    )
+    conn.autocommit = True
+    with conn.cursor() as curs:
+        curs.execute('DROP DATABASE IF EXISTS "{}"'.format(database))
+        curs.execute('CREATE DATABASE "{}"'.format(database))
+    conn.close()
+
+
+def local_postgres(
+        user,
+        password,
+        host='localhost',
+        port=5432,
+        compose=True,
+        compose_file=COMPOSE_FILE,
+        embedded_dir=None,
+        timeout=60
+    ):
+    """
+    Returns the connection settings of a local Postgres server.
+
+    Args:
+        user: The user's name.
+        password: The user's password.
+        host: The host of an already running server.
+        port: The port of an already running server.
+        compose: If True, starts the sales-db service with docker compose
+            when no server is running.
+        compose_file: The compose file of the sales-db service.
+        embedded_dir: If set, and no other server is reachable, an embedded
+            pgserver is started with its data in embedded_dir.
+        timeout: The number of seconds to wait for the compose service.
+
+    Raises:
+        Unavailable: If no server is reachable.
+    """
+    server = {
+        'user': user,
+        'password': password,
+        'host': host,
+        'port': port,
+        'source': 'running'
+    }
+    if (_reachable(server)):
+        return server
+    if (compose and _start_compose(server, compose_file, timeout)):
+        server['source'] = 'compose'
+        return server
+    if (embedded_dir):
+        embedded = _start_embedded(embedded_dir)
+        if (embedded is not None and _reachable(embedded)):
+            return embedded
+    raise Unavailable('no local Postgres server at {}:{}'.format(host, port))
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from dotenv import load_dotenv
+
+from postgres import Unavailable, create_database, local_postgres
+from suites import DB_SUITES, SUITES, Context
+from synthetic import generate
+
+
+"""
+Runs the benchmark suites against synthetic sales data, and writes the
+results as JSON. With --baseline, the median timings are compared with a
+previous run, and the run fails if any of them regressed.
+"""
+
+
+def git_commit():
+    """ Returns the commit of the working tree, or None outside of git. """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def medians(results, prefix=''):
+    """ Yields the name and value of every median timing in the results. """
+    for name, value in results.items():
+        if (isinstance(value, dict)):
+            yield from medians(value, prefix + name + '.')
+        elif (name in ('median_seconds', 'seconds')):
+            yield prefix + name, value
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the timings that are more than tolerance slower than in the
+    baseline, as (name, baseline seconds, seconds) tuples.
+    """
+    previous = dict(medians(baseline['results']))
+    return [
+        (name, previous[name], seconds)
+        for name, seconds in medians(results['results'])
+        if (name in previous and seconds > previous[name] * (1 + tolerance))
+    ]
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description='Benchmark the data path, training input and inference.'
+    )
+    parser.add_argument('--suites', nargs='*', default=list(SUITES), choices=list(SUITES))
+    parser.add_argument('--shops', type=int, default=10)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--months', type=int, default=34)
+    parser.add_argument('--pair-density', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='../data/benchmark')
+    parser.add_argument('--database', default='sales_benchmark')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument(
+        '--insert-rows',
+        type=int,
+        default=5000,
+        help='the number of sales rows loaded by both insertCSV and copyCSV'
+    )
+    parser.add_argument('--model', help='a model or exported artifact for the forecast suite')
+    parser.add_argument('--forecast-batch-sizes', type=int, nargs='*', default=[1, 32, 256])
+    parser.add_argument('--no-compose', action='store_true', help='do not start sales-db/compose.yaml')
+    parser.add_argument('--embedded-dir', help='start an embedded pgserver here if no server is running')
+    parser.add_argument('--output', default='results.json')
+    parser.add_argument('--baseline', help='a previous results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    data = generate(
+        args.data_dir,
+        num_shops=args.shops,
+        num_items=args.items,
+        num_months=args.months,
+        pair_density=args.pair_density,
+        seed=args.seed
+    )
+    print('generated {} sales rows'.format(data['rows']['sales_train']))
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'params': vars(args),
+        'data': data['rows'],
+        'results': {}
+    }
+
+    server = None
+    if (DB_SUITES.intersection(args.suites)):
+        try:
+            server = local_postgres(
+                os.getenv('POSTGRES_USER'),
+                os.getenv('POSTGRES_PASSWORD'),
+                host=os.getenv('POSTGRES_HOST', 'localhost'),
+                port=int(os.getenv('POSTGRES_PORT', 5432)),
+                compose=not args.no_compose,
+                embedded_dir=args.embedded_dir
+            )
+            create_database(server, args.database)
+            results['meta']['postgres'] = server['source']
+        except Unavailable as error:
+            print('skipping database suites: {}'.format(error))
+
+    ctx = Context(data, server, args.database, args)
+    if (server is not None):
+        ctx.db = ctx.connect()
+    for name in SUITES:
+        if (name not in args.suites and not (name == 'load' and server is not None)):
+            continue
+        if (name in DB_SUITES and server is None):
+            results['results'][name] = {'skipped': 'no local Postgres server'}
+            continue
+        print('running {}'.format(name))
+        try:
+            results['results'][name] = SUITES[name](ctx)
+        except ImportError as error:
+            results['results'][name] = {'skipped': str(error)}
+    if (ctx.db is not None):
+        ctx.db.close()
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('wrote {}'.format(args.output))
+
+    if (args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for name, previous, seconds in regressions:
+            print('regression: {} {:.4f}s -> {:.4f}s'.format(name, previous, seconds))
+        if (regressions):
+            sys.exit(1)
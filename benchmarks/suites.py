@@ -0,0 +1,268 @@
+import os
+import sys
+import time
+import tempfile
+import importlib.util
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.append(os.getenv("SALES_DB_DIR"))
+sys.path.append(os.getenv("SALES_MODEL_DIR"))
+import schema
+from database import SalesDB
+from features import fill_batch
+
+from synthetic import head
+
+
+def timings(fn, repeats=10, warmup=1):
+    """
+    Calls fn repeatedly, and returns statistics of its wall time in seconds.
+    """
+    for _ in range(warmup):
+        fn()
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    seconds = np.array(seconds)
+    return {
+        'repeats': repeats,
+        'mean_seconds': float(seconds.mean()),
+        'median_seconds': float(np.median(seconds)),
+        'p95_seconds': float(np.percentile(seconds, 95)),
+        'min_seconds': float(seconds.min()),
+        'max_seconds': float(seconds.max())
+    }
+
+
+def elapsed(fn):
+    """ Calls fn once, and returns its result and wall time in seconds. """
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def import_path(name, path):
+    """
+    Imports a module from a file path under a new name. Both sales-db and
+    sales-model have a data_generator module, so they cannot share a name.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Context():
+
+    """ The data and settings shared by the benchmark suites. """
+
+    def __init__(self, data, server, database, args):
+        self.data = data
+        self.server = server
+        self.database = database
+        self.args = args
+        self.rng = np.random.default_rng(args.seed)
+        self.db = None
+
+    def connect(self, **kwargs):
+        """ Returns a SalesDB instance of the benchmark database. """
+        return SalesDB(
+            self.server['user'],
+            self.server['password'],
+            database=self.database,
+            host=self.server['host'],
+            port=self.server['port'],
+            **kwargs
+        )
+
+    def sample_pairs(self, num_pairs):
+        """ Returns a sample of the shop and item pairs in the database. """
+        ids = np.array(self.db.getIds(), dtype='int64').reshape(-1, 2)
+        rows = self.rng.choice(len(ids), min(num_pairs, len(ids)), replace=False)
+        return [tuple(pair) for pair in ids[rows].tolist()]
+
+
+def bench_load(ctx):
+    """
+    Loads the synthetic csv files into a new database. Row by row
+    insertCSV and bulk copyCSV load the same sample of sales rows, then
+    the full sales file is bulk loaded and rolled up.
+    """
+    paths = ctx.data['paths']
+    db = ctx.db
+    schema.apply(db)
+    results = {}
+    for name, key in (('itemcategories', 'item_categories'), ('shops', 'shops'), ('items', 'items')):
+        db.copyCSV(name, paths[key])
+
+    sample_path = head(
+        paths['sales_train'],
+        ctx.args.insert_rows,
+        os.path.join(ctx.args.data_dir, 'sales_sample.csv')
+    )
+    _, seconds = elapsed(lambda: db.insertCSV('sales', sample_path))
+    results['insert_csv'] = {
+        'rows': ctx.args.insert_rows,
+        'seconds': seconds,
+        'rows_per_second': ctx.args.insert_rows / seconds
+    }
+    db.execute('TRUNCATE sales')
+    report = db.copyCSV('sales', sample_path)
+    results['copy_csv'] = {
+        'rows': report['rows'],
+        'seconds': report['seconds'],
+        'rows_per_second': report['rows_per_second']
+    }
+    results['copy_speedup'] = results['insert_csv']['seconds'] / max(report['seconds'], 1e-9)
+
+    db.execute('TRUNCATE sales')
+    report = db.copyCSV('sales', paths['sales_train'])
+    results['copy_csv_full'] = {
+        'rows': report['rows'],
+        'seconds': report['seconds'],
+        'rows_per_second': report['rows_per_second']
+    }
+    _, seconds = elapsed(lambda: db.refreshRollup(full=True))
+    results['refresh_rollup'] = {'seconds': seconds}
+    return results
+
+
+def bench_getters(ctx):
+    """
+    Compares fetching the features of a sample of pairs with the per-pair
+    getters against a single batched query, with and without prepared
+    statements.
+    """
+    pairs = ctx.sample_pairs(ctx.args.batch_size)
+
+    def per_pair(db):
+        for shop_id, item_id in pairs:
+            db.getSalesData(shop_id, item_id)
+            db.getItemPrice(shop_id, item_id)
+            db.getItemCategory(shop_id, item_id)
+
+    db = ctx.db
+    results = {
+        'pairs': len(pairs),
+        'per_pair': timings(lambda: per_pair(db), ctx.args.repeats),
+        'batched': timings(lambda: db.getBatchFeatures(pairs), ctx.args.repeats),
+        'statements': db.getStatementStats()
+    }
+    results['batched_speedup'] = \
+        results['per_pair']['median_seconds'] / results['batched']['median_seconds']
+
+    with ctx.connect(prepared=False) as unprepared:
+        results['unprepared'] = {
+            'per_pair': timings(lambda: per_pair(unprepared), ctx.args.repeats),
+            'batched': timings(lambda: unprepared.getBatchFeatures(pairs), ctx.args.repeats)
+        }
+    results['prepared_speedup'] = \
+        results['unprepared']['per_pair']['median_seconds'] / results['per_pair']['median_seconds']
+    return results
+
+
+def _batches(generator, num_batches):
+    """ Returns a function that gets the first num_batches batches. """
+    num_batches = min(num_batches, len(generator))
+
+    def run():
+        for idx in range(num_batches):
+            generator[idx]
+    return run, num_batches
+
+
+def bench_db_generator(ctx):
+    """
+    Times sales-db DataGenerator.__getitem__, from the database and from
+    the feature cache.
+    """
+    module = import_path('db_data_generator', os.path.join(os.getenv('SALES_DB_DIR'), 'data_generator.py'))
+    results = {}
+    generator = module.DataGenerator(
+        sales_db=ctx.db,
+        batch_size=ctx.args.batch_size,
+        seq_len=ctx.args.months
+    )
+    run, num_batches = _batches(generator, ctx.args.batches)
+    results['database'] = timings(run, ctx.args.repeats)
+    results['database']['batches'] = num_batches
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        generator, seconds = elapsed(lambda: module.DataGenerator(
+            sales_db=ctx.db,
+            batch_size=ctx.args.batch_size,
+            seq_len=ctx.args.months,
+            cache_dir=cache_dir
+        ))
+        run, num_batches = _batches(generator, ctx.args.batches)
+        results['feature_cache'] = timings(run, ctx.args.repeats)
+        results['feature_cache']['batches'] = num_batches
+        results['feature_cache']['build_seconds'] = seconds
+    return results
+
+
+def bench_csv_generator(ctx):
+    """
+    Times building the sales-model DataGenerator from the csv files, its
+    lazy __getitem__, and building every batch up front with batch_data.
+    """
+    module = import_path('csv_data_generator', os.path.join(os.getenv('SALES_MODEL_DIR'), 'data_generator.py'))
+    paths = ctx.data['paths']
+    results = {}
+    generator, seconds = elapsed(lambda: module.DataGenerator(
+        paths['sales_train'],
+        paths['items'],
+        lazy=True,
+        batch_size=ctx.args.batch_size,
+        seq_len=ctx.args.months - 1
+    ))
+    run, num_batches = _batches(generator, ctx.args.batches)
+    results['lazy'] = timings(run, ctx.args.repeats)
+    results['lazy']['batches'] = num_batches
+    results['lazy']['build_seconds'] = seconds
+
+    data, seconds = elapsed(lambda: generator.load_data(paths['sales_train'], paths['items']))
+    results['load_data'] = {'seconds': seconds}
+    batches, seconds = elapsed(lambda: generator.batch_data(data))
+    results['batch_data'] = {'seconds': seconds, 'batches': len(batches)}
+    return results
+
+
+def bench_forecast(ctx):
+    """
+    Times end-to-end forecasts of a sample of pairs: fetching the features,
+    filling the batch, and running the model, for several batch sizes.
+    """
+    if (not ctx.args.model):
+        return {'skipped': 'no --model given'}
+    from inference import load_model
+    model, seconds = elapsed(lambda: load_model(ctx.args.model))
+    results = {'model': ctx.args.model, 'load_seconds': seconds}
+    # Forecasts of the month after the last date block use every month
+    seq_len = ctx.args.months
+    for batch_size in ctx.args.forecast_batch_sizes:
+        pairs = ctx.sample_pairs(batch_size)
+
+        def forecast():
+            rows = ctx.db.getBatchFeatures(pairs)
+            x_batch, _ = fill_batch(rows, len(pairs), seq_len, targets=False)
+            return model.predict(x_batch)
+
+        results['batch_{}'.format(batch_size)] = timings(forecast, ctx.args.repeats)
+    return results
+
+
+SUITES = {
+    'load': bench_load,
+    'getters': bench_getters,
+    'db_generator': bench_db_generator,
+    'csv_generator': bench_csv_generator,
+    'forecast': bench_forecast
+}
+
+# Suites that need the database, which the load suite fills
+DB_SUITES = {'load', 'getters', 'db_generator', 'forecast'}
@@ -0,0 +1,118 @@
+import os
+import csv
+import numpy as np
+import pandas as pd
+
+
+"""
+Generates synthetic sales data in the format of the Predict Future Sales
+csv files, scaled to any number of shops, items and months.
+"""
+
+
+def generate(
+        data_dir,
+        num_shops=10,
+        num_items=1000,
+        num_months=34,
+        num_categories=84,
+        pair_density=0.2,
+        sale_probability=0.3,
+        seed=0
+    ):
+    """
+    Writes item_categories.csv, shops.csv, items.csv and sales_train.csv
+    into data_dir.
+
+    Args:
+        data_dir: The directory the csv files are written to.
+        num_shops: The number of shops.
+        num_items: The number of items.
+        num_months: The number of date blocks.
+        num_categories: The number of item categories.
+        pair_density: The fraction of shop and item pairs that sell.
+        sale_probability: The probability that a selling pair has sales in
+            a month.
+        seed: Seed value of the data.
+
+    Returns:
+        A dictionary of the number of rows in each file, and the file paths.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {
+        name: os.path.join(data_dir, name + '.csv')
+        for name in ('item_categories', 'shops', 'items', 'sales_train')
+    }
+
+    categories = pd.DataFrame({
+        'item_category_name': ['category {}'.format(i) for i in range(num_categories)],
+        'item_category_id': np.arange(num_categories)
+    })
+    categories.to_csv(paths['item_categories'], index=False)
+
+    shops = pd.DataFrame({
+        'shop_name': ['shop {}'.format(i) for i in range(num_shops)],
+        'shop_id': np.arange(num_shops)
+    })
+    shops.to_csv(paths['shops'], index=False)
+
+    items = pd.DataFrame({
+        'item_name': ['item {}'.format(i) for i in range(num_items)],
+        'item_id': np.arange(num_items),
+        'item_category_id': rng.integers(0, num_categories, num_items)
+    })
+    items.to_csv(paths['items'], index=False)
+
+    # Each selling pair sells in a random subset of months, with one or
+    # more daily sales rows in each month
+    num_pairs = max(int(pair_density * num_shops * num_items), 1)
+    pair_keys = rng.choice(num_shops * num_items, num_pairs, replace=False)
+    base_prices = rng.lognormal(6.5, 1.2, num_items).round(2)
+    num_rows = 0
+    with open(paths['sales_train'], 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ['date', 'date_block_num', 'shop_id', 'item_id', 'item_price', 'item_cnt_day'])
+        for month in range(num_months):
+            selling = pair_keys[rng.random(num_pairs) < sale_probability]
+            days = rng.integers(1, 4, len(selling))
+            keys = np.repeat(selling, days)
+            shop_ids, item_ids = np.divmod(keys, num_items)
+            dates = rng.integers(1, 29, len(keys))
+            counts = rng.poisson(1.5, len(keys)) + 1
+            prices = base_prices[item_ids] * rng.uniform(0.9, 1.1, len(keys)).round(2)
+            year, month_of_year = divmod(month, 12)
+            writer.writerows(
+                (
+                    '{:02d}.{:02d}.{}'.format(day, month_of_year + 1, 2013 + year),
+                    month,
+                    shop_id,
+                    item_id,
+                    '{:.2f}'.format(price),
+                    '{:.1f}'.format(count)
+                )
+                for day, shop_id, item_id, price, count
+                in zip(dates, shop_ids, item_ids, prices, counts)
+            )
+            num_rows += len(keys)
+
+    return {
+        'paths': paths,
+        'rows': {
+            'item_categories': num_categories,
+            'shops': num_shops,
+            'items': num_items,
+            'sales_train': num_rows
+        }
+    }
+
+
+def head(path, num_rows, output_path):
+    """ Writes the header and first num_rows rows of a csv file. """
+    with open(path, newline='') as file, open(output_path, 'w', newline='') as output:
+        for i, line in enumerate(file):
+            if (i > num_rows):
+                break
+            output.write(line)
+    return output_path
@@ -0,0 +1,305 @@
+import time
+import pickle
+import sqlite3
+import threading
+import collections
+
+
+# Namespaces invalidated with a pair, even if this process never set them
+NAMESPACES = ('features', 'sales', 'price', 'category', 'forecast')
+
+
+class SQLiteBackend():
+
+    """
+    SQLiteBackend is a cache backend stored in a local sqlite file, so every
+    process on a host can share entries and see each other's invalidations.
+    """
+
+    def __init__(self, path, ttl=None):
+        """
+        Args:
+            path: The filepath of the sqlite database.
+            ttl: The number of seconds an entry stays valid. If not given,
+                entries stay valid until they are deleted.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ( \
+                    key TEXT PRIMARY KEY \
+                    ,value BLOB NOT NULL \
+                    ,created REAL NOT NULL \
+                )")
+
+    def _connect(self):
+        """ Returns the sqlite connection of the calling thread. """
+        conn = getattr(self._local, 'conn', None)
+        if (conn is None):
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """ Returns the value of a key, or None if it is missing or expired. """
+        row = self._connect().execute(
+            "SELECT value, created FROM cache WHERE key = ?", (repr(key),)
+        ).fetchone()
+        if (row is None):
+            return None
+        value, created = row
+        if (self.ttl is not None and time.time() - created > self.ttl):
+            self.delete([key])
+            return None
+        return pickle.loads(value)
+
+    def set(self, key, value):
+        """ Stores the value of a key. """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                (repr(key), pickle.dumps(value), time.time())
+            )
+
+    def delete(self, keys):
+        """ Deletes keys. """
+        with self._connect() as conn:
+            conn.executemany(
+                "DELETE FROM cache WHERE key = ?",
+                [(repr(key),) for key in keys]
+            )
+
+    def clear(self):
+        """ Deletes every key. """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache")
+
+
+class LRUCache():
+
+    """
+    LRUCache is a thread-safe, in-process least recently used cache with a
+    size limit and an optional time to live. If a backend is given, misses
+    fall through to the backend, and writes and deletes go to both.
+    """
+
+    def __init__(self, maxsize=100000, ttl=None, backend=None):
+        """
+        Args:
+            maxsize: The maximum number of entries kept in memory.
+            ttl: The number of seconds an in-memory entry stays valid. With a
+                shared backend, this bounds how long an invalidation made by
+                another process goes unseen.
+            backend: An optional shared backend, such as a SQLiteBackend.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None, valid=None):
+        """
+        Returns the value of a key, or default if it is missing.
+
+        Args:
+            key: The key.
+            default: The value returned if the key is missing.
+            valid: An optional function of the value, which returns False
+                if the value is stale. Stale values are counted as stale
+                and returned as missing.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None):
+                value, created = entry
+                if (self.ttl is None or time.monotonic() - created <= self.ttl):
+                    self._entries.move_to_end(key)
+                    if (valid is None or valid(value)):
+                        self.hits += 1
+                        return value
+                    self.stale += 1
+                    return default
+                del self._entries[key]
+
+        if (self.backend is not None):
+            value = self.backend.get(key)
+            if (value is not None):
+                if (valid is not None and not valid(value)):
+                    with self._lock:
+                        self.stale += 1
+                    return default
+                self._store(key, value)
+                with self._lock:
+                    self.backend_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def _store(self, key, value):
+        """ Stores a value in memory, evicting the least recently used. """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while (len(self._entries) > self.maxsize):
+                self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        """ Stores the value of a key. """
+        self._store(key, value)
+        if (self.backend is not None):
+            self.backend.set(key, value)
+
+    def delete(self, keys):
+        """ Deletes keys. """
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if (self.backend is not None and keys):
+            self.backend.delete(keys)
+
+    def clear(self):
+        """ Deletes every key. """
+        with self._lock:
+            self._entries.clear()
+        if (self.backend is not None):
+            self.backend.clear()
+
+    def stats(self):
+        """ Returns the hit, miss and stale counters. """
+        with self._lock:
+            lookups = self.hits + self.backend_hits + self.misses + self.stale
+            return {
+                'hits': self.hits,
+                'backend_hits': self.backend_hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'hit_rate': (self.hits + self.backend_hits) / lookups if lookups else 0.0,
+                'size': len(self._entries)
+            }
+
+
+class PairCache():
+
+    """
+    PairCache caches values computed for a shop and item pair, such as
+    features or forecasts, under a namespace. Each entry records the latest
+    date block of the pair's sales it was computed from, and the last date
+    block of the rollup when it was cached. As new date blocks land, advance
+    records the latest date block of each pair with new sales, and entries of
+    those pairs computed from an earlier date block are treated as missing,
+    so values cached by any process are recomputed on their next read.
+    """
+
+    def __init__(self, maxsize=100000, ttl=None, backend=None, namespaces=NAMESPACES):
+        """
+        Args:
+            maxsize: The maximum number of entries kept in memory.
+            ttl: The number of seconds an in-memory entry stays valid.
+            backend: An optional shared backend, such as a SQLiteBackend.
+            namespaces: The namespaces invalidated with a pair.
+        """
+        self.cache = LRUCache(maxsize, ttl, backend)
+        self.namespaces = set(namespaces)
+        self.last_date_block = None
+        self._first_date_block = None
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def advance(self, last_date_block, latest=()):
+        """
+        Records the last date block of the rollup, and the latest date block
+        of each pair with sales after the previous last date block. Values
+        of those pairs computed from an earlier date block are missing from
+        then on.
+
+        Args:
+            last_date_block: The last date block of the rollup.
+            latest: (shop_id, item_id, date_block) rows of the pairs with
+                sales after the previous last date block.
+        """
+        with self._lock:
+            for shop_id, item_id, date_block in latest:
+                pair = (int(shop_id), int(item_id))
+                self._latest[pair] = max(int(date_block), self._latest.get(pair, -1))
+            if (self._first_date_block is None):
+                self._first_date_block = last_date_block
+            self.last_date_block = last_date_block
+
+    def _is_stale(self, pair, date_block, last_date_block):
+        """ Returns True if an entry of a pair predates newer sales. """
+        with self._lock:
+            if (self._first_date_block is None):
+                return False
+            if (last_date_block is None or last_date_block < self._first_date_block):
+                # Cached before the date blocks this process has seen
+                return True
+            latest = self._latest.get(pair)
+        if (latest is None):
+            return False
+        if (date_block is None):
+            date_block = last_date_block
+        return latest > date_block
+
+    def get(self, namespace, shop_id, item_id):
+        """
+        Returns the cached value of a pair, or None if it is missing or was
+        computed before the pair's latest date block.
+        """
+        pair = (int(shop_id), int(item_id))
+        entry = self.cache.get(
+            (namespace,) + pair,
+            valid=lambda entry: not self._is_stale(pair, entry[0], entry[1])
+        )
+        if (entry is None):
+            return None
+        _, _, value = entry
+        return value
+
+    def set(self, namespace, shop_id, item_id, value, date_block=None):
+        """
+        Caches the value of a pair.
+
+        Args:
+            namespace: The kind of value, for example "features".
+            shop_id: The shop id.
+            item_id: The item id.
+            value: The value.
+            date_block: The latest date block of the pair's sales the value
+                was computed from. If not given, the value is valid until
+                the pair has sales after the current last date block.
+        """
+        self.namespaces.add(namespace)
+        self.cache.set(
+            (namespace, int(shop_id), int(item_id)),
+            (date_block, self.last_date_block, value)
+        )
+
+    def invalidate(self, pairs):
+        """ Removes every cached value of the shop and item pairs. """
+        self.cache.delete(
+            (namespace, int(shop_id), int(item_id))
+            for namespace in self.namespaces
+            for shop_id, item_id in pairs
+        )
+
+    def clear(self):
+        """ Removes every cached value. """
+        self.cache.clear()
+
+    def stats(self):
+        """ Returns the hit, miss and stale counters. """
+        return self.cache.stats()
@@ -1,53 +1,61 @@
+import os
+import sys
+import argparse
+from dotenv import load_dotenv
+
+import schema
 from database import SalesDB
 
 
-# Create SalesDB instance
-db = SalesDB(user="admin", password="root")
-
-# Create itemscategories table
-db.createTable(
-    "itemcategories", 
-    ["item_category_name", "item_category_id"], 
-    ["character varying (64)", "serial"],
-    "ADD PRIMARY KEY (item_category_id)"
-)
+"""
+Creates or migrates the tables and indexes of the sales database, and
+verifies the result against the declared schema in schema.py.
+"""
 
-# Create shops table
-db.createTable(
-    "shops",
-    ["shop_name", "shop_id"],
-    ["character varying (256)", "serial"],
-    "ADD PRIMARY KEY (shop_id)"
+parser = argparse.ArgumentParser(
+    description="Apply and verify the sales database schema."
 )
-
-# Create items table
-db.createTable(
-    "items",
-    ["item_name", "item_id", "item_category_id"],
-    ["character varying (256)", "serial", "serial"],
-    "ADD PRIMARY KEY (item_id)",
-    "ADD FOREIGN KEY (item_category_id) \
-        REFERENCES itemcategories(item_category_id)"
+parser.add_argument(
+    "--partition",
+    action="store_true",
+    help="partition a new sales table by date_block_num"
+)
+parser.add_argument(
+    "--blocks-per-partition",
+    type=int,
+    default=12,
+    help="the number of date blocks in each sales partition"
 )
+parser.add_argument(
+    "--verify-only",
+    action="store_true",
+    help="only verify the schema, without applying migrations"
+)
+args = parser.parse_args()
+
+load_dotenv()
+USER = os.getenv("POSTGRES_USER")
+PASSWORD = os.getenv("POSTGRES_PASSWORD")
+
+# Create SalesDB instance
+db = SalesDB(USER, PASSWORD)
+
+# Apply pending migrations
+if (not args.verify_only):
+    applied = schema.apply(
+        db,
+        partition=args.partition,
+        blocks_per_partition=args.blocks_per_partition
+    )
+    for name in applied:
+        print("applied migration: {}".format(name))
+    if (not applied):
+        print("schema is up to date")
 
-# Create sales
-db.createTable(
-    "sales",
-    [
-        "date", 
-        "date_block_num", 
-        "shop_id", "item_id", 
-        "item_price", 
-        "item_cnt_day"
-    ],
-    [
-        "character varying (16)", 
-        "integer", 
-        "serial", 
-        "serial", 
-        "numeric", 
-        "numeric"
-    ],
-    "ADD FOREIGN KEY (shop_id) REFERENCES shops(shop_id)",
-    "ADD FOREIGN KEY (item_id) REFERENCES items(item_id)"
-)
\ No newline at end of file
+# Verify schema
+problems = schema.verify(db)
+for problem in problems:
+    print("ERROR: {}".format(problem))
+if (problems):
+    sys.exit(1)
+print("schema verified")
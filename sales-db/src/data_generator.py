@@ -1,8 +1,17 @@
-import random
+import os
+import time
+import hashlib
 import numpy as np
 import tensorflow as tf
 
 from database import SalesDB
+from feature_cache import FeatureCache
+from features import build_features, fill_batch, gather_batch, lookup_rows
+from loader import PrefetchLoader
+from quantiles import load_boundaries, quantile_levels, save_boundaries, sketch_chunks
+from splits import GROUP_COLUMNS, group_split, split_indices, time_split
+from tf_dataset import make_dataset
+from windows import SlidingWindows
 
 class DataGenerator(tf.keras.utils.PyDataset):
 
@@ -22,6 +31,14 @@ class DataGenerator(tf.keras.utils.PyDataset):
             seq_len=34,
             shuffle=True,
             seed=0,
+            cache_dir=None,
+            features=None,
+            on_batch=None,
+            window=None,
+            stride=1,
+            horizon=1,
+            windows=None,
+            samples=None,
             **krwags
         ):
         """
@@ -37,6 +54,30 @@ class DataGenerator(tf.keras.utils.PyDataset):
             seq_len: The length of each sequence of monthly sales data.
             shuffle: If True, shuffles the data with seed value.
             seed: Seed value used to shuffle data.
+            cache_dir: If set, the compact features of every pair are built
+                once, cached in cache_dir, and served from a memory map
+                instead of the database. The cache is rebuilt when the monthly rollup
+                changes.
+            features: A dictionary of compact feature arrays shared with
+                another data generator.
+            on_batch: An optional function called after each batch with
+                the batch index, number of samples, elapsed seconds, and
+                source, "features" or "database". metrics.batch_timer
+                returns one that records into a metrics sink.
+            window: If set, each pair yields a sample for every window of
+                this many months, instead of one sample of seq_len months.
+                Windows are strided views over a monthly matrix of seq_len
+                months, built from features of every month.
+            stride: The number of months between the starts of windows.
+            horizon: The number of months between the end of a window and
+                its target month.
+            windows: A SlidingWindows instance shared with another data
+                generator.
+            samples: The window samples served by the data generator.
+                Defaults to every window of the ids since their first sale.
+            krwags: Passed to PyDataset, for example workers and
+                use_multiprocessing. Each worker process opens its own
+                database connections.
         """
         super().__init__(**krwags)
 
@@ -53,81 +94,323 @@ class DataGenerator(tf.keras.utils.PyDataset):
             self.ids = ids
 
         self.shuffle = shuffle
+        self.seed = seed
 
-        # Shuffle data
+        # Shuffle data, without changing the given list of ids
         if (shuffle):
-            self.seed = seed
-            random.seed(seed)
-            random.shuffle(self.ids)
+            order = np.random.default_rng(seed).permutation(len(self.ids))
+            self.ids = [self.ids[i] for i in order]
         
         self.batch_size = batch_size
         self.seq_len = seq_len
+        self.cache_dir = cache_dir
+        self.on_batch = on_batch
+
+        # Get cached features. Windows need features of every month, with
+        # no month held out as a target.
+        if (windows is not None):
+            features = windows.features
+        elif (features is None and window is not None):
+            if (cache_dir):
+                features = self.load_features(cache_dir, targets=False)
+            else:
+                features = build_features(self.sales_db, self.ids, seq_len, targets=False)
+        elif (features is None and cache_dir):
+            features = self.load_features(cache_dir)
+        self.features = features
+        if (self.features is not None):
+            self.rows = lookup_rows(self.features['ids'], self.ids)
+
+        # Get window samples
+        if (window is not None and windows is None):
+            windows = SlidingWindows(self.features, seq_len, window, stride, horizon)
+        self.windows = windows
+        if (self.windows is not None):
+            if (samples is None):
+                samples = self.windows.samples(self.rows)
+                if (shuffle):
+                    samples = np.random.default_rng(seed).permutation(samples)
+            self.samples = np.asarray(samples, dtype='int64')
         
     def __len__(self):
         """ Returns the number of batches. """
-        return np.ceil(len(self.ids) / self.batch_size).astype('int32')
+        return np.ceil(self.num_samples() / self.batch_size).astype('int32')
+
+    def num_samples(self):
+        """ Returns the number of samples, one per pair or window. """
+        if (self.windows is not None):
+            return len(self.samples)
+        return len(self.ids)
     
     def __getitem__(self, idx):
         """ Gets the idx'th batch of data. """
+        start = time.perf_counter()
         low = idx * self.batch_size
-        high = min((idx + 1)* self.batch_size, len(self.ids))
+        high = min((idx + 1)* self.batch_size, self.num_samples())
         num_samples = high - low
-        x_batch = {
-            'categories': np.empty(num_samples, dtype='int32'),
-            'prices': np.empty(num_samples, dtype='float32'),
-            'sequences': np.zeros((num_samples,self.seq_len,12), dtype='float32')
-        }
-        y_batch = np.empty(num_samples)
-
-        # Get data from database
-        for i, (shop_id,item_id) in enumerate(self.ids[low:high]):
-            # Get item category id and price
-            x_batch['categories'][i] = np.squeeze(self.sales_db.getItemCategory(shop_id,item_id))
-            x_batch['prices'][i] = np.squeeze(self.sales_db.getItemPrice(shop_id,item_id))
-            
-            # Get sales data
-            sales = self.sales_db.getSalesData(shop_id,item_id)
-            for date_block_num, item_cnt in sales[:-1]:
-                x_batch['sequences'][i,date_block_num,date_block_num%12] = item_cnt
-            _, y_batch[i] = sales[-1]
-        
-        return x_batch, y_batch
+
+        if (self.windows is not None):
+            # Gather the windows from the monthly matrix
+            batch = self.windows.gather(self.samples[low:high])
+            source = 'windows'
+        elif (self.features is not None):
+            # Gather data from the cached features
+            batch = gather_batch(self.features, self.rows[low:high], self.seq_len)
+            source = 'features'
+        else:
+            # Get data from database in a single round trip
+            rows = self.sales_db.getBatchFeatures(self.ids[low:high])
+            batch = fill_batch(rows, num_samples, self.seq_len)
+            source = 'database'
+
+        if (self.on_batch is not None):
+            self.on_batch(idx, num_samples, time.perf_counter() - start, source)
+        return batch
     
     def train_test_split(self, frac=0.2, shuffle=True, seed=0):
         """
         Removes a fraction of the data from the data generator, and returns a
         new DataGenerator with the removed data and the same attributes. If 
         shuffle is set to False, train_test_split removes and adds the last 
-        data points from the data generator.
+        data points from the data generator. Use split to keep the data
+        generator unchanged.
         """
-        ids = []
-        num_samples = int(frac * len(self.ids))
-        # Sample ids
-        if (shuffle):
-            # Remove and add the ids randomly from the data generator
-            random.seed(seed)
-            for i in reversed(range(len(self.ids) - num_samples, len(self.ids))):
-                ids.append(self.ids.pop(random.randrange(i)))
+        if (self.windows is not None):
+            keep, sample = split_indices(len(self.samples), (1 - frac, frac), shuffle, seed)
+            samples = self.samples
+            self.samples = samples[keep]
+            return self.subset_samples(samples[sample])
+        keep, sample = split_indices(len(self.ids), (1 - frac, frac), shuffle, seed)
+        ids = self.ids
+        self.ids = [ids[i] for i in keep]
+        if (self.features is not None):
+            self.rows = lookup_rows(self.features['ids'], self.ids)
+        return self.subset([ids[i] for i in sample])
+
+    def split(self, fracs=(0.8, 0.2), by=None, cutoffs=None, shuffle=True, seed=None):
+        """
+        Splits the data generator's pairs into new DataGenerators with the
+        same database, features and attributes. The data generator itself
+        is not changed, and the splits are reproducible from the seed.
+
+        Args:
+            fracs: The fraction of pairs, or of windows, in each split.
+            by: None to split pairs independently, or 'shop' or 'item' to
+                keep every pair of a shop or item in the same split.
+            cutoffs: If set, pairs are split by the date block of their
+                first sale instead, as in splits.time_split, and fracs, by
+                and shuffle are ignored. Windows are split by their target
+                month, so every training target comes before every
+                validation target.
+            shuffle: If True, pairs are assigned to splits at random.
+            seed: Seed value of the split. Defaults to the data generator's
+                seed.
+
+        Returns:
+            A list of DataGenerators, one for each split.
+        """
+        seed = self.seed if seed is None else seed
+        if (self.windows is not None):
+            if (cutoffs is not None):
+                splits = time_split(self.windows.target_months(self.samples), cutoffs)
+            elif (by is None):
+                splits = split_indices(len(self.samples), fracs, shuffle, seed)
+            else:
+                rows = self.windows.rows(self.samples)
+                splits = group_split(self.features['ids'][rows, GROUP_COLUMNS[by]], fracs, shuffle, seed)
+            return [self.subset_samples(self.samples[idx]) for idx in splits]
+        if (cutoffs is not None):
+            first = np.array(self.sales_db.getFirstDateBlocks(), dtype='int64').reshape(-1, 3)
+            rows = lookup_rows(first[:, :2], self.ids)
+            splits = time_split(first[rows, 2], cutoffs)
+        elif (by is None):
+            splits = split_indices(len(self.ids), fracs, shuffle, seed)
         else:
-            # Remove and add the last ids from the data generator
-            for i in range(num_samples):
-                ids.append(self.ids.pop())
-        
+            ids = np.asarray(self.ids, dtype='int64').reshape(-1, 2)
+            splits = group_split(ids[:, GROUP_COLUMNS[by]], fracs, shuffle, seed)
+        return [self.subset([self.ids[i] for i in idx]) for idx in splits]
+
+    def subset(self, ids):
+        """
+        Returns a new DataGenerator of the given ids, with the same
+        database, features and attributes.
+        """
         return DataGenerator(
             ids=ids,
             sales_db=self.sales_db,
             batch_size=self.batch_size,
             seq_len=self.seq_len,
             shuffle=self.shuffle,
-            seed=self.seed
+            seed=self.seed,
+            features=self.features,
+            on_batch=self.on_batch
         )
-    
+
+    def subset_samples(self, samples):
+        """
+        Returns a new DataGenerator of the given window samples, sharing
+        the data generator's windows.
+        """
+        rows = np.unique(self.windows.rows(samples))
+        return DataGenerator(
+            ids=[tuple(pair) for pair in self.features['ids'][rows].tolist()],
+            sales_db=self.sales_db,
+            batch_size=self.batch_size,
+            seq_len=self.seq_len,
+            shuffle=self.shuffle,
+            seed=self.seed,
+            on_batch=self.on_batch,
+            windows=self.windows,
+            samples=samples
+        )
+
+    def prefetch(self, workers=4, use_multiprocessing=False, max_queue_size=8):
+        """
+        Returns a PrefetchLoader that loads the batches of the data generator
+        in parallel and yields them in order. Each worker uses its own
+        database connection, and loader.stats() reports the load time of
+        each worker.
+        """
+        if (not use_multiprocessing):
+            # Every thread worker needs its own pooled connection
+            pool = self.sales_db.pool
+            pool.resize(max(pool.max_size, workers))
+        return PrefetchLoader(
+            self,
+            workers=workers,
+            use_multiprocessing=use_multiprocessing,
+            max_queue_size=max_queue_size
+        )
+
+    def to_tf_dataset(
+            self,
+            shuffle=None,
+            shuffle_buffer=None,
+            cache=None,
+            num_parallel_calls=tf.data.AUTOTUNE,
+            prefetch=tf.data.AUTOTUNE
+        ):
+        """
+        Returns a tf.data.Dataset of the data generator's batches, loaded by
+        a parallel map and prefetched ahead of training. Batches are
+        gathered from the cached features if there are any, and fetched
+        from the database otherwise.
+
+        Args:
+            shuffle: If True, samples are reshuffled every epoch. Defaults
+                to the data generator's shuffle.
+            shuffle_buffer: The number of samples in the shuffle buffer.
+                Defaults to every sample index, or to
+                tf_dataset.SHUFFLE_BATCHES batches of cached samples.
+            cache: A file to cache loaded samples in, or an empty string to
+                cache them in memory.
+            num_parallel_calls: The number of batches loaded in parallel.
+            prefetch: The number of batches prepared ahead of training.
+        """
+        seq_len = self.seq_len
+        if (self.windows is not None):
+            seq_len = self.windows.window
+
+            def load(positions):
+                return self.windows.gather(self.samples[positions])
+        elif (self.features is not None):
+            def load(positions):
+                return gather_batch(self.features, self.rows[positions], self.seq_len)
+        else:
+            # Every parallel call needs its own pooled connection
+            pool = self.sales_db.pool
+            pool.resize(max(pool.max_size, os.cpu_count() or 1))
+
+            def load(positions):
+                rows = self.sales_db.getBatchFeatures([self.ids[i] for i in positions])
+                return fill_batch(rows, len(positions), self.seq_len)
+
+        return make_dataset(
+            load,
+            self.num_samples(),
+            seq_len,
+            batch_size=self.batch_size,
+            shuffle=self.shuffle if shuffle is None else shuffle,
+            shuffle_buffer=shuffle_buffer,
+            seed=self.seed,
+            cache=cache,
+            num_parallel_calls=num_parallel_calls,
+            prefetch=prefetch
+        )
+
+    def load_features(self, cache_dir, targets=True):
+        """
+        Opens the cached features of the data generator's ids, building them
+        from the database if the cache is missing or out of date.
+        """
+        return FeatureCache(cache_dir).get_or_build(
+            lambda: build_features(self.sales_db, self.ids, self.seq_len, targets=targets),
+            self.sales_db.getFingerprint(),
+            seq_len=self.seq_len,
+            ids=self.ids_digest(),
+            targets=targets
+        )
+
+    def ids_digest(self):
+        """ Returns a hash of the data generator's ids, in any order. """
+        ids = np.array(sorted(self.ids), dtype='int32')
+        return hashlib.sha256(ids.tobytes()).hexdigest()
+
+    def price_boundaries(self, num_bins=16, cache_path=None, chunk_rows=1 << 16):
+        """
+        Returns the bin boundaries of the max item prices of the data
+        generator's pairs, for Discretization(bin_boundaries=...). Without
+        cached features, the database computes exact quantiles with
+        percentile_disc. With cached features, the prices are summarized
+        chunk by chunk with a QuantileSketch, without a database round trip.
+
+        Args:
+            num_bins: The number of bins. num_bins - 1 boundaries are
+                returned.
+            cache_path: If set, the boundaries are cached in this JSON file,
+                and recomputed when the rollup or ids change.
+            chunk_rows: The number of prices sketched at a time.
+        """
+        config = {
+            'num_bins': num_bins,
+            'fingerprint': self.sales_db.getFingerprint(),
+            'ids': self.ids_digest()
+        }
+        if (cache_path):
+            boundaries = load_boundaries(cache_path, **config)
+            if (boundaries is not None):
+                return boundaries
+
+        if (self.features is not None):
+            prices = self.features['prices']
+            boundaries = sketch_chunks(
+                prices[self.rows[i:i + chunk_rows]]
+                for i in range(0, len(self.rows), chunk_rows)
+            ).boundaries(num_bins)
+        else:
+            boundaries = self.sales_db.getPriceQuantiles(
+                quantile_levels(num_bins), self.ids)
+
+        if (cache_path):
+            save_boundaries(cache_path, boundaries, **config)
+        return boundaries
+
     def get_prices(self):
-        """ Gets all of the item prices from the database. """
-        prices = np.array(self.sales_db.getPrices(), dtype='float32')
-        return np.squeeze(prices)
+        """
+        Gets all of the item prices from the database. Use price_boundaries
+        to adapt a Discretization layer without loading every price.
+        """
+        chunks = list(self.iter_prices())
+        if (not chunks):
+            return np.empty(0, dtype='float32')
+        return np.concatenate(chunks)
+
+    def iter_prices(self, chunk_rows=100000):
+        """ Yields the item prices from the database in chunks. """
+        for chunk in self.sales_db.streamPrices(chunk_rows):
+            yield chunk['item_price']
     
     def summary(self):
         """ Prints a summary of all of the data in the data generator. """
-        summary = f'number of data points {len(self.ids)}'
+        summary = f'number of data points {self.num_samples()}'
         print(summary)
\ No newline at end of file
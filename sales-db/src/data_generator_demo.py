@@ -16,26 +16,23 @@ USER = os.getenv('POSTGRES_USER')
 PASSWORD = os.getenv('POSTGRES_PASSWORD')
 
 # Create data generator
-train_gen = DataGenerator(USER,PASSWORD)
-train_gen.summary()
+data_gen = DataGenerator(USER,PASSWORD)
+data_gen.summary()
 
-# Split the training data generator into validation, and test data generators
-val_gen = train_gen.train_test_split(0.3)
+# Split the data generator into training, validation, and test data generators
+train_gen, val_gen, test_gen = data_gen.split((0.7, 0.15, 0.15))
+train_gen.summary()
 val_gen.summary()
-
-test_gen = val_gen.train_test_split(0.5, shuffle=False)
 test_gen.summary()
 
-train_gen.summary()
-
 # Create categorical feature
 category_input = tf.keras.layers.Input(shape=(1,), name='categories', dtype='int64')
 x = tf.keras.layers.Hashing(num_bins=16, output_mode='one_hot')(category_input)
 
 # Create price feature
 price_input = tf.keras.Input(shape=(1,), name='prices')
-disc_layer = tf.keras.layers.Discretization(num_bins=16, output_mode='one_hot')
-disc_layer.adapt(train_gen.get_prices())
+bin_boundaries = train_gen.price_boundaries(num_bins=16, cache_path='preprocessing.json')
+disc_layer = tf.keras.layers.Discretization(bin_boundaries=bin_boundaries, output_mode='one_hot')
 y = disc_layer(price_input)
 
 # Create sequence feature
@@ -60,15 +57,18 @@ model = tf.keras.Model(
 )
 model.summary()
 
+# Load batches with tf.data, so input preparation overlaps with training
+train_ds = train_gen.to_tf_dataset()
+val_ds = val_gen.to_tf_dataset(shuffle=False)
+test_ds = test_gen.to_tf_dataset(shuffle=False)
+
 # Compile and fit
 model.compile(optimizer='adam', loss='mse')
 model.fit(
-    x=train_gen,
+    x=train_ds,
     epochs=1,
-    batch_size=train_gen.batch_size,
-    validation_data=val_gen,
-    validation_batch_size=val_gen.batch_size
+    validation_data=val_ds
 )
 
 # Evaluate model performance
-model.evaluate(test_gen)
\ No newline at end of file
+model.evaluate(test_ds)
\ No newline at end of file
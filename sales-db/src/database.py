@@ -1,5 +1,92 @@
+import io
+import os
 import csv
+import time
+import logging
+import itertools
+import threading
+import contextlib
+import collections
+import numpy as np
 import psycopg2
+from psycopg2.sql import SQL, Composable, Identifier, Placeholder
+
+from metrics import instrumented
+from pool import ConnectionPool
+from schema import ROLLUP, SALES
+from statements import Statement, StatementRegistry
+
+
+logger = logging.getLogger(__name__)
+
+# Tables without a unique constraint. Copies into them skip rows equal to
+# an existing row, or to an earlier row of the same copy, so a load can be
+# rerun without duplicating rows.
+DEDUPLICATED = {"sales": SALES}
+
+# Names of server-side cursors must be unique within a connection
+_cursor_ids = itertools.count()
+
+# The hot queries, prepared once on each pooled connection
+SALES_DATA = Statement(
+    "salesdb_sales_data",
+    "SELECT \
+        date_block_num \
+        ,item_cnt \
+    FROM sales_monthly \
+    WHERE shop_id = %s \
+        AND item_id = %s \
+    ORDER BY date_block_num",
+    ["smallint", "integer"]
+)
+
+ITEM_PRICE = Statement(
+    "salesdb_item_price",
+    "SELECT \
+        MAX(max_price) \
+    FROM sales_monthly \
+    WHERE shop_id = %s \
+        AND item_id = %s",
+    ["smallint", "integer"]
+)
+
+ITEM_CATEGORY = Statement(
+    "salesdb_item_category",
+    "SELECT DISTINCT \
+        item_category_id \
+    FROM sales_monthly \
+    WHERE shop_id = %s \
+        AND item_id = %s",
+    ["smallint", "integer"]
+)
+
+BATCH_FEATURES = Statement(
+    "salesdb_batch_features",
+    "WITH pairs AS ( \
+        SELECT \
+            idx - 1 AS idx \
+            ,shop_id \
+            ,item_id \
+        FROM unnest(%s::integer[], %s::integer[]) \
+            WITH ORDINALITY AS p(shop_id, item_id, idx) \
+    ) \
+    SELECT \
+        pairs.idx \
+        ,items.item_category_id \
+        ,MAX(monthly.max_price) OVER (PARTITION BY pairs.idx) \
+        ,monthly.date_block_num \
+        ,monthly.item_cnt \
+    FROM pairs \
+    LEFT JOIN items \
+        ON pairs.item_id = items.item_id \
+    LEFT JOIN sales_monthly AS monthly \
+        ON pairs.shop_id = monthly.shop_id \
+        AND pairs.item_id = monthly.item_id \
+    ORDER BY pairs.idx, monthly.date_block_num",
+    ["integer[]", "integer[]"]
+)
+
+STATEMENTS = [SALES_DATA, ITEM_PRICE, ITEM_CATEGORY, BATCH_FEATURES]
 
 
 class SalesDB():
@@ -13,7 +100,19 @@ class SalesDB():
             user,
             password,
             database="sales_db",
-            host="localhost"
+            host="localhost",
+            port=5432,
+            pool_min_size=1,
+            pool_max_size=8,
+            idle_timeout=300.0,
+            health_check=True,
+            cache=None,
+            cache_check_seconds=5.0,
+            metrics=None,
+            slow_query_seconds=None,
+            explain_slow_queries=False,
+            explain_analyze=False,
+            prepared=True
         ) -> None:
         """
         Arguments:
@@ -21,11 +120,88 @@ class SalesDB():
             user: The user's name needed to connect with the database.
             password: The user's password needed to connect with the database.
             host: The name of the database network.
+            port: The port of the database server.
+            pool_min_size: The number of pooled connections kept open.
+            pool_max_size: The maximum number of pooled connections.
+            idle_timeout: The number of seconds an idle pooled connection is
+                kept open.
+            health_check: If True, pooled connections are checked before
+                they are reused.
+            cache: An optional PairCache. The per-pair getters and
+                getBatchFeatures are served from the cache, and the pairs
+                of refreshed sales data are invalidated.
+            cache_check_seconds: The number of seconds between checks of
+                the last date block of the rollup. When another process adds
+                a date block, the values cached for the pairs with sales in
+                it are dropped.
+            metrics: An optional MetricsSink. Every public method observes
+                its latency and counts its calls and rows, and connection
+                checkouts observe their wait time.
+            slow_query_seconds: If set, queries slower than this are logged
+                as warnings and recorded as slow_query events.
+            explain_slow_queries: If True, the plan of each slow read query
+                is captured with EXPLAIN.
+            explain_analyze: If True, slow query plans are captured with
+                EXPLAIN (ANALYZE, BUFFERS) instead, which runs the query a
+                second time to measure it.
+            prepared: If True, the hot per-pair and batch queries run as
+                server-side prepared statements, prepared once on each
+                pooled connection. Set to False behind a pooler that does
+                not keep sessions, such as pgbouncer in transaction mode.
         """
         self.database = database
         self.user = user
         self.password = password
         self.host = host
+        self.port = port
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.cache = cache
+        self.cache_check_seconds = cache_check_seconds
+        self._cache_checked = None
+        self.metrics = metrics
+        self.slow_query_seconds = slow_query_seconds
+        self.explain_slow_queries = explain_slow_queries
+        self.explain_analyze = explain_analyze
+        self.prepared = prepared
+        self.statements = StatementRegistry(STATEMENTS)
+
+        # The pool is opened on first use, and reopened after a fork
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+        # Date blocks of the sales table changed since the last refresh of
+        # the monthly rollup
+        self.dirty_blocks = set()
+        self._dirty_pairs = collections.defaultdict(set)
+
+    def __getstate__(self):
+        # The pool and its lock cannot be shared with another process, so a
+        # copy opens its own connections on first use
+        state = self.__dict__.copy()
+        state["_pool"] = None
+        state["_pool_pid"] = None
+        del state["_pool_lock"]
+        # Statements are prepared on connections, so copies start over
+        del state["statements"]
+        # An in-process cache or metrics sink is not shared with copies either
+        state["cache"] = None
+        state["metrics"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool_lock = threading.Lock()
+        self.statements = StatementRegistry(STATEMENTS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def connect(self):
         """
@@ -38,26 +214,148 @@ class SalesDB():
             database=self.database,
             user=self.user,
             password=self.password,
-            host=self.host
+            host=self.host,
+            port=self.port,
+            # Sales dates are written day first, for example 02.01.2013
+            options="-c datestyle=ISO,DMY"
         )
 
+    @property
+    def pool(self):
+        """ The connection pool shared by every query of this instance. """
+        pid = os.getpid()
+        if (self._pool is None or self._pool_pid != pid):
+            with self._pool_lock:
+                if (self._pool is None or self._pool_pid != pid):
+                    # Connections inherited from a parent process are left
+                    # alone, since closing them would break the parent's
+                    self._pool = ConnectionPool(
+                        self.connect,
+                        min_size=self.pool_min_size,
+                        max_size=self.pool_max_size,
+                        idle_timeout=self.idle_timeout,
+                        health_check=self.health_check
+                    )
+                    self._pool_pid = pid
+        return self._pool
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Returns a context manager that checks out a pooled connection, and
+        returns it to the pool on exit.
+
+        Example:
+            with db.connection() as conn:
+                with conn, conn.cursor() as curs:
+                    curs.execute(sql)
+        """
+        start = time.perf_counter()
+        with self.pool.connection() as conn:
+            if (self.metrics is not None):
+                self.metrics.observe(
+                    "salesdb_connection_wait_seconds", time.perf_counter() - start)
+            yield conn
+
+    def close(self) -> None:
+        """ Closes every pooled connection. """
+        with self._pool_lock:
+            if (self._pool is not None and self._pool_pid == os.getpid()):
+                self._pool.close()
+            self._pool = None
+            self._pool_pid = None
+
+    @instrumented
     def execute(self, sql, values=None) -> None:
         """
         Executes a single sql query within our database.
 
         Arguments:
-            sql (str): The sql query.
+            sql (str|Composable): The sql query.
             values (list|optional): A list of values.
         """
-        conn = self.connect()
-        with conn:
-            with conn.cursor() as curs:
-                if values:
-                    curs.execute(sql,values)
-                else:
-                    curs.execute(sql)
-        conn.close()
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as curs:
+                    seconds = self._execute(curs, sql, values)
+                    self._checkSlow(conn, sql, values, seconds, explain=False)
+
+    def _execute(self, curs, sql, values=None):
+        """
+        Executes a query or a Statement on a cursor, and returns its elapsed
+        seconds.
+        """
+        start = time.perf_counter()
+        if (isinstance(sql, Statement)):
+            self._executeStatement(curs, sql, values)
+        elif values:
+            curs.execute(sql,values)
+        else:
+            curs.execute(sql)
+        return time.perf_counter() - start
 
+    def _executeStatement(self, curs, statement, values):
+        """
+        Executes a Statement, as a prepared statement if prepared is True.
+        A connection whose prepared statements are out of step with the
+        registry is rolled back, and the statement retried once.
+        """
+        if (not self.prepared):
+            curs.execute(statement.sql, values)
+            return
+        try:
+            prepared = self.statements.execute(curs, statement, values)
+        except (psycopg2.errors.DuplicatePreparedStatement,
+                psycopg2.errors.InvalidSqlStatementName):
+            curs.connection.rollback()
+            prepared = self.statements.execute(curs, statement, values)
+        if (prepared and self.metrics is not None):
+            self.metrics.increment(
+                "salesdb_statement_prepares_total", 1, {"statement": statement.name})
+
+    def _checkSlow(self, conn, sql, values, seconds, explain=True):
+        """
+        Logs a query slower than slow_query_seconds, and records it as a
+        slow_query event with its plan, if plans are captured.
+        """
+        if (self.slow_query_seconds is None or seconds < self.slow_query_seconds):
+            return
+        record = {}
+        if (isinstance(sql, Statement)):
+            record["statement"] = sql.name
+            # Explain the prepared statement, so the plan is the one it used
+            sql = sql.execute_sql() if self.prepared else sql.sql
+        elif (isinstance(sql, Composable)):
+            sql = sql.as_string(conn)
+        record.update(sql=" ".join(sql.split()), seconds=seconds)
+        logger.warning("slow query (%.3fs): %s", seconds, record["sql"])
+        read_only = record["sql"].upper().startswith(("SELECT", "WITH", "EXECUTE"))
+        if (explain and self.explain_slow_queries and read_only):
+            record["plan"] = self._explain(conn, sql, values)
+        if (self.metrics is not None):
+            self.metrics.increment("salesdb_slow_queries_total")
+            self.metrics.event("slow_query", record)
+
+    def _explain(self, conn, sql, values):
+        """
+        Returns the EXPLAIN plan of a read query, with (ANALYZE, BUFFERS) if
+        explain_analyze is True, or None if it cannot be explained. Runs in
+        a savepoint, so a failure leaves the transaction usable.
+        """
+        explain = "EXPLAIN (ANALYZE, BUFFERS) " if self.explain_analyze else "EXPLAIN "
+        with conn.cursor() as curs:
+            curs.execute("SAVEPOINT salesdb_explain")
+            try:
+                curs.execute(explain + sql, values or None)
+                plan = "\n".join(row[0] for row in curs.fetchall())
+                curs.execute("RELEASE SAVEPOINT salesdb_explain")
+                return plan
+            except psycopg2.Error as error:
+                curs.execute("ROLLBACK TO SAVEPOINT salesdb_explain")
+                logger.warning("could not explain slow query: %s", error)
+                return None
+
+    @instrumented
     def createTable(self, name, col_names, col_types, *alter_table) -> None:
         """
         Creates a table within our database.
@@ -68,22 +366,25 @@ class SalesDB():
             col_types (list): The list of column postgres types.
             alter_table (iter|optional): A collection of table alterations.
 
+        Table and column names are quoted as identifiers. Column types and
+        table alterations are sql, and must not come from user input.
+
         Side Effects:
             Creates a permantant table within our database.
         """
-        sql = "CREATE TABLE {} (".format(name)
-        for col_name, col_type in zip(col_names[:-1], col_types[:-1]):
-            sql += col_name + " " + col_type + ", "
-        sql += col_names[-1] + " " + col_types[-1] + ")"
+        columns = SQL(", ").join(
+            SQL("{} {}").format(Identifier(col_name), SQL(col_type))
+            for col_name, col_type in zip(col_names, col_types)
+        )
         try:
-            self.execute(sql)
+            self.execute(SQL("CREATE TABLE {} ({})").format(Identifier(name), columns))
             if (alter_table):
                 for alt in alter_table:
-                    self.execute("ALTER TABLE {0} {1}".format(name, alt))
+                    self.execute(SQL("ALTER TABLE {} {}").format(Identifier(name), SQL(alt)))
         except psycopg2.errors.DuplicateTable:
-            print("DuplicateTable: relation \
-                  \"{}\" already exists".format(name))
+            logger.warning("relation \"%s\" already exists", name)
 
+    @instrumented
     def insert(self, name, col_names, values) -> None:
         """
         Inserts values into an existing table.
@@ -96,90 +397,445 @@ class SalesDB():
         Side Effects:
             Inserts a new row into the table within our database.
         """
-        sql = "INSERT INTO {0} (".format(name)
-        myformat = "("
-        for col_name in col_names[:-1]:
-            sql += "{}, ".format(col_name)
-            myformat += "%s, "
-        sql += "{}) VALUES ".format(col_names[-1])
-        myformat += "%s)"
-        sql += myformat
         try:
-            self.execute(sql,values)
+            self.execute(self._insertSQL(name, col_names), values)
+            self._touch(name, col_names, [values])
         except psycopg2.errors.UniqueViolation:
-            print("ERROR: {} record already exists".format(values))
+            logger.warning("%s record already exists in table %s", values, name)
 
+    @instrumented
     def insertCSV(self, name, filepath) -> None:
         """
-        Inserts a csv file into an existing table.
+        Inserts a csv file into an existing table, one row at a time. Each
+        row runs in its own savepoint, so a row that already exists is
+        skipped without losing the rows before it. Use copyCSV to bulk load
+        large files.
 
         Arguments:
             name (str): The table name.
             filepath (str): The filepath to the csv file.
 
         Side Effects:
-            Inserts every row from the csv file into a new row within
-            our database.
-        """
-        conn = self.connect()
-
-        file = open(filepath, "r")
-        reader = csv.reader(file)
-
-        col_names = next(reader)
-        sql = "INSERT INTO {} (".format(name)
-        myformat = "("
-        for col_name in col_names[:-1]:
-            sql += "{}, ".format(col_name)
-            myformat += "%s, "
-        sql += "{}) VALUES ".format(col_names[-1])
-        myformat += "%s)"
-        sql += myformat
-
-        curs = conn.cursor()
-        for values in reader:
-            try:
-                curs.execute(sql,values)
-            except psycopg2.errors.UniqueViolation:
-                    print("ERROR: {} record already exists in table {}".format(values,name))
-                    conn.rollback()
-        curs.close()
+            Inserts every new row from the csv file into a new row within
+            our database, in one transaction.
+        """
+        with open(filepath, "r", newline="") as file:
+            reader = csv.reader(file)
+            col_names = next(reader)
+            sql = self._insertSQL(name, col_names)
+            touched = [
+                col_name for col_name in ("date_block_num", "shop_id", "item_id")
+                if (col_name in col_names)
+            ]
+            positions = [col_names.index(col_name) for col_name in touched]
+            keys = set()
 
-        file.close()
+            with self.connection() as conn:
+                with conn:
+                    with conn.cursor() as curs:
+                        for values in reader:
+                            curs.execute("SAVEPOINT insert_row")
+                            try:
+                                curs.execute(sql, values)
+                            except psycopg2.errors.UniqueViolation:
+                                curs.execute("ROLLBACK TO SAVEPOINT insert_row")
+                                logger.warning("%s record already exists in table %s", values, name)
+                                continue
+                            curs.execute("RELEASE SAVEPOINT insert_row")
+                            keys.add(tuple(values[i] for i in positions))
 
-        conn.commit()
-        conn.close()
+        # Only rows that were committed are marked dirty
+        self._touch(name, touched, keys)
+
+    def _insertSQL(self, name, col_names):
+        """ Returns the INSERT statement of one row into a table. """
+        return SQL("INSERT INTO {} ({}) VALUES ({})").format(
+            Identifier(name),
+            SQL(", ").join(Identifier(col_name) for col_name in col_names),
+            SQL(", ").join(Placeholder() * len(col_names))
+        )
 
-    def fetch(self, sql):
+    @instrumented
+    def copyCSV(self, name, filepath, chunk_size=1 << 20):
+        """
+        Bulk loads a csv file into an existing table with COPY. The file is
+        streamed in chunks into a temporary staging table, and then merged
+        into the table, skipping rows that conflict with existing rows.
+        The sales table has no unique key, so rows equal to an existing or
+        earlier row are skipped instead, and a rerun inserts nothing. Equal
+        rows within one file are loaded once, and counted as rejected.
+
+        Arguments:
+            name (str): The table name.
+            filepath (str): The filepath to the csv file. The first line
+                must be a header of column names.
+            chunk_size (int): The number of bytes sent to the database at
+                a time.
+
+        Returns:
+            A dictionary with the number of rows read, inserted and rejected,
+            the elapsed seconds, and the throughput in rows per second.
+
+        Side Effects:
+            Inserts every new row from the csv file into the table. Nothing
+            is inserted if the file cannot be copied.
+        """
+        start = time.perf_counter()
+        with open(filepath, "r", newline="") as file:
+            col_names = next(csv.reader([file.readline()]))
+            report = self._copy(name, col_names, file, chunk_size)
+        return self._report(report, start)
+
+    @instrumented
+    def copyRows(
+            self,
+            name,
+            col_names,
+            rows,
+            on_conflict="DO NOTHING",
+            chunk_size=1 << 20
+        ):
+        """
+        Bulk loads rows into an existing table with COPY, through a staging
+        table like copyCSV.
+
+        Arguments:
+            name (str): The table name.
+            col_names (list): The list of column names.
+            rows (iter): The rows of values.
+            on_conflict (str): The conflict action of the merge, for example
+                "(shop_id, item_id) DO UPDATE SET forecast = EXCLUDED.forecast".
+                It is sql, and must not come from user input.
+            chunk_size (int): The number of bytes sent to the database at
+                a time.
+
+        Returns:
+            A dictionary with the number of rows read, inserted and rejected,
+            the elapsed seconds, and the throughput in rows per second.
+        """
+        start = time.perf_counter()
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        report = self._copy(name, col_names, buffer, chunk_size, on_conflict)
+        return self._report(report, start)
+
+    def _copy(self, name, col_names, file, chunk_size, on_conflict="DO NOTHING"):
+        """
+        Copies csv rows from a file object into a staging table, and merges
+        them into a table in one transaction.
+        """
+        table = Identifier(name)
+        staging = Identifier("{}_staging".format(name))
+        columns = SQL(", ").join(Identifier(col_name) for col_name in col_names)
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as curs:
+                    curs.execute(SQL(
+                        "CREATE TEMPORARY TABLE {0} \
+                            (LIKE {1} INCLUDING DEFAULTS) \
+                        ON COMMIT DROP").format(staging, table))
+                    curs.copy_expert(
+                        SQL("COPY {0} ({1}) FROM STDIN \
+                            WITH (FORMAT csv)").format(staging, columns),
+                        file,
+                        size=chunk_size
+                    )
+                    curs.execute(SQL("SELECT COUNT(*) FROM {}").format(staging))
+                    rows = curs.fetchone()[0]
+                    touched = []
+                    keys = []
+                    if (name == "sales"):
+                        # Pairs are only tracked to invalidate the cache
+                        touched = ["date_block_num"]
+                        if (self.cache is not None):
+                            touched += ["shop_id", "item_id"]
+                        curs.execute(SQL(
+                            "SELECT DISTINCT {0} FROM {1}").format(
+                            SQL(", ").join(map(Identifier, touched)), staging))
+                        keys = curs.fetchall()
+                    curs.execute(self._mergeSQL(name, col_names, staging, on_conflict))
+                    inserted = curs.rowcount
+        # Only rows that were committed are marked dirty
+        self._touch(name, touched, keys)
+        return {"table": name, "rows": rows, "inserted": inserted}
+
+    def _mergeSQL(self, name, col_names, staging, on_conflict):
+        """
+        Returns the INSERT statement merging a staging table into a table.
+        Rows of deduplicated tables are compared column by column, with =
+        on NOT NULL columns so the table's indexes can be used.
+        """
+        table = Identifier(name)
+        columns = SQL(", ").join(Identifier(col_name) for col_name in col_names)
+        if (name not in DEDUPLICATED):
+            return SQL(
+                "INSERT INTO {0} ({1}) \
+                SELECT {1} FROM {2} \
+                ON CONFLICT {3}").format(table, columns, staging, SQL(on_conflict))
+
+        col_types = dict(DEDUPLICATED[name].columns)
+        matches = SQL(" AND ").join(
+            SQL("existing.{0} {1} staged.{0}").format(
+                Identifier(col_name),
+                SQL("=" if ("NOT NULL" in col_types.get(col_name, "")) else "IS NOT DISTINCT FROM")
+            )
+            for col_name in col_names
+        )
+        return SQL(
+            "INSERT INTO {0} ({1}) \
+            SELECT DISTINCT {1} FROM {2} AS staged \
+            WHERE NOT EXISTS ( \
+                SELECT 1 FROM {0} AS existing \
+                WHERE {3} \
+            ) \
+            ON CONFLICT {4}").format(table, columns, staging, matches, SQL(on_conflict))
+
+    def _report(self, report, start):
+        """ Adds the rejected rows and throughput to a copy report. """
+        seconds = time.perf_counter() - start
+        report["rejected"] = report["rows"] - report["inserted"]
+        report["seconds"] = seconds
+        report["rows_per_second"] = report["rows"] / seconds if seconds > 0 else 0.0
+        return report
+
+    def _touch(self, name, col_names, rows) -> None:
+        """
+        Marks the date blocks, and the shop and item pairs within them, of
+        rows inserted into sales as dirty.
+        """
+        if (name != "sales" or "date_block_num" not in col_names):
+            return
+        col_names = list(col_names)
+        i = col_names.index("date_block_num")
+        self.dirty_blocks.update(int(row[i]) for row in rows)
+        if (self.cache is None
+                or "shop_id" not in col_names or "item_id" not in col_names):
+            return
+        j = col_names.index("shop_id")
+        k = col_names.index("item_id")
+        for row in rows:
+            self._dirty_pairs[int(row[i])].add((int(row[j]), int(row[k])))
+
+    def createRollup(self) -> None:
+        """
+        Creates the sales_monthly table, a rollup of the sales table keyed by
+        shop_id, item_id and date_block_num. Each row holds the monthly item
+        count, the max and mean item price, and the item category.
+
+        Side Effects:
+            Creates a permantant table within our database, if it does not
+            already exist.
+        """
+        self.execute(ROLLUP.create_sql())
+
+    @instrumented
+    def refreshRollup(self, date_blocks=None, full=False) -> None:
+        """
+        Refreshes the sales_monthly rollup from the sales table. Only the
+        given date blocks are re-aggregated, so a refresh after an insert
+        costs as much as the new data, not the whole table.
+
+        Arguments:
+            date_blocks (list|optional): The date blocks to refresh. If not
+                given, the date blocks touched by inserts since the last
+                refresh are refreshed.
+            full (bool): If True, rebuilds the whole rollup.
+
+        Side Effects:
+            Replaces the rollup rows of the refreshed date blocks.
+        """
+        if (full):
+            delete = "TRUNCATE sales_monthly"
+            where = ""
+            values = None
+            refreshed = set(self.dirty_blocks)
+        else:
+            if (date_blocks is None):
+                date_blocks = self.dirty_blocks
+            refreshed = set(int(block) for block in date_blocks)
+            if (not refreshed):
+                return
+            delete = "DELETE FROM sales_monthly WHERE date_block_num = ANY(%s)"
+            where = "WHERE sales.date_block_num = ANY(%s)"
+            values = (sorted(refreshed), sorted(refreshed))
+
+        self.execute(
+            "{0}; \
+            INSERT INTO sales_monthly \
+            SELECT \
+                sales.shop_id \
+                ,sales.item_id \
+                ,sales.date_block_num \
+                ,SUM(sales.item_cnt_day) \
+                ,MAX(sales.item_price) \
+                ,AVG(sales.item_price) \
+                ,MAX(items.item_category_id) \
+            FROM sales \
+            LEFT JOIN items \
+                ON sales.item_id = items.item_id \
+            {1} \
+            GROUP BY sales.shop_id, sales.item_id, sales.date_block_num".format(delete, where),
+            values
+        )
+        self.dirty_blocks -= refreshed
+
+        # Drop cached values computed from the old rollup rows
+        if (self.cache is not None):
+            if (full):
+                self.cache.clear()
+                self._dirty_pairs.clear()
+            else:
+                pairs = set()
+                for block in refreshed:
+                    pairs |= self._dirty_pairs.pop(block, set())
+                self.cache.invalidate(pairs)
+            self.checkCache(force=True)
+
+    def checkCache(self, force=False) -> None:
+        """
+        Checks the last date block of the monthly rollup, at most once every
+        cache_check_seconds. When it moved on, the cache is told the latest
+        date block of each pair with sales after the previous one, so only
+        the values of those pairs are treated as missing. Corrections to
+        date blocks already seen are dropped when this SalesDB refreshes
+        the rollup, and otherwise once the cache ttl runs out.
+
+        Arguments:
+            force (bool): If True, checks the cache even if it was checked
+                less than cache_check_seconds ago.
+        """
+        if (self.cache is None):
+            return
+        now = time.monotonic()
+        if (not force and self._cache_checked is not None
+                and now - self._cache_checked < self.cache_check_seconds):
+            return
+        self._cache_checked = now
+        previous = self.cache.last_date_block
+        last = self.getLastDateBlock()
+        latest = []
+        if (previous is not None and last is not None and last > previous):
+            latest = self.getLatestDateBlocks(previous)
+        self.cache.advance(last, latest)
+
+    @instrumented
+    def fetch(self, sql, values=None):
         """
         Fetches the query from our database, and returns the results.
 
         Arguments:
-            sql (str): The query.
+            sql (str|Composable|Statement): The query. A Statement runs as a
+                prepared statement.
+            values (list|optional): A list of values.
 
         Returns:
             list[tuples]: A list of the query results.
         """
-        conn = self.connect()
         results = None
-        with conn:
-            with conn.cursor() as curs:
-                curs.execute(sql)
-                results = curs.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor() as curs:
+                    seconds = self._execute(curs, sql, values)
+                    results = curs.fetchall()
+                self._checkSlow(conn, sql, values, seconds)
         return results
 
+    def stream(self, sql, values=None, chunk_rows=10000, dtype=None):
+        """
+        Streams the query results from our database in chunks, using a
+        server-side cursor. Only one chunk is held in memory at a time, and
+        the first chunk is yielded before the query has been read to the end.
+
+        Arguments:
+            sql (str): The query.
+            values (list|optional): A list of values.
+            chunk_rows (int): The number of rows in each chunk.
+            dtype (numpy.dtype|optional): The structured dtype of each chunk.
+                If not given, the dtype is inferred from the rows.
+
+        Yields:
+            numpy.recarray: A chunk of the query results, with one field for
+                each result column.
+        """
+        name = "salesdb_stream_{}".format(next(_cursor_ids))
+        with self.connection() as conn:
+            with conn:
+                with conn.cursor(name=name) as curs:
+                    curs.itersize = chunk_rows
+                    curs.execute(sql, values)
+                    while True:
+                        rows = curs.fetchmany(chunk_rows)
+                        if (not rows):
+                            break
+                        if (dtype is not None):
+                            yield np.array(rows, dtype=dtype).view(np.recarray)
+                        else:
+                            names = [col.name for col in curs.description]
+                            yield np.rec.fromrecords(rows, names=names)
+
+    @instrumented
     def getIds(self):
         """Gets shop and item id pairs from the sales table."""
         sql = \
             "SELECT \
                 shop_id \
                 ,item_id \
-            FROM sales \
+            FROM sales_monthly \
+            GROUP BY shop_id, item_id \
+            ORDER BY shop_id, item_id"
+        return self.fetch(sql)
+
+    @instrumented
+    def getChangedIds(self, date_blocks):
+        """
+        Gets the shop and item id pairs with sales in any of the given date
+        blocks, ordered by shop and item.
+
+        Arguments:
+            date_blocks (list): The date blocks.
+        """
+        sql = \
+            "SELECT DISTINCT \
+                shop_id \
+                ,item_id \
+            FROM sales_monthly \
+            WHERE date_block_num = ANY(%s) \
+            ORDER BY shop_id, item_id"
+        return self.fetch(sql, ([int(block) for block in date_blocks],))
+
+    @instrumented
+    def getFirstDateBlocks(self):
+        """
+        Gets the first date block with sales of every shop and item pair,
+        as (shop_id, item_id, date_block_num) rows ordered by shop and item.
+        """
+        sql = \
+            "SELECT \
+                shop_id \
+                ,item_id \
+                ,MIN(date_block_num) \
+            FROM sales_monthly \
             GROUP BY shop_id, item_id \
             ORDER BY shop_id, item_id"
         return self.fetch(sql)
 
+    def _fetchPair(self, namespace, statement, shop_id, item_id):
+        """
+        Fetches a query about a single shop and item pair, through the cache
+        if there is one.
+        """
+        values = (int(shop_id), int(item_id))
+        if (self.cache is None):
+            return self.fetch(statement, values)
+        self.checkCache()
+        results = self.cache.get(namespace, shop_id, item_id)
+        if (results is None):
+            results = self.fetch(statement, values)
+            self.cache.set(namespace, shop_id, item_id, results)
+        return results
+
+    @instrumented
     def getSalesData(self, shop_id, item_id):
         """
         Gets monthly sales data from the sales table.
@@ -191,16 +847,9 @@ class SalesDB():
         Returns:
             A list of sales data for the shop and item id pair.
         """
-        sql = \
-            "SELECT \
-                date_block_num \
-                ,SUM(item_cnt_day) as item_cnt \
-            FROM sales \
-            WHERE shop_id = {0} \
-                AND item_id = {1} \
-            GROUP BY date_block_num".format(shop_id, item_id)
-        return self.fetch(sql)
+        return self._fetchPair("sales", SALES_DATA, shop_id, item_id)
 
+    @instrumented
     def getItemPrice(self, shop_id, item_id):
         """
         Gets max item price for shop and item pair.
@@ -212,14 +861,9 @@ class SalesDB():
         Returns:
             The max price for the item.
         """
-        sql = \
-            "SELECT \
-                MAX(item_price) \
-            FROM sales \
-            WHERE shop_id = {0} \
-                AND item_id = {1}".format(shop_id, item_id)
-        return self.fetch(sql)
+        return self._fetchPair("price", ITEM_PRICE, shop_id, item_id)
 
+    @instrumented
     def getItemCategory(self, shop_id, item_id):
         """
         Gets item category id for shop and item pair.
@@ -231,20 +875,205 @@ class SalesDB():
         Returns:
             A category id.
         """
+        return self._fetchPair("category", ITEM_CATEGORY, shop_id, item_id)
+
+    @instrumented
+    def getBatchFeatures(self, pairs):
+        """
+        Gets the item category, max item price, and monthly sales data for
+        a batch of shop and item pairs in a single query.
+
+        Arguments:
+            pairs (list): A list of shop and item id pairs.
+
+        Returns:
+            A list of (idx, category id, max price, date_block_num, item_cnt)
+            rows ordered by idx and date_block_num, where idx is the position
+            of the pair in pairs. A pair without sales data has a single row
+            with a null date_block_num and item_cnt.
+        """
+        if (len(pairs) == 0):
+            return []
+        if (self.cache is None):
+            shop_ids = [int(shop_id) for shop_id, _ in pairs]
+            item_ids = [int(item_id) for _, item_id in pairs]
+            return self.fetch(BATCH_FEATURES, (shop_ids, item_ids))
+
+        # Only fetch the pairs missing from the cache
+        self.checkCache()
+        cached = {}
+        missing = []
+        for i, (shop_id, item_id) in enumerate(pairs):
+            rows = self.cache.get("features", shop_id, item_id)
+            if (rows is None):
+                missing.append(i)
+            else:
+                cached[i] = rows
+        if (missing):
+            shop_ids = [int(pairs[i][0]) for i in missing]
+            item_ids = [int(pairs[i][1]) for i in missing]
+            for idx, *row in self.fetch(BATCH_FEATURES, (shop_ids, item_ids)):
+                cached.setdefault(missing[idx], []).append(tuple(row))
+            for i in missing:
+                rows = cached.get(i, [])
+                blocks = [row[2] for row in rows if row[2] is not None]
+                self.cache.set(
+                    "features", *pairs[i], rows, date_block=max(blocks, default=None))
+
+        results = []
+        for i in range(len(pairs)):
+            results.extend((i,) + row for row in cached.get(i, []))
+        return results
+
+    def getStatementStats(self):
+        """
+        Gets the prepares, executions and reuse of each prepared statement.
+        With prepared statements on, the generic and custom plan counts of
+        one pooled connection are added, from pg_prepared_statements.
+
+        Returns:
+            A dictionary of statistics keyed by statement name.
+        """
+        stats = self.statements.stats()
+        if (self.prepared):
+            with self.connection() as conn:
+                with conn:
+                    plans = self.statements.plans(conn)
+            for name, plan in plans.items():
+                stats[name].update(plan)
+        return stats
+
+    @instrumented
+    def getFingerprint(self):
+        """
+        Gets a fingerprint of the monthly rollup, which changes whenever the
+        rollup is refreshed with new or changed sales data.
+
+        Returns:
+            A string of the row count, last date block and total item count.
+        """
         sql = \
-            "SELECT DISTINCT \
-                items.item_category_id \
-            FROM sales \
-            LEFT JOIN items \
-                ON sales.item_id = items.item_id \
-            WHERE sales.shop_id = {0} \
-                AND sales.item_id = {1}".format(shop_id, item_id)
-        return self.fetch(sql)
+            "SELECT \
+                COUNT(*) \
+                ,MAX(date_block_num) \
+                ,SUM(item_cnt) \
+            FROM sales_monthly"
+        return ":".join(str(value) for value in self.fetch(sql)[0])
+
+    @instrumented
+    def getLastDateBlock(self):
+        """ Gets the last date block of the monthly rollup. """
+        sql = \
+            "SELECT \
+                MAX(date_block_num) \
+            FROM sales_monthly"
+        return self.fetch(sql)[0][0]
+
+    @instrumented
+    def getLatestDateBlocks(self, date_block):
+        """
+        Gets the latest date block of each shop and item pair with sales
+        after a date block.
 
+        Arguments:
+            date_block (int): The date block.
+
+        Returns:
+            A list of (shop_id, item_id, date_block_num) rows.
+        """
+        sql = \
+            "SELECT \
+                shop_id \
+                ,item_id \
+                ,MAX(date_block_num) \
+            FROM sales_monthly \
+            WHERE date_block_num > %s \
+            GROUP BY shop_id, item_id"
+        return self.fetch(sql, (int(date_block),))
+
+    @instrumented
     def getPrices(self):
         """ Gets all item prices from sales table. """
         sql = \
             "SELECT DISTINCT \
                 item_price \
             FROM sales"
-        return self.fetch(sql)
\ No newline at end of file
+        return self.fetch(sql)
+
+    @instrumented
+    def getPriceQuantiles(self, quantiles, pairs=None):
+        """
+        Gets exact quantiles of the max item price of each shop and item
+        pair, computed in the database with percentile_disc, so only the
+        quantiles are sent back.
+
+        Arguments:
+            quantiles (list): The quantiles, each between 0 and 1.
+            pairs (list|optional): The shop and item id pairs to include.
+                Defaults to every pair in the monthly rollup.
+
+        Returns:
+            A list of prices, one for each quantile.
+        """
+        join = ""
+        values = [[float(q) for q in quantiles]]
+        if (pairs is not None):
+            join = \
+                "JOIN unnest(%s::integer[], %s::integer[]) AS pairs(shop_id, item_id) \
+                    ON monthly.shop_id = pairs.shop_id \
+                    AND monthly.item_id = pairs.item_id"
+            values.append([int(shop_id) for shop_id, _ in pairs])
+            values.append([int(item_id) for _, item_id in pairs])
+        sql = \
+            "SELECT \
+                percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY price) \
+            FROM ( \
+                SELECT \
+                    MAX(monthly.max_price) AS price \
+                FROM sales_monthly AS monthly \
+                {} \
+                GROUP BY monthly.shop_id, monthly.item_id \
+            ) AS prices".format(join)
+        results = self.fetch(sql, values)[0][0]
+        return [None if price is None else float(price) for price in results or []]
+
+    def streamIds(self, chunk_rows=10000, after=None):
+        """
+        Streams shop and item id pairs from the monthly rollup.
+
+        Arguments:
+            chunk_rows (int): The number of pairs in each chunk.
+            after (tuple|optional): If given, only pairs ordered after this
+                shop and item id pair are streamed.
+
+        Yields:
+            numpy.recarray: A chunk of pairs with shop_id and item_id fields.
+        """
+        where = ""
+        values = None
+        if (after is not None):
+            where = "WHERE (shop_id, item_id) > (%s, %s)"
+            values = (int(after[0]), int(after[1]))
+        sql = \
+            "SELECT DISTINCT \
+                shop_id \
+                ,item_id \
+            FROM sales_monthly \
+            {} \
+            ORDER BY shop_id, item_id".format(where)
+        dtype = [("shop_id", "int32"), ("item_id", "int32")]
+        return self.stream(sql, values, chunk_rows=chunk_rows, dtype=dtype)
+
+    def streamPrices(self, chunk_rows=100000):
+        """
+        Streams all item prices from sales table.
+
+        Yields:
+            numpy.recarray: A chunk of prices with an item_price field.
+        """
+        sql = \
+            "SELECT DISTINCT \
+                item_price::real \
+            FROM sales"
+        dtype = [("item_price", "float32")]
+        return self.stream(sql, chunk_rows=chunk_rows, dtype=dtype)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+
+# Bumped whenever the layout of cached features changes
+CACHE_VERSION = 3
+
+
+def file_fingerprint(*paths, hash_contents=False):
+    """
+    Returns a fingerprint of source files, which changes when any of the
+    files change.
+
+    Args:
+        paths: The filepaths of the source files.
+        hash_contents: If True, the fingerprint is a hash of the file
+            contents. Otherwise, it is built from the file sizes and
+            modification times, which is much faster for large files.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(os.path.abspath(path).encode())
+        if (hash_contents):
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(chunk)
+        else:
+            digest.update('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+class FeatureCache():
+
+    """
+    FeatureCache stores feature arrays on disk as .npy files, and opens them
+    again as read-only memory maps. Each entry is keyed by a hash of the
+    source data fingerprint and the parameters used to build the features,
+    so a change to either misses the cache and triggers a rebuild. Each cache
+    directory holds the features of a single source.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Args:
+            cache_dir: The directory holding the cache entries.
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, fingerprint, **params):
+        """
+        Returns the cache key of features built from a source with the given
+        fingerprint and parameters.
+        """
+        payload = json.dumps(
+            {'version': CACHE_VERSION, 'fingerprint': fingerprint, 'params': params},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    def path(self, key):
+        """ Returns the directory of a cache entry. """
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """
+        Opens a cache entry.
+
+        Returns:
+            A dictionary of memory mapped arrays, or None if the entry does
+            not exist.
+        """
+        path = self.path(key)
+        meta_path = os.path.join(path, 'meta.json')
+        if (not os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as file:
+            meta = json.load(file)
+        if (meta.get('version') != CACHE_VERSION):
+            return None
+        return {
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in meta['arrays']
+        }
+
+    def save(self, key, features, fingerprint=None, prune=True):
+        """
+        Writes a cache entry. The entry is written to a temporary directory
+        and renamed into place, so readers never see a partial entry.
+
+        Args:
+            key: The cache key.
+            features: A dictionary of arrays.
+            fingerprint: The fingerprint of the source data.
+            prune: If True, removes entries built from other versions of
+                the source, which can no longer be hit.
+        """
+        path = self.path(key)
+        tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        for name, array in features.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array))
+        meta = {
+            'version': CACHE_VERSION,
+            'key': key,
+            'fingerprint': fingerprint,
+            'arrays': sorted(features),
+            'shapes': {name: list(np.shape(array)) for name, array in features.items()}
+        }
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process wrote the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        if (prune and fingerprint is not None):
+            self.prune(fingerprint)
+
+    def prune(self, fingerprint):
+        """ Removes entries whose source fingerprint differs. """
+        for name in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, name, 'meta.json')
+            if (not os.path.exists(meta_path)):
+                continue
+            with open(meta_path) as file:
+                meta = json.load(file)
+            if (meta.get('fingerprint') != fingerprint):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def get_or_build(self, build, fingerprint, **params):
+        """
+        Opens the cache entry for a source fingerprint and parameters,
+        building and writing it first if it does not exist.
+
+        Args:
+            build: A function that returns a dictionary of feature arrays.
+            fingerprint: The fingerprint of the source data.
+            params: The parameters used to build the features.
+
+        Returns:
+            A dictionary of memory mapped arrays.
+        """
+        key = self.key(fingerprint, **params)
+        features = self.load(key)
+        if (features is None):
+            self.save(key, build(), fingerprint=fingerprint)
+            features = self.load(key)
+        return features
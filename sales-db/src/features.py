@@ -0,0 +1,190 @@
+import numpy as np
+
+
+def _column(values, dtype, fill=0):
+    """ Converts a column of query results into an array. """
+    return np.array([fill if v is None else v for v in values], dtype=dtype)
+
+
+def compact_batch(rows, num_samples, seq_len, targets=True):
+    """
+    Builds the compact features of a batch from the rows returned by
+    SalesDB.getBatchFeatures. Sequences are stored sparsely: the months with
+    sales of the i'th sample are date_blocks[offsets[i]:offsets[i + 1]],
+    and their item counts are counts[offsets[i]:offsets[i + 1]].
+
+    Args:
+        rows: A list of (idx, category id, price, date_block_num, item_cnt)
+            rows ordered by idx and date_block_num.
+        num_samples: The number of samples in the batch.
+        seq_len: The length of each sequence of monthly sales data. Months
+            past the end of the sequence are dropped.
+        targets: If True, the last month of each sample is used as its
+            target instead of being added to its sequence.
+
+    Returns:
+        A dictionary of categories, prices, offsets, date_blocks, counts
+        and targets arrays.
+    """
+    features = {
+        'categories': np.zeros(num_samples, dtype='int32'),
+        'prices': np.zeros(num_samples, dtype='float32'),
+        'offsets': np.zeros(num_samples + 1, dtype='int64'),
+        'date_blocks': np.zeros(0, dtype='int16'),
+        'counts': np.zeros(0, dtype='float32'),
+        'targets': np.zeros(num_samples, dtype='float32')
+    }
+    if (len(rows) == 0):
+        return features
+
+    idx, categories, prices, date_blocks, item_cnts = zip(*rows)
+    idx = np.array(idx, dtype='int64')
+    date_blocks = _column(date_blocks, 'int64', fill=-1)
+    item_cnts = _column(item_cnts, 'float32')
+
+    # Rows are ordered by idx, so each sample starts where idx changes
+    first = np.ones(len(idx), dtype=bool)
+    first[1:] = idx[1:] != idx[:-1]
+    last = np.ones(len(idx), dtype=bool)
+    last[:-1] = first[1:]
+
+    features['categories'][idx[first]] = _column(categories, 'int32')[first]
+    features['prices'][idx[first]] = _column(prices, 'float32')[first]
+
+    has_sales = date_blocks >= 0
+    if (targets):
+        target = has_sales & last
+        features['targets'][idx[target]] = item_cnts[target]
+        has_sales &= ~last
+    month = has_sales & (date_blocks < seq_len)
+    features['offsets'][1:] = np.cumsum(np.bincount(idx[month], minlength=num_samples))
+    features['date_blocks'] = date_blocks[month].astype('int16')
+    features['counts'] = item_cnts[month]
+    return features
+
+
+def expand_sequences(features, rows, seq_len):
+    """
+    Expands the compact sequences of the given feature rows into dense
+    (len(rows), seq_len, 12) one-hot month arrays.
+    """
+    rows = np.asarray(rows, dtype='int64')
+    offsets = features['offsets']
+    starts = np.asarray(offsets[rows], dtype='int64')
+    lengths = np.asarray(offsets[rows + 1], dtype='int64') - starts
+    sequences = np.zeros((len(rows), seq_len, 12), dtype='float32')
+    total = int(lengths.sum())
+    if (total == 0):
+        return sequences
+
+    # The position of every entry of the batch in the compact arrays
+    samples = np.repeat(np.arange(len(rows)), lengths)
+    batch_starts = np.cumsum(lengths) - lengths
+    entries = np.arange(total) - np.repeat(batch_starts - starts, lengths)
+    date_blocks = np.asarray(features['date_blocks'][entries], dtype='int64')
+    keep = date_blocks < seq_len
+    sequences[
+        samples[keep], date_blocks[keep], date_blocks[keep] % 12
+    ] = features['counts'][entries][keep]
+    return sequences
+
+
+def gather_batch(features, rows, seq_len):
+    """
+    Gathers a batch of model inputs and targets from compact features,
+    expanding only the batch's sequences.
+    """
+    x_batch = {
+        'categories': features['categories'][rows],
+        'prices': features['prices'][rows],
+        'sequences': expand_sequences(features, rows, seq_len)
+    }
+    return x_batch, features['targets'][rows]
+
+
+def fill_batch(rows, num_samples, seq_len, targets=True):
+    """
+    Fills a batch of model inputs from the rows returned by
+    SalesDB.getBatchFeatures.
+
+    Args:
+        rows: A list of (idx, category id, price, date_block_num, item_cnt)
+            rows ordered by idx and date_block_num.
+        num_samples: The number of samples in the batch.
+        seq_len: The length of each sequence of monthly sales data. Months
+            past the end of the sequence are dropped.
+        targets: If True, the last month of each sample is used as its
+            target instead of being added to its sequence.
+
+    Returns:
+        A dictionary of categories, prices and sequences, and an array of
+        targets.
+    """
+    features = compact_batch(rows, num_samples, seq_len, targets)
+    x_batch, y_batch = gather_batch(features, np.arange(num_samples), seq_len)
+    return x_batch, y_batch.astype('float64')
+
+
+def build_features(sales_db, ids, seq_len, chunk_size=4096, targets=True):
+    """
+    Builds the compact features of every shop and item id pair, fetching
+    them from the database one chunk of pairs at a time.
+
+    Args:
+        sales_db: The SalesDB instance.
+        ids: A list of shop and item id pairs.
+        seq_len: The length of each sequence of monthly sales data.
+        chunk_size: The number of pairs fetched in each query.
+        targets: If True, the last month of each pair is its target.
+            Otherwise, every month is added to its sequence, as needed to
+            forecast the month after.
+
+    Returns:
+        A dictionary of ids, categories, prices, offsets, date_blocks,
+        counts and targets arrays, with one row for each pair sorted by shop
+        and item id. Use gather_batch to get dense model inputs.
+    """
+    ids = sorted((int(shop_id), int(item_id)) for shop_id, item_id in ids)
+    chunks = []
+    for low in range(0, len(ids), chunk_size):
+        high = min(low + chunk_size, len(ids))
+        rows = sales_db.getBatchFeatures(ids[low:high])
+        chunks.append(compact_batch(rows, high - low, seq_len, targets))
+    return concat_features(chunks, ids=np.array(ids, dtype='int32').reshape(-1, 2))
+
+
+def concat_features(chunks, **arrays):
+    """
+    Concatenates the compact features of consecutive chunks of samples.
+
+    Args:
+        chunks: A list of compact feature dictionaries.
+        arrays: Extra arrays added to the result as they are.
+    """
+    features = dict(arrays)
+    if (not chunks):
+        chunks = [compact_batch([], 0, 0)]
+    for name in ('categories', 'prices', 'date_blocks', 'counts', 'targets'):
+        features[name] = np.concatenate([chunk[name] for chunk in chunks])
+    # Shift the offsets of each chunk past the entries of earlier chunks
+    offsets = [np.zeros(1, dtype='int64')]
+    for chunk in chunks:
+        offsets.append(chunk['offsets'][1:] + offsets[-1][-1])
+    features['offsets'] = np.concatenate(offsets)
+    return features
+
+
+def lookup_rows(feature_ids, ids):
+    """
+    Returns the rows of feature_ids, sorted by shop and item id, that hold
+    each shop and item id pair in ids.
+    """
+    feature_ids = np.asarray(feature_ids, dtype='int64')
+    ids = np.asarray(ids, dtype='int64').reshape(-1, 2)
+    feature_keys = (feature_ids[:, 0] << 32) | feature_ids[:, 1]
+    keys = (ids[:, 0] << 32) | ids[:, 1]
+    rows = np.searchsorted(feature_keys, keys)
+    rows = np.minimum(rows, max(len(feature_keys) - 1, 0))
+    if (len(keys) and (len(feature_keys) == 0 or np.any(feature_keys[rows] != keys))):
+        raise KeyError('shop and item id pairs are missing from the features')
+    return rows
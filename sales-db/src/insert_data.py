@@ -11,11 +11,18 @@ PASSWORD = os.getenv("POSTGRES_PASSWORD")
 # Create SalesDB instance
 db = SalesDB(USER,PASSWORD)
 
-# Insert the needed csv files into the database
-db.insertCSV("itemcategories", os.path.join(DATA_DIR,"item_categories.csv"))
-
-db.insertCSV("shops", os.path.join(DATA_DIR,"shops.csv"))
-
-db.insertCSV( "items", os.path.join(DATA_DIR,"items.csv"))
-
-db.insertCSV("sales", os.path.join(DATA_DIR,"sales_train.csv"))
\ No newline at end of file
+# Bulk load the needed csv files into the database
+tables = [
+    ("itemcategories", "item_categories.csv"),
+    ("shops", "shops.csv"),
+    ("items", "items.csv"),
+    ("sales", "sales_train.csv")
+]
+for name, filename in tables:
+    report = db.copyCSV(name, os.path.join(DATA_DIR,filename))
+    print(
+        "{table}: {inserted} of {rows} rows inserted, {rejected} rejected "
+        "({seconds:.1f}s, {rows_per_second:.0f} rows/s)".format(**report)
+    )
+# Aggregate the loaded date blocks into the monthly rollup
+db.refreshRollup()
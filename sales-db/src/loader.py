@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# The dataset of a process worker, set once by _init_process
+_dataset = None
+
+
+def _init_process(dataset):
+    """ Stores the dataset of a process worker. """
+    global _dataset
+    _dataset = dataset
+
+
+def _load(dataset, idx):
+    """ Loads a batch, and returns it with the worker name and load time. """
+    start = time.perf_counter()
+    batch = dataset[idx]
+    seconds = time.perf_counter() - start
+    if (dataset is _dataset):
+        worker = 'process-{}'.format(os.getpid())
+    else:
+        worker = threading.current_thread().name
+    return batch, worker, seconds
+
+
+def _load_in_process(idx):
+    """ Loads a batch from the dataset of a process worker. """
+    return _load(_dataset, idx)
+
+
+class PrefetchLoader():
+
+    """
+    PrefetchLoader loads the batches of a dataset with a pool of thread or
+    process workers, and yields them in order. Up to max_queue_size upcoming
+    batches are loaded ahead of the consumer, so training does not wait on
+    the database between batches.
+
+    Thread workers share the dataset, and each checks out its own connection
+    from the dataset's SalesDB pool, so the pool should allow at least as
+    many connections as there are workers. Process workers each receive a
+    copy of the dataset, whose SalesDB opens its own connections.
+    """
+
+    def __init__(
+            self,
+            dataset,
+            workers=4,
+            use_multiprocessing=False,
+            max_queue_size=8
+        ):
+        """
+        Args:
+            dataset: A dataset with __len__ and __getitem__, such as a
+                DataGenerator.
+            workers: The number of workers loading batches.
+            use_multiprocessing: If True, the workers are processes.
+                Otherwise, the workers are threads.
+            max_queue_size: The maximum number of batches loaded ahead of
+                the consumer.
+        """
+        self.dataset = dataset
+        self.workers = workers
+        self.use_multiprocessing = use_multiprocessing
+        self.max_queue_size = max(max_queue_size, 1)
+        self._executor = None
+        self._timings = collections.defaultdict(list)
+        self._wait_seconds = 0.0
+
+    def __len__(self):
+        """ Returns the number of batches in an epoch. """
+        return len(self.dataset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit(self, idx):
+        """ Schedules the idx'th batch on the worker pool. """
+        if (self._executor is None):
+            if (self.use_multiprocessing):
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    initializer=_init_process,
+                    initargs=(self.dataset,)
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.workers,
+                    thread_name_prefix='loader'
+                )
+        if (self.use_multiprocessing):
+            return self._executor.submit(_load_in_process, idx)
+        return self._executor.submit(_load, self.dataset, idx)
+
+    def __iter__(self):
+        """ Yields every batch of the dataset in order, for one epoch. """
+        num_batches = len(self.dataset)
+        queue = collections.deque()
+        next_idx = 0
+        try:
+            while (queue or next_idx < num_batches):
+                # Keep the prefetch queue full
+                while (next_idx < num_batches and len(queue) < self.max_queue_size):
+                    queue.append(self._submit(next_idx))
+                    next_idx += 1
+
+                start = time.perf_counter()
+                batch, worker, seconds = queue.popleft().result()
+                self._wait_seconds += time.perf_counter() - start
+                self._timings[worker].append(seconds)
+                yield batch
+        finally:
+            for future in queue:
+                future.cancel()
+
+    def stats(self):
+        """
+        Returns the load time of each worker, and the total time the consumer
+        waited for batches.
+        """
+        workers = {}
+        for worker, timings in sorted(self._timings.items()):
+            workers[worker] = {
+                'batches': len(timings),
+                'total_seconds': sum(timings),
+                'mean_seconds': sum(timings) / len(timings),
+                'max_seconds': max(timings)
+            }
+        return {
+            'workers': workers,
+            'batches': sum(len(timings) for timings in self._timings.values()),
+            'wait_seconds': self._wait_seconds
+        }
+
+    def close(self):
+        """ Shuts down the workers. """
+        if (self._executor is not None):
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+import collections
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _key(name, labels):
+    """ Returns the hashable key of a metric and its labels. """
+    return name, tuple(sorted((labels or {}).items()))
+
+
+class MetricsSink():
+
+    """
+    MetricsSink is the interface of the metrics sinks. Latencies are
+    observed into histograms, counts are added to counters, and events, such
+    as slow queries, are recorded as they happen. The base sink drops
+    everything.
+    """
+
+    def observe(self, name, value, labels=None):
+        """ Observes a value, such as a latency, into a histogram. """
+
+    def increment(self, name, value=1, labels=None):
+        """ Adds a value to a counter. """
+
+    def event(self, name, record):
+        """ Records an event, a dictionary of details. """
+
+
+class Histogram():
+
+    """ Histogram counts observed values in cumulative buckets. """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket holding the q'th quantile. """
+        if (self.count == 0):
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            if (total >= rank):
+                return bound
+        return float('inf')
+
+
+class InMemorySink(MetricsSink):
+
+    """
+    InMemorySink keeps histograms, counters and the latest events in
+    memory, to be read with snapshot.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, max_events=1000):
+        """
+        Args:
+            buckets: The upper bounds of the histogram buckets.
+            max_events: The number of latest events kept.
+        """
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = collections.defaultdict(float)
+        self.events = collections.deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels=None):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if (histogram is None):
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, name, value=1, labels=None):
+        with self._lock:
+            self.counters[_key(name, labels)] += value
+
+    def event(self, name, record):
+        with self._lock:
+            self.events.append(dict(record, event=name, time=time.time()))
+
+    def snapshot(self):
+        """
+        Returns the histograms, counters and events as a dictionary that can
+        be serialized to JSON.
+        """
+        with self._lock:
+            return {
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'p50': histogram.quantile(0.5),
+                        'p95': histogram.quantile(0.95),
+                        'p99': histogram.quantile(0.99)
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'events': list(self.events)
+            }
+
+
+class PrometheusSink(InMemorySink):
+
+    """
+    PrometheusSink keeps metrics in memory like InMemorySink, and renders
+    them in the Prometheus text exposition format.
+    """
+
+    @staticmethod
+    def _labels(labels, **extra):
+        items = list(labels) + list(extra.items())
+        if (not items):
+            return ''
+        return '{' + ','.join(
+            '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in items
+        ) + '}'
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text format. """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if (name not in typed):
+                lines.append('# TYPE {} histogram'.format(name))
+                typed.add(name)
+            total = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{} {}'.format(name, self._labels(labels, le=le), total))
+            lines.append('{}_sum{} {}'.format(name, self._labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(name, self._labels(labels), histogram.count))
+        for (name, labels), value in counters:
+            if (name not in typed):
+                lines.append('# TYPE {} counter'.format(name))
+                typed.add(name)
+            lines.append('{}{} {}'.format(name, self._labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ Writes the metrics to a file, for the node exporter textfile collector. """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class JSONLinesSink(MetricsSink):
+
+    """
+    JSONLinesSink appends every observation, counter increment and event to
+    a file as one JSON object per line.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: The filepath the lines are appended to.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1)
+
+    def _write(self, record):
+        line = json.dumps(dict(record, time=time.time()), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def observe(self, name, value, labels=None):
+        self._write({'type': 'observe', 'name': name, 'labels': labels or {}, 'value': value})
+
+    def increment(self, name, value=1, labels=None):
+        self._write({'type': 'increment', 'name': name, 'labels': labels or {}, 'value': value})
+
+    def event(self, name, record):
+        self._write({'type': 'event', 'name': name, 'record': record})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class MultiSink(MetricsSink):
+
+    """ MultiSink forwards everything to several sinks. """
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def observe(self, name, value, labels=None):
+        for sink in self.sinks:
+            sink.observe(name, value, labels)
+
+    def increment(self, name, value=1, labels=None):
+        for sink in self.sinks:
+            sink.increment(name, value, labels)
+
+    def event(self, name, record):
+        for sink in self.sinks:
+            sink.event(name, record)
+
+
+# The instrumented calls in progress on each thread
+_instrumenting = threading.local()
+
+
+def instrumented(method):
+    """
+    Decorates a SalesDB method, so each call observes its latency in the
+    salesdb_method_seconds histogram, and counts its calls, errors and
+    returned rows, if the instance has a metrics sink. Only the outermost
+    instrumented call is recorded, so a getter and the fetch it runs are
+    counted once, under the getter.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if (metrics is None or getattr(_instrumenting, 'active', False)):
+            return method(self, *args, **kwargs)
+        labels = {'method': method.__name__}
+        start = time.perf_counter()
+        _instrumenting.active = True
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception:
+            metrics.increment('salesdb_errors_total', 1, labels)
+            raise
+        finally:
+            _instrumenting.active = False
+            metrics.observe('salesdb_method_seconds', time.perf_counter() - start, labels)
+            metrics.increment('salesdb_calls_total', 1, labels)
+        if (isinstance(result, dict) and 'rows' in result):
+            metrics.increment('salesdb_rows_total', result['rows'], labels)
+        elif (isinstance(result, list)):
+            metrics.increment('salesdb_rows_total', len(result), labels)
+        return result
+    return wrapper
+
+
+def batch_timer(metrics, generator):
+    """
+    Returns a DataGenerator on_batch hook that observes the latency of each
+    batch in the generator_batch_seconds histogram, and counts samples.
+
+    Args:
+        metrics: The metrics sink.
+        generator: The label of the data generator, for example "sales-db".
+    """
+    def on_batch(idx, num_samples, seconds, source):
+        labels = {'generator': generator, 'source': source}
+        metrics.observe('generator_batch_seconds', seconds, labels)
+        metrics.increment('generator_samples_total', num_samples, labels)
+    return on_batch
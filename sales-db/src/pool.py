@@ -0,0 +1,238 @@
+import time
+import threading
+import psycopg2
+
+
+class PoolError(Exception):
+    """ Raised when a connection cannot be checked out of the pool. """
+
+
+class ConnectionPool():
+    """
+    ConnectionPool is a thread-safe pool of psycopg2 connections. Connections
+    are checked out with a context manager, health checked on checkout, and
+    closed once they have been idle for longer than the idle timeout.
+    """
+    def __init__(
+            self,
+            connect,
+            min_size=1,
+            max_size=8,
+            idle_timeout=300.0,
+            checkout_timeout=30.0,
+            health_check=True
+        ) -> None:
+        """
+        Arguments:
+            connect (callable): A function that returns a new connection.
+            min_size (int): The number of connections kept open while idle.
+            max_size (int): The maximum number of open connections.
+            idle_timeout (float): The number of seconds an idle connection
+                is kept open, before it is closed. Connections below
+                min_size are never closed for being idle.
+            checkout_timeout (float): The number of seconds to wait for a
+                free connection, before raising a PoolError.
+            health_check (bool): If True, runs a cheap query on every
+                connection before it is handed out.
+        """
+        if (min_size < 0 or max_size < 1 or min_size > max_size):
+            raise ValueError(
+                "invalid pool size: min_size={} max_size={}".format(
+                    min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check = health_check
+
+        # Idle connections and the time they were returned to the pool
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def size(self):
+        """ The number of open connections, idle or checked out. """
+        return self._size
+
+    def _healthy(self, conn):
+        """ Returns True if the connection can still be used. """
+        if (conn.closed):
+            return False
+        if (not self.health_check):
+            return True
+        try:
+            with conn.cursor() as curs:
+                curs.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        """ Closes a connection, and frees its slot in the pool. """
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _prune(self):
+        """
+        Closes connections that have been idle for longer than the idle
+        timeout, while keeping at least min_size connections open. Must be
+        called while holding the lock.
+        """
+        now = time.monotonic()
+        expired = []
+        keep = []
+        # Oldest connections come first, so they are closed first
+        for conn, since in self._idle:
+            if (self._size - len(expired) > self.min_size
+                    and now - since > self.idle_timeout):
+                expired.append(conn)
+            else:
+                keep.append((conn, since))
+        self._idle = keep
+        self._size -= len(expired)
+        return expired
+
+    def getconn(self):
+        """
+        Checks out a healthy connection from the pool, opening a new one
+        if no idle connection is free and the pool is not full.
+
+        Returns:
+            A psycopg2.connection object.
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                if (self._closed):
+                    raise PoolError("connection pool is closed")
+                expired = self._prune()
+                conn = None
+                if (self._idle):
+                    # Reuse the most recently returned connection
+                    conn, _ = self._idle.pop()
+                elif (self._size < self.max_size):
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if (remaining <= 0):
+                        raise PoolError(
+                            "timed out waiting for a connection after "
+                            "{}s".format(self.checkout_timeout))
+                    self._cond.wait(remaining)
+                    continue
+            for old in expired:
+                old.close()
+
+            if (conn is None):
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            if (self._healthy(conn)):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn):
+        """
+        Returns a connection to the pool. Any open transaction is rolled
+        back, and broken connections are closed.
+
+        Arguments:
+            conn: A connection checked out with getconn.
+        """
+        if (not conn.closed):
+            try:
+                if (conn.status != psycopg2.extensions.STATUS_READY):
+                    conn.rollback()
+            except psycopg2.Error:
+                pass
+        if (conn.closed or self._closed):
+            self._discard(conn)
+            return
+        with self._cond:
+            if (self._size <= self.max_size):
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+        # The pool was shrunk while the connection was checked out
+        self._discard(conn)
+
+    def resize(self, max_size):
+        """
+        Changes the maximum number of open connections. Growing the pool
+        wakes checkouts waiting for a free connection. Shrinking it closes
+        idle connections over the new maximum, and checked out connections
+        are closed as they are returned.
+
+        Arguments:
+            max_size (int): The maximum number of open connections.
+        """
+        with self._cond:
+            if (max_size < 1 or self.min_size > max_size):
+                raise ValueError(
+                    "invalid pool size: min_size={} max_size={}".format(
+                        self.min_size, max_size))
+            self.max_size = max_size
+            # The oldest idle connections come first, so they are closed first
+            excess = max(min(self._size - max_size, len(self._idle)), 0)
+            closed = [conn for conn, _ in self._idle[:excess]]
+            self._idle = self._idle[excess:]
+            self._size -= excess
+            self._cond.notify_all()
+        for conn in closed:
+            conn.close()
+
+    def connection(self):
+        """
+        Returns a context manager that checks out a connection and returns
+        it to the pool on exit.
+        """
+        return _PooledConnection(self)
+
+    def close(self):
+        """ Closes every idle connection, and refuses new checkouts. """
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+
+class _PooledConnection():
+    """ Context manager returned by ConnectionPool.connection. """
+    def __init__(self, pool) -> None:
+        self.pool = pool
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.getconn()
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.putconn(self.conn)
+        self.conn = None
@@ -0,0 +1,142 @@
+import os
+import json
+import numpy as np
+
+
+"""
+Price bin boundaries for the Discretization layer. A QuantileSketch
+summarizes a stream of values chunk by chunk in a fixed number of weighted
+points, so boundaries can be estimated without holding every price in
+memory, and sketches of separate streams can be merged. Boundaries are
+cached as JSON alongside the preprocessing config they were computed for.
+"""
+
+
+def quantile_levels(num_bins):
+    """ Returns the num_bins - 1 quantiles that split values into num_bins bins. """
+    if (num_bins < 2):
+        raise ValueError('num_bins must be at least 2, got {}'.format(num_bins))
+    return np.arange(1, num_bins) / num_bins
+
+
+class QuantileSketch():
+
+    """
+    QuantileSketch is a mergeable summary of a stream of values. It keeps
+    at most capacity weighted points; when it grows past capacity, adjacent
+    points are merged into groups of equal total weight. Quantile estimates
+    are within about 1 / capacity of the true rank.
+    """
+
+    def __init__(self, capacity=2048):
+        """
+        Args:
+            capacity: The number of weighted points kept.
+        """
+        self.capacity = capacity
+        self.values = np.empty(0, dtype='float64')
+        self.weights = np.empty(0, dtype='float64')
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        """ The number of values summarized. """
+        return float(self.weights.sum())
+
+    def update(self, values):
+        """ Adds a chunk of values to the sketch. NaN values are ignored. """
+        values = np.asarray(values, dtype='float64').ravel()
+        values = values[~np.isnan(values)]
+        if (len(values) == 0):
+            return self
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        return self._add(values, np.ones(len(values)))
+
+    def merge(self, other):
+        """ Adds the values summarized by another sketch to this one. """
+        if (len(other.values) == 0):
+            return self
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self._add(other.values, other.weights)
+
+    def _add(self, values, weights):
+        values = np.concatenate([self.values, values])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        weights = weights[order]
+        if (len(values) > self.capacity):
+            # Group adjacent points by the rank of their midpoint, and keep
+            # each group's weighted mean value and total weight
+            cumulative = np.cumsum(weights)
+            total = cumulative[-1]
+            groups = np.minimum(
+                ((cumulative - weights / 2) / total * self.capacity).astype('int64'),
+                self.capacity - 1
+            )
+            starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+            weight_sums = np.add.reduceat(weights, starts)
+            values = np.add.reduceat(values * weights, starts) / weight_sums
+            weights = weight_sums
+        self.values = values
+        self.weights = weights
+        return self
+
+    def quantiles(self, levels):
+        """
+        Returns estimates of the given quantiles, each between 0 and 1.
+        """
+        levels = np.asarray(levels, dtype='float64')
+        if (len(self.values) == 0):
+            return np.full(levels.shape, np.nan)
+        cumulative = np.cumsum(self.weights)
+        midpoints = cumulative - self.weights / 2
+        ranks = levels * cumulative[-1]
+        # The ends are pinned to the exact min and max
+        return np.interp(
+            ranks,
+            np.r_[0.0, midpoints, cumulative[-1]],
+            np.r_[self.min, self.values, self.max]
+        )
+
+    def boundaries(self, num_bins):
+        """ Returns the num_bins - 1 bin boundaries of the summarized values. """
+        return self.quantiles(quantile_levels(num_bins)).tolist()
+
+
+def sketch_chunks(chunks, capacity=2048):
+    """ Returns a QuantileSketch of every value in an iterable of chunks. """
+    sketch = QuantileSketch(capacity)
+    for chunk in chunks:
+        sketch.update(chunk)
+    return sketch
+
+
+def load_boundaries(path, **config):
+    """
+    Returns the bin boundaries cached in a preprocessing config file, or
+    None if the file is missing or was written for a different config.
+    """
+    if (not os.path.exists(path)):
+        return None
+    with open(path) as file:
+        cached = json.load(file)
+    if (any(cached.get(name) != value for name, value in config.items())):
+        return None
+    return cached.get('bin_boundaries')
+
+
+def save_boundaries(path, boundaries, **config):
+    """
+    Writes bin boundaries to a preprocessing config file, with the config
+    they were computed for.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(dict(config, bin_boundaries=list(boundaries)), file, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,328 @@
+"""
+The declarative schema of the sales database. Tables and indexes are
+declared once below, and apply brings a database up to date by running every
+migration it has not yet recorded in the schema_migrations table.
+"""
+
+import re
+
+
+class Table():
+    """ A table declaration. """
+    def __init__(self, name, columns, constraints=()) -> None:
+        """
+        Arguments:
+            name (str): The table name.
+            columns (list): A list of column name and postgres type pairs.
+            constraints (list|optional): A list of table constraints.
+        """
+        self.name = name
+        self.columns = columns
+        self.constraints = list(constraints)
+
+    def create_sql(self, partition_by=None):
+        """
+        Returns the CREATE TABLE statement of the table.
+
+        Arguments:
+            partition_by (str|optional): A partition key, for example
+                "RANGE (date_block_num)".
+        """
+        defs = ["{} {}".format(name, col_type) for name, col_type in self.columns]
+        sql = "CREATE TABLE IF NOT EXISTS {} ({})".format(
+            self.name, ", ".join(defs + self.constraints))
+        if (partition_by):
+            sql += " PARTITION BY {}".format(partition_by)
+        return sql
+
+
+class Index():
+    """ An index declaration. """
+    def __init__(self, name, table, columns) -> None:
+        """
+        Arguments:
+            name (str): The index name.
+            table (str): The indexed table name.
+            columns (list): The indexed column names.
+        """
+        self.name = name
+        self.table = table
+        self.columns = columns
+
+    def create_sql(self):
+        """ Returns the CREATE INDEX statement of the index. """
+        return "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+            self.name, self.table, ", ".join(self.columns))
+
+
+ITEM_CATEGORIES = Table(
+    "itemcategories",
+    [
+        ("item_category_name", "character varying (64)"),
+        ("item_category_id", "smallint NOT NULL")
+    ],
+    ["PRIMARY KEY (item_category_id)"]
+)
+
+SHOPS = Table(
+    "shops",
+    [
+        ("shop_name", "character varying (256)"),
+        ("shop_id", "smallint NOT NULL")
+    ],
+    ["PRIMARY KEY (shop_id)"]
+)
+
+ITEMS = Table(
+    "items",
+    [
+        ("item_name", "character varying (256)"),
+        ("item_id", "integer NOT NULL"),
+        ("item_category_id", "smallint")
+    ],
+    [
+        "PRIMARY KEY (item_id)",
+        "FOREIGN KEY (item_category_id) \
+            REFERENCES itemcategories(item_category_id)"
+    ]
+)
+
+SALES = Table(
+    "sales",
+    [
+        ("date", "date NOT NULL"),
+        ("date_block_num", "smallint NOT NULL"),
+        ("shop_id", "smallint NOT NULL"),
+        ("item_id", "integer NOT NULL"),
+        ("item_price", "numeric"),
+        ("item_cnt_day", "numeric")
+    ],
+    [
+        "FOREIGN KEY (shop_id) REFERENCES shops(shop_id)",
+        "FOREIGN KEY (item_id) REFERENCES items(item_id)"
+    ]
+)
+
+ROLLUP = Table(
+    "sales_monthly",
+    [
+        ("shop_id", "smallint NOT NULL"),
+        ("item_id", "integer NOT NULL"),
+        ("date_block_num", "smallint NOT NULL"),
+        ("item_cnt", "numeric NOT NULL"),
+        ("max_price", "numeric"),
+        ("mean_price", "numeric"),
+        ("item_category_id", "smallint")
+    ],
+    ["PRIMARY KEY (shop_id, item_id, date_block_num)"]
+)
+
+FORECASTS = Table(
+    "forecasts",
+    [
+        ("shop_id", "smallint NOT NULL"),
+        ("item_id", "integer NOT NULL"),
+        ("date_block_num", "smallint NOT NULL"),
+        ("forecast", "real NOT NULL"),
+        ("run_id", "character varying (64)"),
+        ("created_at", "timestamp with time zone DEFAULT now()")
+    ],
+    ["PRIMARY KEY (shop_id, item_id, date_block_num)"]
+)
+
+TABLES = [ITEM_CATEGORIES, SHOPS, ITEMS, SALES, ROLLUP, FORECASTS]
+
+INDEXES = [
+    Index("items_item_category_id_idx", "items", ["item_category_id"]),
+    Index(
+        "sales_shop_item_block_idx",
+        "sales",
+        ["shop_id", "item_id", "date_block_num"]
+    ),
+    Index("sales_date_block_num_idx", "sales", ["date_block_num"]),
+    Index("sales_monthly_date_block_num_idx", "sales_monthly", ["date_block_num"])
+]
+
+# Casts used to convert columns created by earlier versions of the schema
+LEGACY_CASTS = {
+    ("sales", "date"): "to_date(date, 'DD.MM.YYYY')"
+}
+
+
+def _data_type(col_type):
+    """
+    Returns the information_schema data type of a postgres column type,
+    without its NOT NULL, NULL or DEFAULT column constraints.
+    """
+    col_type = re.split(r"\s+(?:NOT NULL|NULL|DEFAULT)\b", col_type)[0].strip()
+    if (col_type.startswith("character varying")):
+        return "character varying"
+    return col_type
+
+
+def _create_tables(curs, partition=False, blocks_per_partition=12, num_partitions=3):
+    """ Creates every table, optionally partitioning sales by date block. """
+    for table in [ITEM_CATEGORIES, SHOPS, ITEMS, SALES, ROLLUP]:
+        if (table is SALES and partition):
+            curs.execute(table.create_sql("RANGE (date_block_num)"))
+            curs.execute(
+                "SELECT relkind FROM pg_class \
+                WHERE oid = to_regclass('sales')")
+            if (curs.fetchone()[0] != "p"):
+                # An existing sales table cannot be partitioned in place
+                continue
+            for i in range(num_partitions):
+                low = i * blocks_per_partition
+                curs.execute(
+                    "CREATE TABLE IF NOT EXISTS sales_{0} PARTITION OF sales \
+                    FOR VALUES FROM ({1}) TO ({2})".format(
+                        i, low, low + blocks_per_partition))
+            curs.execute(
+                "CREATE TABLE IF NOT EXISTS sales_default \
+                PARTITION OF sales DEFAULT")
+        else:
+            curs.execute(table.create_sql())
+
+
+def _retype_columns(curs, **kwargs):
+    """
+    Converts the columns of tables created by create_tables.py before this
+    schema existed, which used serial foreign keys and a varchar date.
+    """
+    for table in TABLES:
+        actual = _column_types(curs, table.name)
+        for name, col_type in table.columns:
+            data_type = _data_type(col_type)
+            if (actual.get(name, data_type) == data_type):
+                continue
+            using = LEGACY_CASTS.get((table.name, name), "{}::{}".format(name, data_type))
+            curs.execute(
+                "ALTER TABLE {0} \
+                    ALTER COLUMN {1} DROP DEFAULT, \
+                    ALTER COLUMN {1} TYPE {2} USING {3}".format(
+                    table.name, name, data_type, using))
+
+
+def _create_indexes(curs, **kwargs):
+    """ Creates every index. """
+    for index in INDEXES:
+        curs.execute(index.create_sql())
+
+
+def _create_forecasts(curs, **kwargs):
+    """ Creates the forecasts table written by batch scoring. """
+    curs.execute(FORECASTS.create_sql())
+
+
+# Ordered list of migrations. A migration is never edited once released,
+# new changes are appended with the next version number.
+MIGRATIONS = [
+    (1, "create tables", _create_tables),
+    (2, "retype legacy columns", _retype_columns),
+    (3, "create indexes", _create_indexes),
+    (4, "create forecasts", _create_forecasts)
+]
+
+
+def _column_types(curs, table):
+    """ Returns the data type of every column of a table. """
+    curs.execute(
+        "SELECT column_name, data_type \
+        FROM information_schema.columns \
+        WHERE table_schema = current_schema() \
+            AND table_name = %s", (table,))
+    return dict(curs.fetchall())
+
+
+def apply(db, partition=False, blocks_per_partition=12, num_partitions=3):
+    """
+    Applies every pending migration, each in its own transaction.
+
+    Arguments:
+        db (SalesDB): The database.
+        partition (bool): If True, a new sales table is partitioned by
+            date_block_num. An existing sales table is left unpartitioned.
+        blocks_per_partition (int): The number of date blocks in each
+            partition.
+        num_partitions (int): The number of partitions created up front.
+            Later date blocks go to a default partition.
+
+    Returns:
+        A list of the names of the applied migrations.
+    """
+    applied = []
+    with db.connection() as conn:
+        with conn:
+            with conn.cursor() as curs:
+                curs.execute(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ( \
+                        version integer PRIMARY KEY \
+                        ,name character varying (64) NOT NULL \
+                        ,applied_at timestamp with time zone DEFAULT now() \
+                    )")
+                curs.execute("SELECT version FROM schema_migrations")
+                done = set(version for version, in curs.fetchall())
+
+        for version, name, migrate in MIGRATIONS:
+            if (version in done):
+                continue
+            with conn:
+                with conn.cursor() as curs:
+                    migrate(
+                        curs,
+                        partition=partition,
+                        blocks_per_partition=blocks_per_partition,
+                        num_partitions=num_partitions
+                    )
+                    curs.execute(
+                        "INSERT INTO schema_migrations (version, name) \
+                        VALUES (%s, %s)", (version, name))
+            applied.append(name)
+    return applied
+
+
+def verify(db):
+    """
+    Checks that the database matches the declared schema.
+
+    Arguments:
+        db (SalesDB): The database.
+
+    Returns:
+        A list of problems. The list is empty if the schema matches.
+    """
+    problems = []
+    with db.connection() as conn:
+        with conn:
+            with conn.cursor() as curs:
+                for table in TABLES:
+                    actual = _column_types(curs, table.name)
+                    if (not actual):
+                        problems.append("missing table {}".format(table.name))
+                        continue
+                    for name, col_type in table.columns:
+                        data_type = _data_type(col_type)
+                        if (name not in actual):
+                            problems.append("missing column {}.{}".format(
+                                table.name, name))
+                        elif (actual[name] != data_type):
+                            problems.append("column {}.{} is {}, expected {}".format(
+                                table.name, name, actual[name], data_type))
+
+                curs.execute(
+                    "SELECT indexname FROM pg_indexes \
+                    WHERE schemaname = current_schema()")
+                indexes = set(name for name, in curs.fetchall())
+                for index in INDEXES:
+                    if (index.name not in indexes):
+                        problems.append("missing index {}".format(index.name))
+
+                curs.execute("SELECT to_regclass('schema_migrations')")
+                version = None
+                if (curs.fetchone()[0] is not None):
+                    curs.execute("SELECT MAX(version) FROM schema_migrations")
+                    version = curs.fetchone()[0]
+                if (version != MIGRATIONS[-1][0]):
+                    problems.append("schema version is {}, expected {}".format(
+                        version, MIGRATIONS[-1][0]))
+    return problems
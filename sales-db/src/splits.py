@@ -0,0 +1,102 @@
+import numpy as np
+
+
+# The column of a shop and item id pair holding each group
+GROUP_COLUMNS = {'shop': 0, 'item': 1}
+
+
+def split_bounds(num_samples, fracs):
+    """
+    Returns the num_splits + 1 boundaries that divide num_samples samples
+    into splits with the given fractions. Fractions are normalized by their
+    sum, so (0.8, 0.2) and (4, 1) split alike.
+    """
+    fracs = np.asarray(fracs, dtype='float64')
+    if (fracs.ndim != 1 or len(fracs) == 0 or np.any(fracs < 0) or fracs.sum() <= 0):
+        raise ValueError('fracs must be a non-empty list of non-negative fractions')
+    bounds = np.zeros(len(fracs) + 1, dtype='int64')
+    bounds[1:] = np.rint(np.cumsum(fracs) / fracs.sum() * num_samples)
+    return bounds
+
+
+def partition(labels, num_splits):
+    """
+    Returns the indices of the samples with each split label, in order.
+    """
+    labels = np.asarray(labels, dtype='int64')
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=num_splits)
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def split_indices(num_samples, fracs, shuffle=True, seed=0):
+    """
+    Splits the samples into index arrays with the given fractions.
+
+    Args:
+        num_samples: The number of samples.
+        fracs: The fraction of samples in each split.
+        shuffle: If True, samples are assigned from a permutation drawn
+            with seed. Otherwise, the splits are consecutive ranges.
+        seed: Seed value of the permutation.
+
+    Returns:
+        A list of index arrays, one for each split. The arrays are views of
+        a single permutation.
+    """
+    if (shuffle):
+        order = np.random.default_rng(seed).permutation(num_samples)
+    else:
+        order = np.arange(num_samples)
+    bounds = split_bounds(num_samples, fracs)
+    return [order[low:high] for low, high in zip(bounds[:-1], bounds[1:])]
+
+
+def group_split(groups, fracs, shuffle=True, seed=0):
+    """
+    Splits the samples so every sample of a group lands in the same split,
+    for example every pair of a shop. Groups are assigned whole, so the
+    split sizes only approximate the fractions.
+
+    Args:
+        groups: The group of each sample.
+        fracs: The fraction of samples in each split.
+        shuffle: If True, groups are assigned in an order drawn with seed.
+            Otherwise, they are assigned in sorted order.
+        seed: Seed value of the permutation.
+
+    Returns:
+        A list of index arrays, one for each split.
+    """
+    _, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+    if (shuffle):
+        order = np.random.default_rng(seed).permutation(len(counts))
+    else:
+        order = np.arange(len(counts))
+
+    # Each group goes to the split its first sample would fall in
+    starts = np.cumsum(counts[order]) - counts[order]
+    bounds = split_bounds(len(inverse), fracs)
+    group_splits = np.empty(len(counts), dtype='int64')
+    group_splits[order] = np.searchsorted(bounds[1:-1], starts, side='right')
+    return partition(group_splits[inverse.reshape(-1)], len(bounds) - 1)
+
+
+def time_split(date_blocks, cutoffs):
+    """
+    Splits the samples by date block. The i'th split holds the samples
+    before cutoffs[i] and at or after cutoffs[i - 1], and the last split
+    holds the samples at or after the last cutoff.
+
+    Args:
+        date_blocks: The date block of each sample.
+        cutoffs: The increasing date blocks between splits.
+
+    Returns:
+        A list of len(cutoffs) + 1 index arrays.
+    """
+    cutoffs = np.asarray(cutoffs, dtype='int64')
+    if (np.any(np.diff(cutoffs) < 0)):
+        raise ValueError('cutoffs must be increasing')
+    labels = np.searchsorted(cutoffs, np.asarray(date_blocks), side='right')
+    return partition(labels, len(cutoffs) + 1)
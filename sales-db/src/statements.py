@@ -0,0 +1,186 @@
+import re
+import weakref
+import threading
+import collections
+import psycopg2
+
+
+"""
+Server-side prepared statements. A Statement is prepared once on each
+connection that runs it, so Postgres parses it once per connection, and
+after a few executions reuses a generic plan instead of planning every call.
+The StatementRegistry remembers which statements each connection has
+prepared, and counts prepares and executions to show how often plans are
+reused.
+"""
+
+# A parameter placeholder, or an escaped percent sign
+_PLACEHOLDER = re.compile(r"%[s%]")
+
+
+class Statement():
+    """
+    A named query. Its %s parameters are numbered $1, $2, ... when it is
+    prepared, so the same query also runs unprepared.
+    """
+    def __init__(self, name, sql, types) -> None:
+        """
+        Arguments:
+            name (str): The name of the prepared statement. Must be unique
+                within the registry.
+            sql (str): The query, with a %s placeholder per parameter.
+            types (list): The postgres type of each parameter.
+        """
+        self.name = name
+        self.sql = sql
+        self.types = tuple(types)
+
+    def prepare_sql(self):
+        """
+        Returns the PREPARE statement. It runs without parameters, so an
+        escaped %% is written as a single %.
+        """
+        count = 0
+
+        def number(match):
+            nonlocal count
+            if (match.group() == "%%"):
+                return "%"
+            count += 1
+            return "${}".format(count)
+
+        body = _PLACEHOLDER.sub(number, self.sql)
+        if (count != len(self.types)):
+            raise ValueError("statement {} has {} parameters and {} types".format(
+                self.name, count, len(self.types)))
+        if (not self.types):
+            return "PREPARE {} AS {}".format(self.name, body)
+        return "PREPARE {} ({}) AS {}".format(
+            self.name, ", ".join(self.types), body)
+
+    def execute_sql(self):
+        """ Returns the EXECUTE statement, with a %s placeholder per parameter. """
+        if (not self.types):
+            return "EXECUTE {}".format(self.name)
+        return "EXECUTE {} ({})".format(
+            self.name, ", ".join(["%s"] * len(self.types)))
+
+
+class StatementRegistry():
+    """
+    StatementRegistry prepares statements on the connections that run them,
+    and tracks plan reuse. A statement is prepared at most once per
+    connection; every later execution on that connection reuses its parsed
+    query and cached plan.
+    """
+    def __init__(self, statements=()) -> None:
+        """
+        Arguments:
+            statements (list|optional): The statements to register.
+        """
+        self.statements = {}
+        self._prepared = weakref.WeakKeyDictionary()
+        self._counts = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+        for statement in statements:
+            self.register(statement)
+
+    def register(self, statement):
+        """ Adds a statement to the registry, and returns it. """
+        if (statement.name in self.statements):
+            raise ValueError("statement {} is already registered".format(statement.name))
+        self.statements[statement.name] = statement
+        return statement
+
+    def prepare(self, curs, statement):
+        """
+        Prepares a statement on the cursor's connection, unless it is already
+        prepared there.
+
+        Returns:
+            True if the statement was prepared by this call.
+        """
+        conn = curs.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+            if (statement.name in prepared):
+                return False
+        try:
+            curs.execute(statement.prepare_sql())
+        except psycopg2.errors.DuplicatePreparedStatement:
+            # Prepared on this connection without the registry knowing
+            with self._lock:
+                prepared.add(statement.name)
+            raise
+        with self._lock:
+            prepared.add(statement.name)
+            self._counts[statement.name]["prepares"] += 1
+        return True
+
+    def execute(self, curs, statement, values=None):
+        """
+        Executes a statement on a cursor, preparing it first if needed.
+
+        Returns:
+            True if the statement was prepared by this call.
+        """
+        if (statement.name not in self.statements):
+            raise KeyError("statement {} is not registered".format(statement.name))
+        prepared = self.prepare(curs, statement)
+        try:
+            curs.execute(statement.execute_sql(), values)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Deallocated behind the registry's back
+            self.forget(curs.connection)
+            raise
+        with self._lock:
+            self._counts[statement.name]["executions"] += 1
+        return prepared
+
+    def forget(self, conn):
+        """
+        Forgets the statements prepared on a connection, for example after
+        DISCARD ALL or DEALLOCATE ALL.
+        """
+        with self._lock:
+            self._prepared.pop(conn, None)
+
+    def plans(self, conn):
+        """
+        Returns the number of generic and custom plans each registered
+        statement has used on a connection, from pg_prepared_statements.
+        The plan counts need Postgres 14 or later, and are None before.
+        """
+        with conn.cursor() as curs:
+            curs.execute("SELECT * FROM pg_prepared_statements")
+            names = [col.name for col in curs.description]
+            rows = [dict(zip(names, row)) for row in curs.fetchall()]
+        return {
+            row["name"]: {
+                "generic_plans": row.get("generic_plans"),
+                "custom_plans": row.get("custom_plans")
+            }
+            for row in rows
+            if (row["name"] in self.statements)
+        }
+
+    def stats(self):
+        """
+        Returns the prepares, executions, and reused executions of each
+        statement, and the fraction of executions that reused a prepared
+        statement.
+        """
+        with self._lock:
+            counts = {name: dict(counter) for name, counter in self._counts.items()}
+        stats = {}
+        for name in self.statements:
+            prepares = counts.get(name, {}).get("prepares", 0)
+            executions = counts.get(name, {}).get("executions", 0)
+            reused = max(executions - prepares, 0)
+            stats[name] = {
+                "prepares": prepares,
+                "executions": executions,
+                "reused": reused,
+                "reuse_ratio": reused / executions if executions else 0.0
+            }
+        return stats
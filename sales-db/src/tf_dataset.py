@@ -0,0 +1,114 @@
+import numpy as np
+import tensorflow as tf
+
+
+# The default shuffle buffer of cached samples, in batches
+SHUFFLE_BATCHES = 16
+
+
+def element_spec(seq_len):
+    """
+    Returns the element spec of a batch: the model inputs, with the dtypes
+    and shapes of the model's input layers, and the targets.
+    """
+    return (
+        {
+            'categories': tf.TensorSpec((None, 1), tf.int64),
+            'prices': tf.TensorSpec((None, 1), tf.float32),
+            'sequences': tf.TensorSpec((None, seq_len, 12), tf.float32)
+        },
+        tf.TensorSpec((None,), tf.float32)
+    )
+
+
+def make_dataset(
+        load,
+        num_samples,
+        seq_len,
+        batch_size=32,
+        shuffle=True,
+        shuffle_buffer=None,
+        seed=0,
+        cache=None,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        prefetch=tf.data.AUTOTUNE
+    ):
+    """
+    Builds a tf.data pipeline over the samples of a data generator.
+
+    Batches of sample indices are loaded by a parallel map, so input
+    preparation runs on several cores and overlaps with training.
+
+    Args:
+        load: A function of an array of sample indices, returning a
+            dictionary of categories, prices and sequences arrays and an
+            array of targets. It is run in parallel, so it must be thread
+            safe.
+        num_samples: The number of samples.
+        seq_len: The length of each sequence of monthly sales data.
+        batch_size: The size of each batch of data.
+        shuffle: If True, the samples are reshuffled every epoch.
+        shuffle_buffer: The number of samples in the shuffle buffer.
+            Without a cache, sample indices are shuffled, and the default
+            buffer holds every index. With a cache, loaded samples are
+            shuffled, and the default buffer holds SHUFFLE_BATCHES batches:
+            a buffer of every sample would hold the whole expanded dataset
+            in memory. Samples are then only mixed with samples about
+            shuffle_buffer positions apart in the cache, whose order is a
+            random permutation fixed by the first epoch.
+        seed: Seed value used to shuffle data.
+        cache: If None, batches are loaded every epoch. Otherwise, loaded
+            samples are cached in the file cache, or in memory if cache is
+            an empty string, and shuffled from the cache on later epochs.
+        num_parallel_calls: The number of batches loaded in parallel.
+        prefetch: The number of batches prepared ahead of training.
+
+    Returns:
+        A tf.data.Dataset of (inputs, targets) batches.
+    """
+    spec = element_spec(seq_len)
+    if (cache is None):
+        shuffle_buffer = shuffle_buffer or max(num_samples, 1)
+    else:
+        shuffle_buffer = shuffle_buffer or SHUFFLE_BATCHES * batch_size
+
+    def load_batch(rows):
+        x_batch, y_batch = load(rows)
+        return (
+            np.asarray(x_batch['categories'], dtype='int64').reshape(-1, 1),
+            np.asarray(x_batch['prices'], dtype='float32').reshape(-1, 1),
+            np.asarray(x_batch['sequences'], dtype='float32'),
+            np.asarray(y_batch, dtype='float32')
+        )
+
+    def to_element(rows):
+        categories, prices, sequences, targets = tf.numpy_function(
+            load_batch,
+            [rows],
+            [tf.int64, tf.float32, tf.float32, tf.float32]
+        )
+        inputs = {
+            'categories': tf.ensure_shape(categories, spec[0]['categories'].shape),
+            'prices': tf.ensure_shape(prices, spec[0]['prices'].shape),
+            'sequences': tf.ensure_shape(sequences, spec[0]['sequences'].shape)
+        }
+        return inputs, tf.ensure_shape(targets, spec[1].shape)
+
+    dataset = tf.data.Dataset.range(num_samples)
+    if (shuffle and cache is None):
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    elif (shuffle):
+        # Indices are cheap to shuffle, so the cache is filled in a random
+        # order, and the bounded buffer below reshuffles it every epoch
+        dataset = dataset.shuffle(max(num_samples, 1), seed=seed)
+    dataset = dataset.batch(batch_size).map(
+        to_element,
+        num_parallel_calls=num_parallel_calls
+    )
+    if (cache is not None):
+        # Cache single samples, so they can be reshuffled every epoch
+        dataset = dataset.unbatch().cache(cache)
+        if (shuffle):
+            dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+    return dataset.prefetch(prefetch)
@@ -0,0 +1,126 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def monthly_matrix(features, num_months, target_month=None):
+    """
+    Expands compact features into a dense (num_pairs, num_months) matrix of
+    the monthly item counts of each pair.
+
+    Args:
+        features: A dictionary of compact features.
+        num_months: The number of months in the matrix. Later months are
+            dropped.
+        target_month: If set, the targets of the features are written to
+            this month, for features built with the last month as target.
+    """
+    offsets = np.asarray(features['offsets'], dtype='int64')
+    num_pairs = len(offsets) - 1
+    rows = np.repeat(np.arange(num_pairs), np.diff(offsets))
+    date_blocks = np.asarray(features['date_blocks'], dtype='int64')
+    keep = date_blocks < num_months
+    monthly = np.zeros((num_pairs, num_months), dtype='float32')
+    monthly[rows[keep], date_blocks[keep]] = np.asarray(features['counts'])[keep]
+    if (target_month is not None):
+        monthly[:, target_month] = features['targets']
+    return monthly
+
+
+class SlidingWindows():
+
+    """
+    SlidingWindows serves many samples per shop and item pair from rolling
+    windows over one dense monthly matrix. Each window is a strided view of
+    the matrix, so windows cost no memory until a batch is gathered. Sample
+    s is the (s % num_windows)'th window of feature row s // num_windows:
+    the months [start, start + window) predict month
+    start + window + horizon - 1, where start is the window index times
+    stride.
+    """
+
+    def __init__(self, features, num_months, window, stride=1, horizon=1, target_month=None):
+        """
+        Args:
+            features: A dictionary of compact features.
+            num_months: The number of months windows are taken from.
+            window: The number of months in each sequence.
+            stride: The number of months between the starts of windows.
+            horizon: The number of months between the end of a window and
+                its target month. 1 forecasts the next month.
+            target_month: Passed to monthly_matrix.
+        """
+        if (window < 1 or stride < 1 or horizon < 1):
+            raise ValueError('window, stride and horizon must be positive')
+        if (window + horizon > num_months):
+            raise ValueError('window + horizon is longer than {} months'.format(num_months))
+        self.features = features
+        self.window = window
+        self.stride = stride
+        self.horizon = horizon
+        self.monthly = monthly_matrix(features, num_months, target_month)
+        self.view = sliding_window_view(self.monthly, window + horizon, axis=1)[:, ::stride]
+        self.num_windows = self.view.shape[1]
+
+    def __len__(self):
+        """ Returns the number of samples. """
+        return self.view.shape[0] * self.num_windows
+
+    def samples(self, rows=None, since_first_sale=True):
+        """
+        Returns the samples of the given feature rows, in row order.
+
+        Args:
+            rows: The feature rows. Defaults to every row.
+            since_first_sale: If True, windows whose target month is before
+                the first sale of their pair are skipped, as are pairs
+                without sales.
+        """
+        if (rows is None):
+            rows = np.arange(self.view.shape[0])
+        rows = np.asarray(rows, dtype='int64')
+        first = np.zeros(len(rows), dtype='int64')
+        if (since_first_sale):
+            sold = self.monthly[rows] != 0
+            first = np.where(sold.any(axis=1), sold.argmax(axis=1), self.monthly.shape[1])
+        # The first window of each row whose target month is not before
+        # its first sale
+        first = np.maximum(first - self.window - self.horizon + 1, 0)
+        lows = np.minimum(-(-first // self.stride), self.num_windows)
+        counts = self.num_windows - lows
+        starts = np.cumsum(counts) - counts
+        windows = np.arange(counts.sum()) - np.repeat(starts - lows, counts)
+        return np.repeat(rows, counts) * self.num_windows + windows
+
+    def rows(self, samples):
+        """ Returns the feature row of each sample. """
+        return np.asarray(samples, dtype='int64') // self.num_windows
+
+    def start_months(self, samples):
+        """ Returns the first month of each sample's window. """
+        return np.asarray(samples, dtype='int64') % self.num_windows * self.stride
+
+    def target_months(self, samples):
+        """ Returns the target month of each sample. """
+        return self.start_months(samples) + self.window + self.horizon - 1
+
+    def gather(self, samples):
+        """
+        Gathers a batch of model inputs and targets. Only the batch's
+        windows are copied out of the monthly matrix.
+        """
+        samples = np.asarray(samples, dtype='int64')
+        rows, windows = np.divmod(samples, self.num_windows)
+        values = self.view[rows, windows]
+        # One-hot encode the month of the year of each month, as in
+        # features.expand_sequences
+        months = windows[:, None] * self.stride + np.arange(self.window)
+        sequences = np.zeros((len(samples), self.window, 12), dtype='float32')
+        sequences[
+            np.arange(len(samples))[:, None], np.arange(self.window), months % 12
+        ] = values[:, :self.window]
+        x_batch = {
+            'categories': self.features['categories'][rows],
+            'prices': self.features['prices'][rows],
+            'sequences': sequences
+        }
+        return x_batch, values[:, -1]
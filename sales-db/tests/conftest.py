@@ -0,0 +1,88 @@
+import os
+import sys
+import importlib.util
+import pytest
+
+
+SALES_DB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+if (SALES_DB_DIR not in sys.path):
+    sys.path.append(SALES_DB_DIR)
+
+
+def load_module(name, path):
+    """
+    Imports a module by path, under a name that does not clash with the
+    sales-model module of the same file name.
+    """
+    if (name not in sys.modules):
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+class FakeSalesDB():
+
+    """
+    FakeSalesDB answers the SalesDB queries used by the data generators
+    from an in-memory monthly rollup.
+    """
+
+    def __init__(self, monthly, categories, prices):
+        """
+        Args:
+            monthly: A dictionary of the item count of each date block, keyed
+                by shop and item id pair.
+            categories: The category id of each item id.
+            prices: The max price of each shop and item id pair.
+        """
+        self.monthly = monthly
+        self.categories = categories
+        self.prices = prices
+
+    def getIds(self):
+        return sorted(self.monthly)
+
+    def getFirstDateBlocks(self):
+        return [pair + (min(self.monthly[pair]),) for pair in self.getIds()]
+
+    def getFingerprint(self):
+        counts = [count for blocks in self.monthly.values() for count in blocks.values()]
+        return '{}:{}'.format(len(counts), sum(counts))
+
+    def getBatchFeatures(self, pairs):
+        rows = []
+        for idx, (shop_id, item_id) in enumerate(pairs):
+            pair = (int(shop_id), int(item_id))
+            category = self.categories.get(pair[1])
+            blocks = self.monthly.get(pair, {})
+            if (not blocks):
+                rows.append((idx, category, None, None, None))
+            for date_block in sorted(blocks):
+                rows.append((idx, category, self.prices[pair], date_block, blocks[date_block]))
+        return rows
+
+
+@pytest.fixture
+def sales_db():
+    """
+    A FakeSalesDB of three shop and item pairs over six months. The last
+    month is the target month of seq_len 5.
+    """
+    return FakeSalesDB(
+        monthly={
+            (1, 10): {0: 1.0, 1: 2.0, 5: 3.0},
+            (1, 20): {2: 4.0, 3: 1.0},
+            (2, 10): {4: 2.0, 5: 5.0}
+        },
+        categories={10: 5, 20: 6},
+        prices={(1, 10): 100.0, (1, 20): 50.0, (2, 10): 90.0}
+    )
+
+
+@pytest.fixture(scope='session')
+def data_generator():
+    """ The sales-db data_generator module. """
+    return load_module('db_data_generator', os.path.join(SALES_DB_DIR, 'data_generator.py'))
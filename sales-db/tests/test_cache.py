@@ -0,0 +1,81 @@
+from cache import PairCache, SQLiteBackend
+from database import SalesDB
+
+
+def test_values_of_pairs_with_newer_sales_are_missing(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'))
+    writer = PairCache(backend=backend)
+    reader = PairCache(backend=backend)
+    writer.advance(33)
+    reader.advance(33)
+    writer.set('forecast', 1, 2, 3.0, date_block=33)
+    writer.set('forecast', 1, 3, 4.0, date_block=30)
+    assert reader.get('forecast', 1, 2) == 3.0
+
+    # Another process added date block 34 with sales of (1, 2) only
+    reader.advance(34, [(1, 2, 34)])
+    assert reader.get('forecast', 1, 2) is None
+    assert reader.get('forecast', 1, 3) == 4.0
+    assert reader.stats()['stale'] == 1
+
+
+def test_values_without_a_date_block_use_the_last_date_block():
+    cache = PairCache()
+    cache.advance(33)
+    cache.set('price', 1, 2, 10.0)
+    cache.advance(34, [(1, 2, 34)])
+    assert cache.get('price', 1, 2) is None
+    cache.set('price', 1, 2, 12.0)
+    assert cache.get('price', 1, 2) == 12.0
+
+
+def test_values_cached_before_the_first_check_are_missing(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite'))
+    writer = PairCache(backend=backend)
+    writer.advance(33)
+    writer.set('forecast', 1, 2, 3.0, date_block=33)
+
+    # A process started after date block 34 cannot tell what changed
+    reader = PairCache(backend=backend)
+    reader.advance(34)
+    assert reader.get('forecast', 1, 2) is None
+
+
+def test_check_cache_fetches_pairs_of_new_date_blocks():
+    last = [33]
+    since = []
+    cache = PairCache()
+    db = SalesDB('user', 'password', cache=cache, cache_check_seconds=3600)
+    db.getLastDateBlock = lambda: last[-1]
+
+    def getLatestDateBlocks(date_block):
+        since.append(date_block)
+        return [(1, 2, 34)]
+
+    db.getLatestDateBlocks = getLatestDateBlocks
+
+    db.checkCache()
+    assert since == []
+    cache.set('forecast', 1, 2, 3.0, date_block=33)
+    last.append(34)
+    # Checked less than cache_check_seconds ago
+    db.checkCache()
+    assert cache.get('forecast', 1, 2) == 3.0
+    db.checkCache(force=True)
+    assert since == [33]
+    assert cache.get('forecast', 1, 2) is None
+    # The last date block did not move
+    db.checkCache(force=True)
+    assert since == [33]
+
+
+def test_stale_values_are_not_counted_as_hits():
+    cache = PairCache()
+    cache.advance(33)
+    cache.set('forecast', 1, 2, 3.0, date_block=33)
+    assert cache.get('forecast', 1, 2) == 3.0
+    cache.advance(34, [(1, 2, 34)])
+    assert cache.get('forecast', 1, 2) is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['stale']) == (1, 0, 1)
+    assert stats['hit_rate'] == 0.5
@@ -0,0 +1,153 @@
+import os
+import psycopg2
+import pytest
+from psycopg2.sql import Identifier
+from database import SalesDB
+from pool import ConnectionPool
+
+
+class FakeConnection():
+
+    """
+    A connection that records its queries and transactions. Inserting one
+    of the duplicate rows raises a UniqueViolation, and inserting one of
+    the failures drops the connection.
+    """
+
+    def __init__(self, duplicates=(), failures=()):
+        self.closed = False
+        self.status = psycopg2.extensions.STATUS_READY
+        self.duplicates = set(duplicates)
+        self.failures = set(failures)
+        self.queries = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if (exc_type is None):
+            self.commits += 1
+        else:
+            self.rollbacks += 1
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor():
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, values=None):
+        self.conn.queries.append((sql, values))
+        if (values is not None and tuple(values) in self.conn.duplicates):
+            raise psycopg2.errors.UniqueViolation("duplicate key value")
+        if (values is not None and tuple(values) in self.conn.failures):
+            raise psycopg2.OperationalError("server closed the connection")
+
+    def fetchall(self):
+        return [('Seq Scan on sales',)]
+
+
+@pytest.fixture
+def connect():
+    """ Returns a SalesDB whose pool hands out a fake connection. """
+    def connect(conn, **kwargs):
+        db = SalesDB('user', 'password', **kwargs)
+        db._pool = ConnectionPool(lambda: conn, min_size=0, max_size=1, health_check=False)
+        db._pool_pid = os.getpid()
+        return db
+    return connect
+
+
+def test_insert_csv_skips_duplicates_without_losing_rows(connect, tmp_path):
+    path = tmp_path / 'sales.csv'
+    path.write_text(
+        'date,date_block_num,shop_id,item_id,item_price,item_cnt_day\n'
+        '2013-01-02,0,1,10,100.0,1.0\n'
+        '2013-02-02,1,1,10,100.0,1.0\n'
+        '2013-03-02,2,1,20,50.0,1.0\n'
+    )
+    conn = FakeConnection(duplicates=[('2013-02-02', '1', '1', '10', '100.0', '1.0')])
+    db = connect(conn)
+    db.insertCSV('sales', str(path))
+
+    statements = [sql for sql, _ in conn.queries if (isinstance(sql, str))]
+    assert statements.count("SAVEPOINT insert_row") == 3
+    assert statements.count("ROLLBACK TO SAVEPOINT insert_row") == 1
+    assert statements.count("RELEASE SAVEPOINT insert_row") == 2
+    # The rows around the duplicate are committed in one transaction
+    assert conn.commits == 1 and conn.rollbacks == 0
+    assert db.dirty_blocks == {0, 2}
+
+
+def test_insert_csv_marks_nothing_dirty_if_the_transaction_fails(connect, tmp_path):
+    path = tmp_path / 'sales.csv'
+    path.write_text('date_block_num,shop_id,item_id\n0,1,10\n1,1,20\n')
+    conn = FakeConnection(failures=[('1', '1', '20')])
+    db = connect(conn)
+    with pytest.raises(psycopg2.OperationalError):
+        db.insertCSV('sales', str(path))
+    assert conn.rollbacks == 1
+    assert db.dirty_blocks == set()
+
+
+def render(composed):
+    """ Renders a psycopg2.sql object without a connection, for asserts. """
+    if (hasattr(composed, 'seq')):
+        return ''.join(render(part) for part in composed.seq)
+    if (hasattr(composed, 'strings')):
+        return '.'.join('"{}"'.format(name) for name in composed.strings)
+    return composed.string
+
+
+def test_sales_copies_skip_rows_equal_to_existing_rows():
+    db = SalesDB('user', 'password')
+    merge = ' '.join(render(db._mergeSQL(
+        'sales', ['date', 'shop_id', 'item_price'], Identifier('sales_staging'), 'DO NOTHING'
+    )).split())
+    assert 'SELECT DISTINCT "date", "shop_id", "item_price" FROM "sales_staging" AS staged' in merge
+    assert 'NOT EXISTS ( SELECT 1 FROM "sales" AS existing' in merge
+    assert 'existing."shop_id" = staged."shop_id"' in merge
+    assert 'existing."item_price" IS NOT DISTINCT FROM staged."item_price"' in merge
+
+
+def test_keyed_copies_merge_on_conflict():
+    db = SalesDB('user', 'password')
+    merge = ' '.join(render(db._mergeSQL(
+        'shops', ['shop_name', 'shop_id'], Identifier('shops_staging'), 'DO NOTHING'
+    )).split())
+    assert merge == (
+        'INSERT INTO "shops" ("shop_name", "shop_id") '
+        'SELECT "shop_name", "shop_id" FROM "shops_staging" ON CONFLICT DO NOTHING'
+    )
+
+
+@pytest.mark.parametrize('analyze, explain', [
+    (False, 'EXPLAIN SELECT 1'),
+    (True, 'EXPLAIN (ANALYZE, BUFFERS) SELECT 1')
+])
+def test_slow_queries_are_explained_without_analyze_by_default(connect, analyze, explain):
+    conn = FakeConnection()
+    db = connect(conn, explain_analyze=analyze)
+    assert db._explain(conn, 'SELECT 1', None) == 'Seq Scan on sales'
+    assert [sql for sql, _ in conn.queries] == [
+        'SAVEPOINT salesdb_explain',
+        explain,
+        'RELEASE SAVEPOINT salesdb_explain'
+    ]
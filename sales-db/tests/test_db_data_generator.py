@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def batches(generator):
+    return [generator[i] for i in range(len(generator))]
+
+
+def test_database_and_cached_batches_match(data_generator, sales_db, tmp_path):
+    from_db = data_generator.DataGenerator(sales_db=sales_db, seq_len=5, batch_size=2, shuffle=False)
+    cached = data_generator.DataGenerator(
+        sales_db=sales_db, seq_len=5, batch_size=2, shuffle=False, cache_dir=str(tmp_path))
+    assert len(from_db) == len(cached) == 2
+    for (x_db, y_db), (x_cached, y_cached) in zip(batches(from_db), batches(cached)):
+        for name in ('categories', 'prices', 'sequences'):
+            np.testing.assert_allclose(x_db[name], x_cached[name])
+        np.testing.assert_allclose(y_db, y_cached)
+    np.testing.assert_allclose(batches(cached)[0][1], [3.0, 1.0])
+
+
+def test_shuffle_keeps_the_given_ids(data_generator, sales_db):
+    ids = sales_db.getIds()
+    generator = data_generator.DataGenerator(ids=ids, sales_db=sales_db, seq_len=5, seed=3)
+    assert sorted(generator.ids) == ids and ids == sales_db.getIds()
+    assert generator.num_samples() == 3
+
+
+def test_splits_share_the_database(data_generator, sales_db):
+    generator = data_generator.DataGenerator(sales_db=sales_db, seq_len=5, shuffle=False)
+    by_shop = generator.split((0.5, 0.5), by='shop', shuffle=False)
+    assert [gen.ids for gen in by_shop] == [[(1, 10), (1, 20)], [(2, 10)]]
+    assert all(gen.sales_db is sales_db for gen in by_shop)
+    # Pairs first sold before date block 2 train, the rest validate
+    train, val = generator.split(cutoffs=[2])
+    assert sorted(train.ids) == [(1, 10)] and sorted(val.ids) == [(1, 20), (2, 10)]
+
+
+def test_windowed_generator(data_generator, sales_db):
+    generator = data_generator.DataGenerator(
+        sales_db=sales_db, seq_len=6, batch_size=4, shuffle=False, window=3)
+    assert generator.num_samples() == 8 and len(generator) == 2
+    x_batch, y_batch = generator[1]
+    assert x_batch['sequences'].shape == (4, 3, 12)
+    np.testing.assert_allclose(y_batch, [0.0, 0.0, 2.0, 5.0])
+
+    # Windows are split by target month, and share the monthly matrix
+    train, val = generator.split(cutoffs=[5])
+    assert train.windows is generator.windows
+    assert (generator.windows.target_months(train.samples) < 5).all()
+    assert (generator.windows.target_months(val.samples) >= 5).all()
+    assert train.num_samples() + val.num_samples() == 8
+
+
+def test_price_boundaries_of_cached_features(data_generator, sales_db, tmp_path):
+    generator = data_generator.DataGenerator(
+        sales_db=sales_db, seq_len=5, shuffle=False, cache_dir=str(tmp_path / 'features'))
+    path = str(tmp_path / 'preprocessing.json')
+    boundaries = generator.price_boundaries(num_bins=2, cache_path=path)
+    assert boundaries == [90.0]
+    assert generator.price_boundaries(num_bins=2, cache_path=path) == boundaries
+
+
+def test_tf_dataset_of_cached_features(data_generator, sales_db, tmp_path):
+    generator = data_generator.DataGenerator(
+        sales_db=sales_db, seq_len=5, batch_size=2, shuffle=False, cache_dir=str(tmp_path))
+    dataset = generator.to_tf_dataset()
+    targets = np.concatenate([y_batch.numpy() for _, y_batch in dataset])
+    np.testing.assert_allclose(targets, [3.0, 1.0, 5.0])
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from features import compact_batch, concat_features, expand_sequences, fill_batch, lookup_rows
+
+
+PAIRS = [(1, 10), (1, 20), (2, 10), (3, 30)]
+
+
+def test_compact_batch_holds_target_and_months(sales_db):
+    features = compact_batch(sales_db.getBatchFeatures(PAIRS), len(PAIRS), 5)
+    np.testing.assert_array_equal(features['categories'], [5, 6, 5, 0])
+    np.testing.assert_allclose(features['prices'], [100.0, 50.0, 90.0, 0.0])
+    np.testing.assert_array_equal(features['offsets'], [0, 2, 3, 4, 4])
+    np.testing.assert_array_equal(features['date_blocks'], [0, 1, 2, 4])
+    np.testing.assert_allclose(features['counts'], [1.0, 2.0, 4.0, 2.0])
+    # The last month of each pair is its target
+    np.testing.assert_allclose(features['targets'], [3.0, 1.0, 5.0, 0.0])
+
+
+def test_compact_batch_without_targets_drops_months_past_seq_len(sales_db):
+    features = compact_batch(sales_db.getBatchFeatures(PAIRS), len(PAIRS), 5, targets=False)
+    np.testing.assert_array_equal(features['offsets'], [0, 2, 4, 5, 5])
+    np.testing.assert_array_equal(features['date_blocks'], [0, 1, 2, 3, 4])
+    assert not features['targets'].any()
+
+
+def test_expand_sequences_one_hot_encodes_months():
+    features = compact_batch(
+        [(0, 1, 1.0, 0, 1.0), (0, 1, 1.0, 13, 2.0), (1, 2, 2.0, 3, 4.0), (1, 2, 2.0, 15, 0.0)],
+        2,
+        14,
+        targets=False
+    )
+    sequences = expand_sequences(features, [1, 0], 14)
+    assert sequences.shape == (2, 14, 12)
+    assert sequences[0, 3, 3] == 4.0 and sequences[0].sum() == 4.0
+    assert sequences[1, 0, 0] == 1.0 and sequences[1, 13, 1] == 2.0
+    assert sequences[1].sum() == 3.0
+    assert not expand_sequences(features, [], 14).any()
+
+
+def test_fill_batch_matches_compact_features(sales_db):
+    x_batch, y_batch = fill_batch(sales_db.getBatchFeatures(PAIRS), len(PAIRS), 5)
+    assert x_batch['sequences'].shape == (4, 5, 12)
+    assert x_batch['sequences'][2, 4, 4] == 2.0
+    np.testing.assert_allclose(y_batch, [3.0, 1.0, 5.0, 0.0])
+
+
+def test_concat_features_shifts_offsets(sales_db):
+    chunks = [
+        compact_batch(sales_db.getBatchFeatures(PAIRS[:2]), 2, 5),
+        compact_batch(sales_db.getBatchFeatures(PAIRS[2:]), 2, 5)
+    ]
+    features = concat_features(chunks, ids=np.array(PAIRS))
+    whole = compact_batch(sales_db.getBatchFeatures(PAIRS), len(PAIRS), 5)
+    for name, array in whole.items():
+        np.testing.assert_array_equal(features[name], array)
+
+
+def test_lookup_rows():
+    feature_ids = np.array(PAIRS)
+    np.testing.assert_array_equal(lookup_rows(feature_ids, [(2, 10), (1, 10)]), [2, 0])
+    with pytest.raises(KeyError):
+        lookup_rows(feature_ids, [(9, 9)])
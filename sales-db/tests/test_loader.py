@@ -0,0 +1,75 @@
+import threading
+import pytest
+
+from loader import PrefetchLoader
+
+
+class FakeDataset():
+
+    """
+    A dataset whose batches are their indices. Loading a batch waits for
+    its event in waits, and sets its event in sets once loaded. Loading a
+    failing index raises.
+    """
+
+    def __init__(self, num_batches, waits=None, sets=None, failing=()):
+        self.num_batches = num_batches
+        self.waits = waits or {}
+        self.sets = sets or {}
+        self.failing = set(failing)
+        self.loaded = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.num_batches
+
+    def __getitem__(self, idx):
+        if (idx in self.waits):
+            assert self.waits[idx].wait(timeout=5)
+        if (idx in self.failing):
+            raise ValueError('batch {} failed'.format(idx))
+        with self._lock:
+            self.loaded.append(idx)
+        if (idx in self.sets):
+            self.sets[idx].set()
+        return idx
+
+
+def test_batches_are_yielded_in_order_when_loaded_out_of_order():
+    # Batch 0 waits until the last batch has loaded
+    release = threading.Event()
+    dataset = FakeDataset(4, waits={0: release}, sets={3: release})
+    with PrefetchLoader(dataset, workers=4, max_queue_size=4) as loader:
+        assert list(loader) == [0, 1, 2, 3]
+        assert dataset.loaded[-1] == 0
+        stats = loader.stats()
+    assert stats['batches'] == 4
+    assert sum(worker['batches'] for worker in stats['workers'].values()) == 4
+
+
+def test_worker_errors_propagate_to_the_consumer():
+    dataset = FakeDataset(5, failing=[2])
+    batches = []
+    with PrefetchLoader(dataset, workers=2, max_queue_size=2) as loader:
+        with pytest.raises(ValueError, match='batch 2'):
+            for batch in loader:
+                batches.append(batch)
+    assert batches == [0, 1]
+
+
+def test_stopping_early_cancels_pending_batches():
+    release = threading.Event()
+    dataset = FakeDataset(10, waits={idx: release for idx in range(1, 10)})
+    loader = PrefetchLoader(dataset, workers=1, max_queue_size=4)
+    batches = iter(loader)
+    assert next(batches) == 0
+    batches.close()
+    release.set()
+    loader.close()
+    # At most the batch the worker had started is loaded after the break
+    assert max(dataset.loaded) <= 1
+    assert loader._executor is None
+
+    # The loader starts new workers for the next epoch
+    assert list(loader) == list(range(10))
+    loader.close()
@@ -0,0 +1,92 @@
+import json
+import pytest
+
+from metrics import JSONLinesSink, PrometheusSink, batch_timer, instrumented
+
+
+class FakeDB():
+
+    """ A SalesDB stand-in whose getter runs an instrumented fetch. """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    @instrumented
+    def fetch(self, sql):
+        if (sql == 'fail'):
+            raise ValueError('query failed')
+        return [(1,), (2,), (3,)]
+
+    @instrumented
+    def getIds(self):
+        return self.fetch('SELECT')
+
+
+def counter(sink, name, **labels):
+    return sink.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_prometheus_render():
+    sink = PrometheusSink(buckets=(0.1, 1.0))
+    sink.observe('salesdb_method_seconds', 0.05, {'method': 'fetch'})
+    sink.observe('salesdb_method_seconds', 0.5, {'method': 'fetch'})
+    sink.increment('salesdb_calls_total', 2, {'method': 'fetch'})
+    sink.increment('salesdb_errors_total', 1, {'method': 'say "hi"'})
+    assert sink.render().splitlines() == [
+        '# TYPE salesdb_method_seconds histogram',
+        'salesdb_method_seconds_bucket{method="fetch",le="0.1"} 1',
+        'salesdb_method_seconds_bucket{method="fetch",le="1.0"} 2',
+        'salesdb_method_seconds_bucket{method="fetch",le="+Inf"} 2',
+        'salesdb_method_seconds_sum{method="fetch"} 0.55',
+        'salesdb_method_seconds_count{method="fetch"} 2',
+        '# TYPE salesdb_calls_total counter',
+        'salesdb_calls_total{method="fetch"} 2.0',
+        '# TYPE salesdb_errors_total counter',
+        'salesdb_errors_total{method="say \\"hi\\""} 1.0'
+    ]
+
+
+def test_jsonlines_sink_appends_one_record_per_line(tmp_path):
+    path = str(tmp_path / 'metrics.jsonl')
+    sink = JSONLinesSink(path)
+    sink.observe('salesdb_method_seconds', 0.5, {'method': 'fetch'})
+    sink.increment('salesdb_calls_total')
+    sink.event('slow_query', {'sql': 'SELECT 1', 'seconds': 2.0})
+    sink.close()
+
+    with open(path) as file:
+        records = [json.loads(line) for line in file]
+    assert [record['type'] for record in records] == ['observe', 'increment', 'event']
+    assert records[0]['labels'] == {'method': 'fetch'} and records[0]['value'] == 0.5
+    assert records[1]['labels'] == {} and records[1]['value'] == 1
+    assert records[2]['record'] == {'sql': 'SELECT 1', 'seconds': 2.0}
+    assert all('time' in record for record in records)
+
+
+def test_batch_timer_observes_batches():
+    sink = PrometheusSink()
+    on_batch = batch_timer(sink, 'sales-model')
+    on_batch(0, 32, 0.002, 'features')
+    on_batch(1, 16, 0.004, 'features')
+    labels = (('generator', 'sales-model'), ('source', 'features'))
+    histogram = sink.histograms[('generator_batch_seconds', labels)]
+    assert histogram.count == 2
+    assert histogram.sum == pytest.approx(0.006)
+    assert sink.counters[('generator_samples_total', labels)] == 48
+
+
+def test_instrumented_records_the_outermost_call_only():
+    sink = PrometheusSink()
+    db = FakeDB(sink)
+    assert db.getIds() == [(1,), (2,), (3,)]
+    assert counter(sink, 'salesdb_calls_total', method='getIds') == 1
+    assert counter(sink, 'salesdb_rows_total', method='getIds') == 3
+    assert counter(sink, 'salesdb_calls_total', method='fetch') == 0
+
+    # A direct fetch is recorded under its own name
+    db.fetch('SELECT')
+    assert counter(sink, 'salesdb_calls_total', method='fetch') == 1
+    with pytest.raises(ValueError):
+        db.fetch('fail')
+    assert counter(sink, 'salesdb_errors_total', method='fetch') == 1
+    assert counter(sink, 'salesdb_calls_total', method='fetch') == 2
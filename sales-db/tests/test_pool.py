@@ -0,0 +1,163 @@
+import threading
+import psycopg2
+import pytest
+import pool as pool_module
+from pool import ConnectionPool, PoolError
+
+
+class FakeConnection():
+
+    """ A connection that can be broken, and records its queries. """
+
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+        self.status = psycopg2.extensions.STATUS_READY
+        self.queries = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.STATUS_READY
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor():
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql):
+        if (self.conn.broken):
+            raise psycopg2.OperationalError("server closed the connection")
+        self.conn.queries.append(sql)
+
+
+class FakeTime():
+
+    """ A clock that only moves when it is advanced. """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(pool_module, 'time', clock)
+    return clock
+
+
+def test_checkout_health_checks_idle_connections():
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=2)
+    conn = pool.getconn()
+    assert conn.queries == ["SELECT 1"] and conn.rollbacks == 1
+    pool.putconn(conn)
+
+    # A connection broken while idle is closed, and replaced
+    conn.broken = True
+    fresh = pool.getconn()
+    assert fresh is not conn and conn.closed
+    assert pool.size == 1
+
+
+def test_checkout_skips_the_health_check_if_disabled():
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=1, health_check=False)
+    conn = pool.getconn()
+    assert conn.queries == []
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_idle_connections_are_pruned_down_to_min_size(clock):
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=3, idle_timeout=60, health_check=False)
+    conns = [pool.getconn() for _ in range(3)]
+    for conn in conns:
+        pool.putconn(conn)
+        clock.now += 1
+    assert pool.size == 3
+
+    clock.now += 30
+    assert pool.getconn() is conns[-1]
+    pool.putconn(conns[-1])
+    assert pool.size == 3
+
+    # The oldest connections are closed first, and min_size are kept
+    clock.now += 61
+    assert pool.getconn() is conns[-1]
+    assert conns[0].closed and conns[1].closed
+    assert pool.size == 1
+
+
+def test_checkout_times_out_when_the_pool_is_full():
+    pool = ConnectionPool(
+        FakeConnection, min_size=0, max_size=1, checkout_timeout=0.05, health_check=False)
+    conn = pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+
+def test_putconn_discards_broken_connections():
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=2, health_check=False)
+    broken, busy = pool.getconn(), pool.getconn()
+    broken.close()
+    pool.putconn(broken)
+    assert pool.size == 1
+
+    # An open transaction is rolled back before the connection is reused
+    busy.status = psycopg2.extensions.STATUS_IN_TRANSACTION
+    pool.putconn(busy)
+    assert busy.rollbacks == 1 and not busy.closed
+    assert pool.getconn() is busy
+
+
+def test_closed_pool_refuses_checkouts():
+    pool = ConnectionPool(FakeConnection, min_size=1, max_size=2, health_check=False)
+    conn = pool.getconn()
+    pool.close()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    pool.putconn(conn)
+    assert conn.closed and pool.size == 0
+
+
+def test_resize_wakes_waiting_checkouts():
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=1, health_check=False)
+    first = pool.getconn()
+    checked_out = []
+    waiter = threading.Thread(target=lambda: checked_out.append(pool.getconn()))
+    waiter.start()
+    pool.resize(2)
+    waiter.join(timeout=5)
+    assert len(checked_out) == 1 and checked_out[0] is not first
+    assert pool.size == 2
+
+
+def test_resize_closes_connections_over_the_maximum():
+    pool = ConnectionPool(FakeConnection, min_size=0, max_size=3, health_check=False)
+    conns = [pool.getconn() for _ in range(3)]
+    pool.putconn(conns[0])
+    pool.resize(1)
+    assert conns[0].closed and pool.size == 2
+    pool.putconn(conns[1])
+    assert conns[1].closed and pool.size == 1
+    pool.putconn(conns[2])
+    assert not conns[2].closed and pool.size == 1
+    with pytest.raises(ValueError):
+        pool.resize(0)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from quantiles import (
+    QuantileSketch, load_boundaries, quantile_levels, save_boundaries, sketch_chunks
+)
+
+
+def test_quantile_levels():
+    np.testing.assert_allclose(quantile_levels(4), [0.25, 0.5, 0.75])
+    with pytest.raises(ValueError):
+        quantile_levels(1)
+
+
+def test_sketch_estimates_quantiles_in_bounded_memory():
+    values = np.random.default_rng(0).uniform(0, 1000, 100000)
+    sketch = sketch_chunks(np.array_split(values, 50), capacity=256)
+    assert len(sketch.values) <= 256
+    assert sketch.count == len(values)
+    levels = quantile_levels(8)
+    np.testing.assert_allclose(sketch.quantiles(levels), np.quantile(values, levels), atol=10)
+    assert sketch.quantiles([0.0, 1.0]).tolist() == [values.min(), values.max()]
+
+
+def test_merged_sketches_summarize_both_streams():
+    rng = np.random.default_rng(1)
+    low, high = rng.uniform(0, 1, 5000), rng.uniform(1, 2, 5000)
+    sketch = QuantileSketch(128).update(low).merge(QuantileSketch(128).update(high))
+    assert sketch.count == 10000
+    assert abs(sketch.quantiles([0.5])[0] - 1.0) < 0.05
+
+
+def test_sketch_ignores_nan_and_handles_empty_streams():
+    sketch = QuantileSketch().update([np.nan, 1.0, 3.0, np.nan])
+    assert sketch.count == 2
+    assert sketch.boundaries(2) == [2.0]
+    assert np.isnan(QuantileSketch().quantiles([0.5])).all()
+
+
+def test_boundaries_are_cached_with_their_config(tmp_path):
+    path = str(tmp_path / 'preprocessing.json')
+    assert load_boundaries(path, num_bins=4) is None
+    save_boundaries(path, [1.0, 2.0, 3.0], num_bins=4, prices='abc')
+    assert load_boundaries(path, num_bins=4, prices='abc') == [1.0, 2.0, 3.0]
+    assert load_boundaries(path, num_bins=4, prices='def') is None
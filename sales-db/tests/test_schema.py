@@ -0,0 +1,114 @@
+import schema
+
+
+def test_data_type_strips_column_constraints():
+    assert schema._data_type("smallint NOT NULL") == "smallint"
+    assert schema._data_type("character varying (64)") == "character varying"
+    assert schema._data_type("timestamp with time zone DEFAULT now()") == "timestamp with time zone"
+    assert schema._data_type("numeric NULL") == "numeric"
+
+
+def test_declared_types_are_information_schema_types():
+    for table in schema.TABLES:
+        for name, col_type in table.columns:
+            data_type = schema._data_type(col_type)
+            assert "DEFAULT" not in data_type and "NULL" not in data_type, (table.name, name)
+
+
+# The data types postgres reports in information_schema for each declared type
+REPORTED_TYPES = {
+    "smallint": "smallint",
+    "smallint NOT NULL": "smallint",
+    "integer NOT NULL": "integer",
+    "date NOT NULL": "date",
+    "numeric": "numeric",
+    "numeric NOT NULL": "numeric",
+    "real NOT NULL": "real",
+    "character varying (64)": "character varying",
+    "character varying (256)": "character varying",
+    "timestamp with time zone DEFAULT now()": "timestamp with time zone"
+}
+
+
+class FakeCursor():
+
+    """ Answers the catalog queries run by schema.verify. """
+
+    def __init__(self, columns, indexes, version):
+        self.columns = columns
+        self.indexes = indexes
+        self.version = version
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, values=None):
+        if ("information_schema.columns" in sql):
+            self.results = list(self.columns.get(values[0], {}).items())
+        elif ("pg_indexes" in sql):
+            self.results = [(name,) for name in self.indexes]
+        elif ("to_regclass" in sql):
+            self.results = [(None if self.version is None else "schema_migrations",)]
+        else:
+            self.results = [(self.version,)]
+
+    def fetchall(self):
+        return self.results
+
+    def fetchone(self):
+        return self.results[0]
+
+
+class FakeDB():
+
+    def __init__(self, curs):
+        self.curs = curs
+
+    def connection(self):
+        db = self
+
+        class Connection():
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def cursor(self):
+                return db.curs
+
+        return Connection()
+
+
+def applied_schema():
+    """ Returns the columns and indexes of a fully migrated database. """
+    columns = {
+        table.name: {name: REPORTED_TYPES[col_type] for name, col_type in table.columns}
+        for table in schema.TABLES
+    }
+    return columns, [index.name for index in schema.INDEXES]
+
+
+def test_verify_accepts_the_declared_schema():
+    columns, indexes = applied_schema()
+    curs = FakeCursor(columns, indexes, schema.MIGRATIONS[-1][0])
+    assert schema.verify(FakeDB(curs)) == []
+
+
+def test_verify_reports_every_difference():
+    columns, indexes = applied_schema()
+    del columns["forecasts"]
+    del columns["sales"]["item_price"]
+    columns["items"]["item_id"] = "bigint"
+    curs = FakeCursor(columns, indexes[1:], None)
+    assert schema.verify(FakeDB(curs)) == [
+        "column items.item_id is bigint, expected integer",
+        "missing column sales.item_price",
+        "missing table forecasts",
+        "missing index {}".format(schema.INDEXES[0].name),
+        "schema version is None, expected {}".format(schema.MIGRATIONS[-1][0])
+    ]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from splits import group_split, split_bounds, split_indices, time_split
+
+
+def test_split_bounds_normalizes_fractions():
+    np.testing.assert_array_equal(split_bounds(10, (0.8, 0.2)), [0, 8, 10])
+    np.testing.assert_array_equal(split_bounds(10, (4, 1)), [0, 8, 10])
+    with pytest.raises(ValueError):
+        split_bounds(10, (-1, 2))
+    with pytest.raises(ValueError):
+        split_bounds(10, ())
+
+
+def test_split_indices_partitions_every_sample():
+    train, test = split_indices(100, (0.8, 0.2), shuffle=True, seed=1)
+    assert len(train) == 80 and len(test) == 20
+    assert sorted(np.concatenate([train, test])) == list(range(100))
+
+    # Splits are reproducible from the seed
+    again, _ = split_indices(100, (0.8, 0.2), shuffle=True, seed=1)
+    np.testing.assert_array_equal(train, again)
+
+
+def test_split_indices_without_shuffle_are_ranges():
+    train, val, test = split_indices(10, (0.6, 0.2, 0.2), shuffle=False)
+    assert list(train) == list(range(6))
+    assert list(val) == [6, 7] and list(test) == [8, 9]
+
+
+def test_group_split_keeps_groups_together():
+    groups = np.repeat(np.arange(10), 5)
+    train, test = group_split(groups, (0.8, 0.2), shuffle=True, seed=0)
+    assert len(train) + len(test) == len(groups)
+    assert not set(groups[train]) & set(groups[test])
+    assert len(test) == 10
+
+
+def test_time_split_by_cutoffs():
+    date_blocks = np.array([0, 5, 10, 15, 20, 25])
+    before, middle, after = time_split(date_blocks, [10, 20])
+    assert list(before) == [0, 1]
+    assert list(middle) == [2, 3]
+    assert list(after) == [4, 5]
+    with pytest.raises(ValueError):
+        time_split(date_blocks, [20, 10])
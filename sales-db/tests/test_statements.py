@@ -0,0 +1,99 @@
+import psycopg2
+import pytest
+
+from statements import Statement, StatementRegistry
+
+
+class FakeConnection():
+
+    """ A connection that records the queries run on it. """
+
+    def __init__(self, prepared=()):
+        self.queries = []
+        self.prepared = set(prepared)
+
+
+class FakeCursor():
+
+    """
+    A cursor that records its queries on its connection. Preparing a
+    statement the connection already has raises DuplicatePreparedStatement.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, values=None):
+        self.connection.queries.append((sql, values))
+        if (sql.startswith('PREPARE')):
+            name = sql.split()[1]
+            if (name in self.connection.prepared):
+                raise psycopg2.errors.DuplicatePreparedStatement('already exists')
+            self.connection.prepared.add(name)
+
+
+SALES = Statement(
+    'sales_data',
+    'SELECT date_block_num, item_cnt FROM sales_monthly WHERE shop_id = %s AND item_id = %s',
+    ['integer', 'integer']
+)
+
+
+def test_prepare_sql_numbers_parameters():
+    assert SALES.prepare_sql() == \
+        'PREPARE sales_data (integer, integer) AS SELECT date_block_num, item_cnt ' \
+        'FROM sales_monthly WHERE shop_id = $1 AND item_id = $2'
+    assert SALES.execute_sql() == 'EXECUTE sales_data (%s, %s)'
+    assert Statement('shops', 'SELECT shop_id FROM shops', []).prepare_sql() == \
+        'PREPARE shops AS SELECT shop_id FROM shops'
+
+
+def test_prepare_sql_unescapes_literal_percent_signs():
+    statement = Statement(
+        'like', "SELECT item_id FROM items WHERE item_name LIKE '%%s' || %s", ['text'])
+    # The escaped %% before the s is not a parameter
+    assert statement.prepare_sql() == \
+        "PREPARE like (text) AS SELECT item_id FROM items WHERE item_name LIKE '%s' || $1"
+
+
+def test_prepare_sql_checks_the_parameter_types():
+    with pytest.raises(ValueError):
+        Statement('bad', 'SELECT %s, %s', ['integer']).prepare_sql()
+
+
+def test_statements_are_prepared_once_per_connection():
+    registry = StatementRegistry([SALES])
+    first, second = FakeConnection(), FakeConnection()
+    assert registry.execute(FakeCursor(first), SALES, (1, 2))
+    assert not registry.execute(FakeCursor(first), SALES, (1, 3))
+    assert registry.execute(FakeCursor(second), SALES, (1, 2))
+
+    assert [sql.split()[0] for sql, _ in first.queries] == ['PREPARE', 'EXECUTE', 'EXECUTE']
+    assert first.queries[-1] == ('EXECUTE sales_data (%s, %s)', (1, 3))
+    assert registry.stats()['sales_data'] == {
+        'prepares': 2,
+        'executions': 3,
+        'reused': 1,
+        'reuse_ratio': 1 / 3
+    }
+
+
+def test_registry_rejects_unknown_and_duplicate_statements():
+    registry = StatementRegistry([SALES])
+    with pytest.raises(ValueError):
+        registry.register(Statement('sales_data', 'SELECT 1', []))
+    with pytest.raises(KeyError):
+        registry.execute(FakeCursor(FakeConnection()), Statement('other', 'SELECT 1', []))
+
+
+def test_statements_prepared_behind_the_registry_are_remembered():
+    registry = StatementRegistry([SALES])
+    conn = FakeConnection(prepared=['sales_data'])
+    with pytest.raises(psycopg2.errors.DuplicatePreparedStatement):
+        registry.execute(FakeCursor(conn), SALES, (1, 2))
+    # The retry executes without preparing again
+    assert not registry.execute(FakeCursor(conn), SALES, (1, 2))
+
+    registry.forget(conn)
+    conn.prepared.clear()
+    assert registry.execute(FakeCursor(conn), SALES, (1, 2))
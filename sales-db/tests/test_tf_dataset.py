@@ -0,0 +1,28 @@
+import numpy as np
+from tf_dataset import make_dataset
+
+
+def load(rows):
+    rows = np.asarray(rows)
+    x_batch = {
+        'categories': rows,
+        'prices': rows.astype('float32'),
+        'sequences': np.zeros((len(rows), 3, 12), dtype='float32')
+    }
+    return x_batch, rows.astype('float32')
+
+
+def epoch(dataset):
+    return np.concatenate([y_batch.numpy() for _, y_batch in dataset]).astype('int64')
+
+
+def test_cached_samples_are_reshuffled_from_a_bounded_buffer():
+    dataset = make_dataset(load, 200, 3, batch_size=4, shuffle_buffer=8, cache='')
+    first, second = epoch(dataset), epoch(dataset)
+    assert sorted(first) == list(range(200)) and sorted(second) == list(range(200))
+    assert list(first) != list(range(200)) and list(first) != list(second)
+
+
+def test_unshuffled_dataset_keeps_sample_order():
+    dataset = make_dataset(load, 10, 3, batch_size=4, shuffle=False)
+    assert list(epoch(dataset)) == list(range(10))
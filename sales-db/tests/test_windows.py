@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from features import build_features
+from windows import SlidingWindows, monthly_matrix
+
+
+@pytest.fixture
+def features(sales_db):
+    return build_features(sales_db, sales_db.getIds(), 6, targets=False)
+
+
+def test_monthly_matrix(features):
+    monthly = monthly_matrix(features, 6)
+    np.testing.assert_allclose(monthly, [
+        [1, 2, 0, 0, 0, 3],
+        [0, 0, 4, 1, 0, 0],
+        [0, 0, 0, 0, 2, 5]
+    ])
+    monthly = monthly_matrix(features, 5, target_month=4)
+    assert monthly.shape == (3, 5) and not monthly[:, 4].any()
+
+
+def test_samples_start_at_the_first_sale(features):
+    windows = SlidingWindows(features, 6, 3)
+    assert windows.num_windows == 3 and len(windows) == 9
+    # The first window of row 2 forecasts month 3, before its first sale
+    np.testing.assert_array_equal(windows.samples(), [0, 1, 2, 3, 4, 5, 7, 8])
+    np.testing.assert_array_equal(windows.samples([2], since_first_sale=False), [6, 7, 8])
+    np.testing.assert_array_equal(windows.rows([4, 7]), [1, 2])
+    np.testing.assert_array_equal(windows.target_months([0, 7, 8]), [3, 4, 5])
+
+
+def test_gather_copies_the_windows_of_a_batch(features):
+    windows = SlidingWindows(features, 6, 3)
+    x_batch, y_batch = windows.gather([8, 0])
+    np.testing.assert_allclose(y_batch, [5.0, 0.0])
+    np.testing.assert_array_equal(x_batch['categories'], [5, 5])
+    sequences = x_batch['sequences']
+    assert sequences.shape == (2, 3, 12)
+    # Sample 8 holds months 2 to 4 of row 2
+    assert sequences[0, 2, 4] == 2.0 and sequences[0].sum() == 2.0
+    assert sequences[1, 0, 0] == 1.0 and sequences[1, 1, 1] == 2.0
+
+
+def test_strided_windows_with_horizon(features):
+    windows = SlidingWindows(features, 6, 2, stride=2, horizon=2)
+    assert windows.num_windows == 2
+    np.testing.assert_array_equal(windows.start_months([0, 1]), [0, 2])
+    np.testing.assert_array_equal(windows.target_months([0, 1]), [3, 5])
+    _, y_batch = windows.gather([1, 3, 5])
+    np.testing.assert_allclose(y_batch, [3.0, 0.0, 5.0])
+    with pytest.raises(ValueError):
+        SlidingWindows(features, 6, 5, horizon=2)
+    with pytest.raises(ValueError):
+        SlidingWindows(features, 6, 2, stride=0)
@@ -1,7 +1,118 @@
-import random
+import os
+import sys
+import time
+import hashlib
 import numpy as np
 import pandas as pd
 import tensorflow as tf
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.append(os.getenv("SALES_DB_DIR"))
+from feature_cache import FeatureCache, file_fingerprint
+from features import gather_batch
+from quantiles import load_boundaries, save_boundaries, sketch_chunks
+from splits import GROUP_COLUMNS, group_split, split_indices, time_split
+from tf_dataset import make_dataset
+from windows import SlidingWindows
+
+
+# The narrow dtypes of the sales csv columns used to build features
+SALES_DTYPES = {
+    'date_block_num': 'int8',
+    'shop_id': 'int16',
+    'item_id': 'int32',
+    'item_price': 'float32',
+    'item_cnt_day': 'float32'
+}
+
+PAIR = ['shop_id', 'item_id']
+MONTH = ['shop_id', 'item_id', 'date_block_num']
+
+
+def read_sales(sales_path, chunk_rows=1 << 20, engine='auto'):
+    """
+    Yields the sales csv file in chunks of about chunk_rows rows, with only
+    the columns in SALES_DTYPES and their narrow dtypes.
+
+    Args:
+        sales_path: The path to the sales csv file.
+        chunk_rows: The number of rows in each chunk.
+        engine: 'pyarrow' to stream the file with pyarrow's csv reader, 'c'
+            for the pandas csv parser, or 'auto' to use pyarrow if it is
+            installed.
+    """
+    if (engine == 'auto'):
+        try:
+            import pyarrow.csv
+            engine = 'pyarrow'
+        except ImportError:
+            engine = 'c'
+
+    if (engine == 'pyarrow'):
+        import pyarrow
+        import pyarrow.csv
+        reader = pyarrow.csv.open_csv(
+            sales_path,
+            # Sales rows are about 40 bytes long
+            read_options=pyarrow.csv.ReadOptions(block_size=chunk_rows * 40),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=list(SALES_DTYPES),
+                column_types={
+                    name: pyarrow.from_numpy_dtype(np.dtype(dtype))
+                    for name, dtype in SALES_DTYPES.items()
+                }
+            )
+        )
+        for batch in reader:
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(
+            sales_path,
+            usecols=list(SALES_DTYPES),
+            dtype=SALES_DTYPES,
+            chunksize=chunk_rows,
+            engine=engine
+        )
+
+
+def aggregate_sales(chunks, max_partial_rows=1 << 22):
+    """
+    Aggregates chunks of sales into a monthly rollup, one chunk at a time,
+    so only the rollup is held in memory.
+
+    Args:
+        chunks: An iterable of sales dataframes.
+        max_partial_rows: The number of partially aggregated rows held
+            before they are merged.
+
+    Returns:
+        A dataframe of item_cnt_day, price_sum and price_count indexed by
+        shop_id, item_id and date_block_num, sorted by its index.
+    """
+    partials = []
+    num_rows = 0
+    for chunk in chunks:
+        chunk = chunk.assign(price_sum=chunk['item_price'].astype('float64'))
+        partial = chunk.groupby(MONTH, sort=False).agg(
+            item_cnt_day=('item_cnt_day', 'sum'),
+            price_sum=('price_sum', 'sum'),
+            price_count=('price_sum', 'size')
+        )
+        partials.append(partial)
+        num_rows += len(partial)
+        if (num_rows > max_partial_rows):
+            # Merge the partial rollups of the chunks read so far
+            partials = [pd.concat(partials).groupby(level=MONTH, sort=False).sum()]
+            num_rows = len(partials[0])
+
+    if (not partials):
+        index = pd.MultiIndex.from_arrays([[], [], []], names=MONTH)
+        return pd.DataFrame(
+            {'item_cnt_day': [], 'price_sum': [], 'price_count': []},
+            index=index
+        )
+    return pd.concat(partials).groupby(level=MONTH).sum()
 
 
 class DataGenerator(tf.keras.utils.PyDataset):
@@ -16,155 +127,441 @@ class DataGenerator(tf.keras.utils.PyDataset):
             sales_path=None,
             items_path=None,
             batches='auto',
+            features=None,
+            indices=None,
+            lazy=False,
             batch_size=32,
             seq_len=33,
             shuffle=True,
             seed=0,
+            cache_dir=None,
+            on_batch=None,
+            window=None,
+            stride=1,
+            horizon=1,
+            windows=None,
             **krwags
         ):
         """
         Args:
             sales_path: The path to the sales csv file.
             items_path: The path to the items csv file.
-            batches: If set to auto, the data is loaded, preprocessed, and
-                batched from the sales and items csv files. Otherwise, batches
-                is set with a list of batches.
+            batches: If set to auto, the data is loaded and preprocessed from
+                the sales and items csv files. Otherwise, batches is set with
+                a list of batches.
+            features: A dictionary of compact feature arrays shared with
+                another generator. If set, the
+                csv files and batches are ignored.
+            indices: The rows of features served by the generator, or its
+                window samples if it is windowed. Defaults to every row, or
+                every window since the first sale of each pair.
+            lazy: If True, the compact features are stored once and each
+                batch is gathered and expanded on demand, as a dictionary of
+                sequences, categories and prices and the targets. Otherwise,
+                every batch is built up front as a ((sequences, categories,
+                prices), targets) tuple. Splitting by shop, item or cutoffs,
+                windows, cache_dir and to_tf_dataset need a lazy generator.
             batch_size: The size of each batch of data. If the number of
                 ids is not a multiple of the batch size, the last batch is 
                 smaller.
             seq_len: The length of each sequence of monthly sales data.
             shuffle: If True, shuffles the data with seed value.
             seed: Seed value used to shuffle data.
+            cache_dir: If set in lazy mode, the features are cached in
+                cache_dir and opened as memory maps on later runs. The cache
+                is rebuilt when the csv files or seq_len change.
+            on_batch: An optional function called after each batch with
+                the batch index, number of samples, elapsed seconds, and
+                source, "features" or "batches". metrics.batch_timer
+                returns one that records into a metrics sink.
+            window: If set in lazy mode, each pair yields a sample for
+                every window of this many months, instead of one sample of
+                seq_len months. Windows are strided views over a monthly
+                matrix of the seq_len months and the target month.
+            stride: The number of months between the starts of windows.
+            horizon: The number of months between the end of a window and
+                its target month.
+            windows: A SlidingWindows instance shared with another data
+                generator.
         """
         super().__init__(**krwags)
 
         self.batch_size = batch_size
         self.seq_len = seq_len
+        self.on_batch = on_batch
+        self.features = None
+        self.batches = None
 
-        # Batch data
-        if (batches == 'auto'):
-            # Load sales data
-            sales_df = pd.read_csv(sales_path)
-
-            # Load item items
-            items_df = pd.read_csv(
-                items_path,
-                usecols=['item_id', 'item_category_id'],
-                index_col=['item_id']
-            )
-            data = {'items': items_df}
-
-            # Group item prices
-            prices_df = sales_df[['shop_id', 'item_id', 'item_price']]
-            prices_df = prices_df.groupby(
-                by=['shop_id', 'item_id']
-            ).agg('mean')
-            data['prices'] = prices_df
-
-            # Drop date and item_price from dataframe
-            sales_df.drop(columns=['date', 'item_price'], inplace=True)
-
-            # Group item count
-            sales_df = sales_df.groupby(
-                by=['shop_id', 'item_id', 'date_block_num']
-            ).agg('sum')
-            data['sales'] = sales_df
-
-            # Get and store batches of data
-            self.batches = self.batch_data(data)
+        if (windows is not None):
+            # Share the windows of another generator
+            self.features = windows.features
+        elif (features is not None):
+            # Share the features of another generator
+            self.features = features
+        elif (batches == 'auto'):
+            if (lazy and cache_dir):
+                # Open the cached features, building them if needed
+                self.features = FeatureCache(cache_dir).get_or_build(
+                    lambda: self.build_features(self.load_data(sales_path, items_path)),
+                    file_fingerprint(sales_path, items_path),
+                    seq_len=seq_len,
+                    prices='mean'
+                )
+            elif (lazy):
+                # Store the features, and gather batches on demand
+                self.features = self.build_features(self.load_data(sales_path, items_path))
+            else:
+                # Get and store batches of data
+                self.batches = self.batch_data(self.load_data(sales_path, items_path))
         else:
             # Store batches
             self.batches = batches
+        self.lazy = self.features is not None
+        if (window is not None and not self.lazy):
+            raise ValueError('only lazy DataGenerators can be windowed')
+        if (window is not None and windows is None):
+            windows = SlidingWindows(
+                self.features, seq_len + 1, window, stride, horizon, target_month=seq_len)
+        self.windows = windows
         
         self.shuffle = shuffle
         self.seed = seed
 
-        # Shuffle data
+        if (self.lazy):
+            if (indices is None and self.windows is not None):
+                indices = self.windows.samples()
+            elif (indices is None):
+                indices = np.arange(len(self.features['targets']))
+            self.indices = indices
+
+        # Shuffle data, without changing the given indices or batches
         if (shuffle):
-            random.seed(seed)
-            random.shuffle(self.batches)
+            rng = np.random.default_rng(seed)
+            if (self.lazy):
+                self.indices = rng.permutation(self.indices)
+            else:
+                self.batches = [self.batches[i] for i in rng.permutation(len(self.batches))]
 
     def __len__(self):
         """ Returns the number of batches. """
+        if (self.lazy):
+            return int(np.ceil(len(self.indices) / self.batch_size))
         return len(self.batches)
     
     def __getitem__(self, idx):
         """ Gets the idx'th batch of data. """
-        return self.batches[idx]
-    
+        start = time.perf_counter()
+        if (self.windows is not None):
+            # Gather the windows from the monthly matrix
+            samples = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
+            batch = self.windows.gather(samples)
+            num_samples, source = len(samples), 'windows'
+        elif (self.lazy):
+            # Gather the batch from the feature arrays
+            rows = self.indices[idx * self.batch_size:(idx + 1) * self.batch_size]
+            batch = gather_batch(self.features, rows, self.seq_len)
+            num_samples, source = len(rows), 'features'
+        else:
+            batch = self.batches[idx]
+            num_samples, source = len(batch[1]), 'batches'
+
+        if (self.on_batch is not None):
+            self.on_batch(idx, num_samples, time.perf_counter() - start, source)
+        return batch
+
+    def to_tf_dataset(
+            self,
+            shuffle=None,
+            shuffle_buffer=None,
+            cache=None,
+            num_parallel_calls=tf.data.AUTOTUNE,
+            prefetch=tf.data.AUTOTUNE
+        ):
+        """
+        Returns a tf.data.Dataset of the data generator's batches, gathered
+        from the features by a parallel map and prefetched ahead of
+        training. Only lazy data generators hold the features needed.
+
+        Args:
+            shuffle: If True, samples are reshuffled every epoch. Defaults
+                to the data generator's shuffle.
+            shuffle_buffer: The number of samples in the shuffle buffer.
+                Defaults to every sample index, or to
+                tf_dataset.SHUFFLE_BATCHES batches of cached samples.
+            cache: A file to cache loaded samples in, or an empty string to
+                cache them in memory.
+            num_parallel_calls: The number of batches loaded in parallel.
+            prefetch: The number of batches prepared ahead of training.
+        """
+        if (not self.lazy):
+            raise ValueError('to_tf_dataset needs a lazy DataGenerator')
+
+        seq_len = self.seq_len
+        if (self.windows is not None):
+            seq_len = self.windows.window
+
+            def load(positions):
+                return self.windows.gather(self.indices[positions])
+        else:
+            def load(positions):
+                return gather_batch(self.features, self.indices[positions], self.seq_len)
+
+        return make_dataset(
+            load,
+            len(self.indices),
+            seq_len,
+            batch_size=self.batch_size,
+            shuffle=self.shuffle if shuffle is None else shuffle,
+            shuffle_buffer=shuffle_buffer,
+            seed=self.seed,
+            cache=cache,
+            num_parallel_calls=num_parallel_calls,
+            prefetch=prefetch
+        )
+
+    def load_data(self, sales_path, items_path, chunk_rows=1 << 20, engine='auto'):
+        """
+        Loads the items, prices and monthly sales dataframes from the sales
+        and items csv files. The sales file is streamed in chunks and
+        aggregated as it is read, so it may be larger than memory.
+
+        Args:
+            sales_path: The path to the sales csv file.
+            items_path: The path to the items csv file.
+            chunk_rows: The number of sales rows read at a time.
+            engine: The csv engine passed to read_sales.
+        """
+        # Load item items
+        items_df = pd.read_csv(
+            items_path,
+            usecols=['item_id', 'item_category_id'],
+            index_col=['item_id'],
+            dtype={'item_id': 'int32', 'item_category_id': 'int32'}
+        )
+        data = {'items': items_df}
+
+        # Aggregate sales data into monthly item counts and price sums
+        rollup = aggregate_sales(read_sales(sales_path, chunk_rows, engine))
+        data['sales'] = rollup[['item_cnt_day']].astype('float32')
+
+        # Average item prices over every sale of each pair
+        prices = rollup[['price_sum', 'price_count']].groupby(level=PAIR).sum()
+        data['prices'] = pd.DataFrame({
+            'item_price': (prices['price_sum'] / prices['price_count']).astype('float32')
+        })
+
+        return data
+
     def batch_data(self, data):
         """ Batches data. """
-        # Get unique shop and item id pairs
-        ids = data['sales'].index.droplevel('date_block_num')
-        ids = list(ids.unique())
+        features = self.build_features(data)
+        num_samples = len(features['targets'])
 
-        # Create batches
+        # Create batches of dense feature arrays
         batches = []
-        num_batches = np.ceil(len(ids) / self.batch_size).astype('int32')
-
-        # Create progress bar
-        prog_bar =tf.keras.utils.Progbar(num_batches)
-
-        for idx in range(num_batches):
-            low = idx * self.batch_size
-            high = min((idx + 1)* self.batch_size, len(ids))
-            num_samples = high - low
-
-            # Create batch
-            sales_batch = np.zeros((num_samples, self.seq_len, 12), dtype='float32')
-            items_batch = np.empty(num_samples, dtype='int32')
-            prices_batch = np.empty(num_samples, dtype='float32')
-            y_batch = np.empty(num_samples)
-
-            for i, (shop_id, item_id) in enumerate(ids[low:high]):
-                # Create sales sequence
-                sales = data['sales'].loc[shop_id, item_id,:]
-                seq = np.zeros((self.seq_len+1,12))
-                for date_block_num, item_cnt in sales.itertuples():
-                    seq[date_block_num, date_block_num%12] += item_cnt
-                
-                # Add add sequence to sales_batch and y_batch
-                sales_batch[i] = seq[:-1]
-                y_batch[i] = np.sum(seq[-1])
-
-                # Add category id to items_batch
-                items_batch[i] = data['items'].loc[item_id]
-
-                # Add price to price_batch
-                prices_batch[i] = data['prices'].loc[(shop_id, item_id)]
-            
-                batches.append(((sales_batch, items_batch, prices_batch), y_batch))
-            
-            # Update progress bar
-            prog_bar.update(idx)
-        
+        for low in range(0, num_samples, self.batch_size):
+            high = min(low + self.batch_size, num_samples)
+            x_batch, y_batch = gather_batch(features, np.arange(low, high), self.seq_len)
+            batches.append((
+                (
+                    x_batch['sequences'],
+                    x_batch['categories'],
+                    x_batch['prices']
+                ),
+                y_batch
+            ))
+
         return batches
 
+    def build_features(self, data):
+        """
+        Builds the compact features of every shop and item id pair at once.
+        The months with sales of the i'th pair are stored in
+        date_blocks[offsets[i]:offsets[i + 1]], with their item counts in
+        counts, and are expanded into dense sequences one batch at a time.
+
+        Args:
+            data: A dictionary of the items, prices and sales dataframes.
+
+        Returns:
+            A dictionary of ids, categories, prices, offsets, date_blocks,
+            counts and targets arrays, with one row for each shop and item id
+            pair.
+        """
+        # Factorize shop and item id pairs into dense row indices
+        sales = data['sales']['item_cnt_day']
+        pairs = sales.index.droplevel('date_block_num')
+        rows, ids = pd.factorize(pairs)
+        # Factorizing drops the level names of the pairs
+        ids = ids.set_names(pairs.names)
+        date_blocks = sales.index.get_level_values('date_block_num').to_numpy()
+        item_cnts = sales.to_numpy(dtype='float32')
+
+        # Sales are sorted by pair and month, so the months before seq_len
+        # are already laid out pair by pair
+        month = date_blocks < self.seq_len
+        target = date_blocks == self.seq_len
+        offsets = np.zeros(len(ids) + 1, dtype='int64')
+        offsets[1:] = np.cumsum(np.bincount(rows[month], minlength=len(ids)))
+        targets = np.bincount(rows[target], weights=item_cnts[target], minlength=len(ids))
+
+        # Gather category ids and prices
+        item_ids = ids.get_level_values('item_id')
+        categories = data['items']['item_category_id'].reindex(item_ids)
+        prices = data['prices']['item_price'].reindex(ids)
+
+        return {
+            'ids': np.stack([
+                ids.get_level_values('shop_id').to_numpy(dtype='int32'),
+                item_ids.to_numpy(dtype='int32')
+            ], axis=1),
+            'categories': categories.to_numpy(dtype='int32'),
+            'prices': prices.to_numpy(dtype='float32'),
+            'offsets': offsets,
+            'date_blocks': date_blocks[month].astype('int16'),
+            'counts': item_cnts[month],
+            'targets': targets.astype('float32')
+        }
+
     def split_generator(self, frac=0.2, shuffle=True, seed=0):
         """
         Removes a fraction of the data from the data generator, and returns a
         new DataGenerator with the removed data and the same attributes. If 
         shuffle is set to False split_generator removes and adds the last data
-        points from the data generator.
+        points from the data generator. Use split to keep the data generator
+        unchanged.
         """
-        num_batches = len(self)
-        num_samples = int(frac * len(self.batches))
-        # Sample batches
-        sample_batches = []
-        if (shuffle):
-            # Remove and add the ids randomly from the data generator
-            random.seed(seed)
-            for i in reversed(range(num_batches-num_samples, num_batches)):
-                sample_batches.append(self.batches.pop(random.randrange(i)))
+        num_items = len(self.indices) if self.lazy else len(self.batches)
+        keep, sample = split_indices(num_items, (1 - frac, frac), shuffle, seed)
+        if (self.lazy):
+            indices = self.indices
+            self.indices = indices[keep]
+            return self.subset(indices[sample])
+        batches = self.batches
+        self.batches = [batches[i] for i in keep]
+        return self.subset([batches[i] for i in sample])
+
+    def split(self, fracs=(0.8, 0.2), by=None, cutoffs=None, shuffle=True, seed=None):
+        """
+        Splits the data generator's samples into new DataGenerators sharing
+        its features. The data generator itself is not changed, and the
+        splits are reproducible from the seed. Eager data generators are
+        split by batch.
+
+        Args:
+            fracs: The fraction of samples in each split.
+            by: None to split samples independently, or 'shop' or 'item' to
+                keep every pair of a shop or item in the same split.
+            cutoffs: If set, pairs are split by the date block of their
+                first sale instead, as in splits.time_split, and fracs, by
+                and shuffle are ignored. Windows are split by their target
+                month, so every training target comes before every
+                validation target.
+            shuffle: If True, samples are assigned to splits at random.
+            seed: Seed value of the split. Defaults to the data generator's
+                seed.
+
+        Returns:
+            A list of DataGenerators, one for each split.
+        """
+        seed = self.seed if seed is None else seed
+        if (not self.lazy):
+            if (by is not None or cutoffs is not None):
+                raise ValueError('eager DataGenerators can only be split by batch')
+            splits = split_indices(len(self.batches), fracs, shuffle, seed)
+            return [self.subset([self.batches[i] for i in idx]) for idx in splits]
+
+        rows = self.indices
+        if (self.windows is not None):
+            rows = self.windows.rows(self.indices)
+        if (cutoffs is not None and self.windows is not None):
+            splits = time_split(self.windows.target_months(self.indices), cutoffs)
+        elif (cutoffs is not None):
+            splits = time_split(self.first_date_blocks()[self.indices], cutoffs)
+        elif (by is None):
+            splits = split_indices(len(self.indices), fracs, shuffle, seed)
         else:
-            # Remove and add the last ids from the data generator
-            for i in range(num_samples):
-                sample_batches.append(self.batches.pop())
+            groups = self.features['ids'][rows, GROUP_COLUMNS[by]]
+            splits = group_split(groups, fracs, shuffle, seed)
+        return [self.subset(self.indices[idx]) for idx in splits]
+
+    def iter_prices(self, chunk_rows=1 << 16):
+        """
+        Yields the mean item prices of the data generator's samples in
+        chunks, in feature row order if it is lazy, or batch by batch.
+        """
+        if (not self.lazy):
+            # Eager batches are ((sequences, categories, prices), targets)
+            for x_batch, _ in self.batches:
+                yield np.asarray(x_batch[2]).ravel()
+            return
+        if (self.windows is not None):
+            rows = np.unique(self.windows.rows(self.indices))
+        else:
+            rows = np.sort(self.indices)
+        for i in range(0, len(rows), chunk_rows):
+            yield self.features['prices'][rows[i:i + chunk_rows]]
+
+    def price_boundaries(self, num_bins=16, cache_path=None, chunk_rows=1 << 16):
+        """
+        Returns the bin boundaries of the data generator's mean item prices,
+        for Discretization(bin_boundaries=...). The prices are summarized
+        chunk by chunk with a QuantileSketch, so only O(num_bins) results
+        and one chunk of prices are held in memory.
+
+        Args:
+            num_bins: The number of bins. num_bins - 1 boundaries are
+                returned.
+            cache_path: If set, the boundaries are cached in this JSON file,
+                and recomputed when the data generator's prices change.
+            chunk_rows: The number of prices sketched at a time.
+        """
+        digest = hashlib.sha256()
+        for chunk in self.iter_prices(chunk_rows):
+            digest.update(np.ascontiguousarray(chunk, dtype='float32').tobytes())
+        config = {'num_bins': num_bins, 'prices': digest.hexdigest()}
+        if (cache_path):
+            boundaries = load_boundaries(cache_path, **config)
+            if (boundaries is not None):
+                return boundaries
+        boundaries = sketch_chunks(self.iter_prices(chunk_rows)).boundaries(num_bins)
+        if (cache_path):
+            save_boundaries(cache_path, boundaries, **config)
+        return boundaries
+
+    def first_date_blocks(self):
+        """
+        Returns the date block of the first sale of every feature row. Rows
+        only sold in their target month get seq_len.
+        """
+        offsets = np.asarray(self.features['offsets'])
+        # Rows without sales before seq_len start at the appended seq_len
+        date_blocks = np.append(self.features['date_blocks'], self.seq_len)
+        first = date_blocks[offsets[:-1]].astype('int64')
+        return np.where(offsets[1:] > offsets[:-1], first, self.seq_len)
 
+    def subset(self, items):
+        """
+        Returns a new DataGenerator with the same features and attributes,
+        serving the given feature rows, or the given batches if the data
+        generator is eager.
+        """
+        if (self.lazy):
+            return DataGenerator(
+                features=self.features,
+                windows=self.windows,
+                indices=items,
+                batch_size=self.batch_size,
+                seq_len=self.seq_len,
+                shuffle=self.shuffle,
+                seed=self.seed,
+                on_batch=self.on_batch
+            )
         return DataGenerator(
-            batches=sample_batches,
+            batches=items,
             batch_size=self.batch_size,
             seq_len=self.seq_len,
             shuffle=self.shuffle,
-            seed=self.seed
-        )
\ No newline at end of file
+            seed=self.seed,
+            on_batch=self.on_batch
+        )
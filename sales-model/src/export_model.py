@@ -0,0 +1,340 @@
+"""
+Exports the forecasting model into latency optimized inference artifacts,
+and reports their accuracy drift and latency against the original model.
+
+The Hashing layer hashes the string form of each category, which neither
+XLA nor the TFLite builtin ops support. The exported forward pass replaces
+it with a lookup table of the layer's bins for every category below
+--num-categories, and runs the Discretization layer as a sorted search over
+its bin boundaries. The recurrent and dense layers are reused as they are.
+Categories outside the table forecast NaN instead of borrowing the bin of
+another category, and the loaders of artifacts that know the table size
+reject them with a ValueError.
+"""
+
+import os
+import json
+import time
+import argparse
+import sys
+import numpy as np
+import tensorflow as tf
+from dotenv import load_dotenv
+
+from inference import KerasModel, load_model
+
+load_dotenv()
+sys.path.append(os.getenv("SALES_DB_DIR"))
+from features import expand_sequences
+
+
+def model_layers(model):
+    """
+    Returns the hashing, discretization, recurrent and dense layers of the
+    forecasting model, in the order they are applied.
+    """
+    layers = {'hashing': None, 'discretization': None, 'rnns': [], 'denses': []}
+    for layer in model.layers:
+        if (isinstance(layer, tf.keras.layers.Hashing)):
+            layers['hashing'] = layer
+        elif (isinstance(layer, tf.keras.layers.Discretization)):
+            layers['discretization'] = layer
+        elif (isinstance(layer, tf.keras.layers.RNN)):
+            layers['rnns'].append(layer)
+        elif (isinstance(layer, tf.keras.layers.Dense)):
+            layers['denses'].append(layer)
+    return layers
+
+
+def hash_table(hashing, num_categories):
+    """ Returns the bin of every category id below num_categories. """
+    categories = np.arange(num_categories, dtype='int64').reshape(-1, 1)
+    one_hot = np.asarray(hashing(categories))
+    return np.argmax(one_hot, axis=-1).astype('int32')
+
+
+def forward_function(model, seq_len, num_categories=1024):
+    """
+    Returns the forward pass of the model as a tf.function with a fixed
+    input signature, built only from ops that XLA and TFLite support.
+    """
+    layers = model_layers(model)
+    table = tf.constant(hash_table(layers['hashing'], num_categories))
+    num_hash_bins = layers['hashing'].num_bins
+    boundaries = tf.constant(
+        layers['discretization'].bin_boundaries, dtype=tf.float32)
+    num_price_bins = len(layers['discretization'].bin_boundaries) + 1
+
+    signature = [
+        tf.TensorSpec((None, 1), tf.int64, name='categories'),
+        tf.TensorSpec((None, 1), tf.float32, name='prices'),
+        tf.TensorSpec((None, seq_len, 12), tf.float32, name='sequences')
+    ]
+
+    @tf.function(input_signature=signature)
+    def forward(categories, prices, sequences):
+        categories = categories[:, 0]
+        inside = (categories >= 0) & (categories < num_categories)
+        x = tf.one_hot(
+            tf.gather(table, tf.clip_by_value(categories, 0, num_categories - 1)),
+            num_hash_bins
+        )
+        bins = tf.searchsorted(
+            boundaries,
+            prices[:, 0],
+            side='right',
+            out_type=tf.int32
+        )
+        y = tf.one_hot(bins, num_price_bins)
+        z = sequences
+        for rnn in layers['rnns']:
+            z = rnn(z, training=False)
+        w = tf.concat([x, y, z], axis=-1)
+        for dense in layers['denses']:
+            w = dense(w)
+        return tf.where(inside[:, None], w, tf.fill(tf.shape(w), float('nan')))
+
+    return forward, signature
+
+
+def export_xla(model, forward, signature, seq_len, path, num_categories=1024):
+    """ Saves an XLA compiled forward pass as a SavedModel. """
+    module = tf.Module()
+    module.model = model
+    module.seq_len = tf.Variable(seq_len, trainable=False)
+    module.num_categories = tf.Variable(num_categories, trainable=False)
+    module.serve = tf.function(
+        forward.python_function,
+        input_signature=signature,
+        jit_compile=True
+    )
+    tf.saved_model.save(
+        module,
+        path,
+        signatures={'serving_default': module.serve}
+    )
+
+
+def export_tflite(model, forward, path, quantize=None, samples=None):
+    """
+    Converts the forward pass to a TFLite flatbuffer.
+
+    Args:
+        quantize: None, 'dynamic' for dynamic range quantized weights, or
+            'int8' for int8 weights and activations calibrated on samples.
+    """
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [forward.get_concrete_function()],
+        model
+    )
+    converter.target_spec.supported_ops = [
+        tf.lite.OpsSet.TFLITE_BUILTINS,
+        tf.lite.OpsSet.SELECT_TF_OPS
+    ]
+    if (quantize in ('dynamic', 'int8')):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if (quantize == 'int8'):
+        def representative_dataset():
+            for i in range(min(len(samples['prices']), 256)):
+                yield [
+                    samples['categories'][i:i + 1],
+                    samples['prices'][i:i + 1],
+                    samples['sequences'][i:i + 1]
+                ]
+        converter.representative_dataset = representative_dataset
+    with open(path, 'wb') as file:
+        file.write(converter.convert())
+
+
+def export_onnx(forward, signature, path):
+    """ Converts the forward pass to an ONNX graph with tf2onnx. """
+    import tf2onnx
+    tf2onnx.convert.from_function(
+        forward,
+        input_signature=signature,
+        output_path=path
+    )
+
+
+def export_numpy(model, path, num_categories=1024):
+    """
+    Saves the weights and preprocessing state of the model into an .npz
+    file for the NumPy engine in numpy_model.py.
+    """
+    layers = model_layers(model)
+    weights = {
+        'hash_table': hash_table(layers['hashing'], num_categories),
+        'num_hash_bins': layers['hashing'].num_bins,
+        'bin_boundaries': np.asarray(
+            layers['discretization'].bin_boundaries, dtype='float32'),
+        'num_rnns': len(layers['rnns']),
+        'num_denses': len(layers['denses'])
+    }
+    for i, rnn in enumerate(layers['rnns']):
+        kernel, recurrent_kernel, bias = rnn.get_weights()
+        prefix = 'rnn_{}_'.format(i)
+        weights[prefix + 'cell'] = 'lstm' if isinstance(rnn, tf.keras.layers.LSTM) else 'gru'
+        weights[prefix + 'kernel'] = kernel
+        weights[prefix + 'recurrent_kernel'] = recurrent_kernel
+        weights[prefix + 'bias'] = bias
+    for i, dense in enumerate(layers['denses']):
+        kernel, bias = dense.get_weights()
+        prefix = 'dense_{}_'.format(i)
+        weights[prefix + 'kernel'] = kernel
+        weights[prefix + 'bias'] = bias
+        weights[prefix + 'activation'] = dense.activation.__name__
+    np.savez(path, **weights)
+
+
+def load_samples(path, seq_len, num_samples=1024, seed=0):
+    """
+    Loads model inputs from a directory of .npy files, such as a feature
+    cache entry, or an .npz file. Without a path, synthetic inputs are drawn
+    with the ranges of the sales data.
+    """
+    if (path):
+        if (os.path.isdir(path)):
+            arrays = {
+                name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+                for name in os.listdir(path) if name.endswith('.npy')
+            }
+        else:
+            arrays = np.load(path)
+        samples = {
+            name: np.asarray(arrays[name][:num_samples])
+            for name in ('categories', 'prices')
+        }
+        if ('sequences' in arrays):
+            samples['sequences'] = np.asarray(arrays['sequences'][:num_samples])
+        else:
+            # Expand compact features, such as a feature cache entry
+            rows = np.arange(len(samples['prices']))
+            samples['sequences'] = expand_sequences(arrays, rows, seq_len)
+    else:
+        rng = np.random.default_rng(seed)
+        samples = {
+            'categories': rng.integers(0, 84, num_samples),
+            'prices': rng.lognormal(6.5, 1.2, num_samples),
+            'sequences': rng.poisson(0.3, (num_samples, seq_len, 12))
+        }
+    sequences = np.zeros((len(samples['prices']), seq_len, 12), dtype='float32')
+    length = min(seq_len, samples['sequences'].shape[1])
+    sequences[:, -length:] = samples['sequences'][:, -length:]
+    return {
+        'categories': samples['categories'].astype('int64').reshape(-1, 1),
+        'prices': samples['prices'].astype('float32').reshape(-1, 1),
+        'sequences': sequences
+    }
+
+
+def latency(model, samples, batch_size, repeats=50):
+    """ Returns the median seconds per call on batches of batch_size. """
+    batch = {name: array[:batch_size] for name, array in samples.items()}
+    model.predict(batch)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict(batch)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def compare(original, artifacts, samples, batch_size=256):
+    """
+    Compares each artifact with the original model.
+
+    Returns:
+        A dictionary of accuracy drift and latency for every model.
+    """
+    expected = original.predict(samples)
+    report = {}
+    for name, model in [('original', original)] + artifacts:
+        predictions = model.predict(samples, batch_size=batch_size)
+        diff = predictions - expected
+        single = latency(model, samples, 1)
+        batched = latency(model, samples, batch_size)
+        report[name] = {
+            'max_abs_diff': float(np.max(np.abs(diff))),
+            'mean_abs_diff': float(np.mean(np.abs(diff))),
+            'rmse': float(np.sqrt(np.mean(diff ** 2))),
+            'single_latency_ms': single * 1000,
+            'batch_latency_ms': batched * 1000,
+            'batch_size': batch_size,
+            'samples_per_second': batch_size / batched
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export latency optimized inference artifacts.'
+    )
+    parser.add_argument('--model', default='../callbacks/best-model')
+    parser.add_argument('--output', default='../exports')
+    parser.add_argument('--seq-len', type=int, default=34)
+    parser.add_argument('--num-categories', type=int, default=1024)
+    parser.add_argument('--no-xla', action='store_true')
+    parser.add_argument(
+        '--tflite',
+        nargs='*',
+        default=['none', 'dynamic'],
+        choices=['none', 'dynamic', 'int8'],
+        help='the TFLite quantization modes to export'
+    )
+    parser.add_argument('--onnx', action='store_true')
+    parser.add_argument(
+        '--numpy',
+        action='store_true',
+        help='export the weights for the NumPy engine'
+    )
+    parser.add_argument(
+        '--samples',
+        help='a feature cache entry or .npz file of inputs for calibration '
+        'and the report. Synthetic inputs are used if not set.'
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    original = KerasModel(args.model)
+    forward, signature = forward_function(
+        original.model, args.seq_len, args.num_categories)
+    samples = load_samples(args.samples, args.seq_len)
+
+    paths = []
+    if (not args.no_xla):
+        path = os.path.join(args.output, 'xla')
+        export_xla(
+            original.model, forward, signature, args.seq_len, path, args.num_categories)
+        paths.append(('xla', path))
+    for quantize in args.tflite:
+        path = os.path.join(args.output, 'model-{}.tflite'.format(quantize))
+        export_tflite(
+            original.model,
+            forward,
+            path,
+            quantize=None if quantize == 'none' else quantize,
+            samples=samples
+        )
+        paths.append(('tflite-{}'.format(quantize), path))
+    if (args.onnx):
+        path = os.path.join(args.output, 'model.onnx')
+        export_onnx(forward, signature, path)
+        paths.append(('onnx', path))
+    if (args.numpy):
+        path = os.path.join(args.output, 'model.npz')
+        export_numpy(original.model, path, args.num_categories)
+        paths.append(('numpy', path))
+
+    report = compare(original, [(name, load_model(path)) for name, path in paths], samples)
+    report_path = os.path.join(args.output, 'report.json')
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=2)
+    for name, row in report.items():
+        print(
+            '{:<16} max drift {:.2e}  single {:.2f}ms  batch {:.2f}ms'.format(
+                name,
+                row['max_abs_diff'],
+                row['single_latency_ms'],
+                row['batch_latency_ms']
+            )
+        )
@@ -0,0 +1,201 @@
+"""
+Loaders for the forecasting model and its exported inference artifacts.
+Every loader returns a model with the same predict method, so the serving
+and batch scoring paths can switch artifacts by changing the model path.
+TensorFlow and onnxruntime are only imported by the loaders that need them,
+so the NumPy engine loads without either.
+"""
+
+import os
+import abc
+import numpy as np
+
+
+def model_inputs(x_batch, seq_len=None):
+    """
+    Returns the model inputs of a batch, with the dtypes and shapes of the
+    model's input signature.
+
+    Args:
+        x_batch: A dictionary of categories, prices and sequences arrays.
+        seq_len: If set, sequences are cut to their last seq_len months, or
+            left padded with months without sales, to fit a fixed signature.
+    """
+    sequences = np.asarray(x_batch['sequences'], dtype='float32')
+    if (seq_len is not None and sequences.shape[1] != seq_len):
+        if (sequences.shape[1] > seq_len):
+            sequences = sequences[:, -seq_len:]
+        else:
+            pad = seq_len - sequences.shape[1]
+            sequences = np.pad(sequences, ((0, 0), (pad, 0), (0, 0)))
+    return {
+        'categories': np.asarray(x_batch['categories'], dtype='int64').reshape(-1, 1),
+        'prices': np.asarray(x_batch['prices'], dtype='float32').reshape(-1, 1),
+        'sequences': np.ascontiguousarray(sequences)
+    }
+
+
+def check_categories(categories, num_categories):
+    """
+    Raises a ValueError if a category id is outside the hash table of an
+    exported artifact, which only covers the ids below num_categories.
+    """
+    outside = (categories < 0) | (categories >= num_categories)
+    if (outside.any()):
+        raise ValueError(
+            'category ids {} are outside the exported hash table of {} ids, '
+            'export the model again with a larger --num-categories'.format(
+                np.unique(categories[outside]).tolist(),
+                num_categories
+            )
+        )
+
+
+class InferenceModel(abc.ABC):
+
+    """ Base class of the loaded models. """
+
+    # The fixed sequence length of the artifact's signature, if any
+    seq_len = None
+
+    # The number of category ids the artifact's hash table covers, if any
+    num_categories = None
+
+    def predict(self, x_batch, batch_size=None):
+        """
+        Forecasts a batch of samples.
+
+        Args:
+            x_batch: A dictionary of categories, prices and sequences arrays.
+            batch_size: If set, the samples are run batch_size at a time.
+
+        Returns:
+            An array of forecasts, one for each sample.
+
+        Raises:
+            ValueError: If a category id is outside the artifact's hash table.
+        """
+        inputs = model_inputs(x_batch, self.seq_len)
+        if (self.num_categories is not None):
+            check_categories(inputs['categories'], self.num_categories)
+        num_samples = len(inputs['prices'])
+        if (batch_size is None or num_samples <= batch_size):
+            return self._predict(inputs)
+        return np.concatenate([
+            self._predict({name: array[low:low + batch_size] for name, array in inputs.items()})
+            for low in range(0, num_samples, batch_size)
+        ])
+
+    @abc.abstractmethod
+    def _predict(self, inputs):
+        """ Forecasts a batch of model inputs, returning a flat array. """
+
+
+class KerasModel(InferenceModel):
+
+    """ The original Keras SavedModel, run eagerly. """
+
+    def __init__(self, path):
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(path)
+
+    def _predict(self, inputs):
+        return np.asarray(self.model(inputs, training=False)).reshape(-1)
+
+
+class XLAModel(InferenceModel):
+
+    """ A SavedModel of an XLA compiled function with a fixed signature. """
+
+    def __init__(self, path):
+        import tensorflow as tf
+        self.tf = tf
+        self.module = tf.saved_model.load(path)
+        self.seq_len = int(self.module.seq_len.numpy())
+        if (hasattr(self.module, 'num_categories')):
+            self.num_categories = int(self.module.num_categories.numpy())
+
+    def _predict(self, inputs):
+        outputs = self.module.serve(**{
+            name: self.tf.constant(array) for name, array in inputs.items()
+        })
+        return np.asarray(outputs).reshape(-1)
+
+
+class TFLiteModel(InferenceModel):
+
+    """ A TFLite flatbuffer, run by the TFLite interpreter. """
+
+    def __init__(self, path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path)
+        self.interpreter.allocate_tensors()
+        self.inputs = {}
+        for detail in self.interpreter.get_input_details():
+            # Signature inputs are named like serving_default_prices:0
+            name = next(
+                name for name in ('categories', 'prices', 'sequences')
+                if name in detail['name']
+            )
+            self.inputs[name] = detail
+        self.seq_len = int(self.inputs['sequences']['shape'][1])
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.inputs['prices']['shape'][0])
+
+    def _predict(self, inputs):
+        num_samples = len(inputs['prices'])
+        if (num_samples != self.batch_size):
+            for name, detail in self.inputs.items():
+                shape = list(detail['shape'])
+                shape[0] = num_samples
+                self.interpreter.resize_tensor_input(detail['index'], shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = num_samples
+        for name, detail in self.inputs.items():
+            self.interpreter.set_tensor(detail['index'], inputs[name])
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index']).reshape(-1).copy()
+
+
+class ONNXModel(InferenceModel):
+
+    """ An ONNX graph, run by onnxruntime. """
+
+    def __init__(self, path):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path)
+        for detail in self.session.get_inputs():
+            if (detail.name == 'sequences' and isinstance(detail.shape[1], int)):
+                self.seq_len = detail.shape[1]
+
+    def _predict(self, inputs):
+        outputs = self.session.run(None, inputs)
+        return np.asarray(outputs[0]).reshape(-1)
+
+
+def load_model(path):
+    """
+    Loads a forecasting model, choosing the loader from the artifact type.
+
+    Args:
+        path: The path of a Keras SavedModel directory, an exported XLA
+            SavedModel directory, a .tflite file, an .onnx file, or an .npz
+            file of weights for the NumPy engine.
+
+    Returns:
+        An InferenceModel.
+    """
+    if (path.endswith('.tflite')):
+        return TFLiteModel(path)
+    if (path.endswith('.onnx')):
+        return ONNXModel(path)
+    if (path.endswith('.npz')):
+        from numpy_model import NumpyModel
+        return NumpyModel(path)
+    if (os.path.exists(os.path.join(path, 'keras_metadata.pb'))):
+        return KerasModel(path)
+    return XLAModel(path)
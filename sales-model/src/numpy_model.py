@@ -0,0 +1,143 @@
+"""
+A NumPy only inference engine for the forecasting model. The weights and
+preprocessing state of the saved Keras model are exported once into an
+.npz file by export_model.py --numpy, and loaded here without importing
+TensorFlow, so serving workers start quickly and stay small.
+
+The forward pass matches the Keras model at inference time: the category
+is one-hot encoded through the hash table of the Hashing layer, which only
+covers the exported category ids, so other ids raise a ValueError, the price
+is one-hot encoded by its Discretization bin, the sequences run through the
+LSTM or GRU layers, and the concatenation runs through the Dense layers.
+"""
+
+import numpy as np
+
+from inference import InferenceModel
+
+
+def sigmoid(x):
+    """ Returns the logistic sigmoid of x. """
+    return 1 / (1 + np.exp(-x))
+
+
+def one_hot(indices, depth):
+    """ Returns the float32 one-hot encoding of an array of indices. """
+    encoded = np.zeros((len(indices), depth), dtype='float32')
+    encoded[np.arange(len(indices)), indices] = 1
+    return encoded
+
+
+def lstm(sequences, kernel, recurrent_kernel, bias, return_sequences=False):
+    """
+    Runs an LSTM layer over a batch of sequences, with the gates in the
+    Keras order of input, forget, cell and output.
+    """
+    num_samples, seq_len, _ = sequences.shape
+    units = recurrent_kernel.shape[0]
+    # The input projections of every month are computed in one product
+    inputs = sequences @ kernel + bias
+    h = np.zeros((num_samples, units), dtype='float32')
+    c = np.zeros((num_samples, units), dtype='float32')
+    outputs = []
+    for t in range(seq_len):
+        z = inputs[:, t] + h @ recurrent_kernel
+        i = sigmoid(z[:, :units])
+        f = sigmoid(z[:, units:2 * units])
+        c = f * c + i * np.tanh(z[:, 2 * units:3 * units])
+        h = sigmoid(z[:, 3 * units:]) * np.tanh(c)
+        outputs.append(h)
+    return np.stack(outputs, axis=1) if return_sequences else h
+
+
+def gru(sequences, kernel, recurrent_kernel, bias, return_sequences=False):
+    """
+    Runs a GRU layer over a batch of sequences, with the gates in the Keras
+    order of update, reset and candidate. A bias of shape (2, 3 * units)
+    means the reset gate is applied after the recurrent product.
+    """
+    num_samples, seq_len, _ = sequences.shape
+    units = recurrent_kernel.shape[0]
+    reset_after = bias.ndim == 2
+    input_bias, recurrent_bias = (bias[0], bias[1]) if reset_after else (bias, 0)
+    inputs = sequences @ kernel + input_bias
+    h = np.zeros((num_samples, units), dtype='float32')
+    outputs = []
+    for t in range(seq_len):
+        x = inputs[:, t]
+        if (reset_after):
+            r_h = h @ recurrent_kernel + recurrent_bias
+            z = sigmoid(x[:, :units] + r_h[:, :units])
+            r = sigmoid(x[:, units:2 * units] + r_h[:, units:2 * units])
+            candidate = np.tanh(x[:, 2 * units:] + r * r_h[:, 2 * units:])
+        else:
+            r_h = h @ recurrent_kernel[:, :2 * units]
+            z = sigmoid(x[:, :units] + r_h[:, :units])
+            r = sigmoid(x[:, units:2 * units] + r_h[:, units:])
+            candidate = np.tanh(
+                x[:, 2 * units:] + (r * h) @ recurrent_kernel[:, 2 * units:])
+        h = z * h + (1 - z) * candidate
+        outputs.append(h)
+    return np.stack(outputs, axis=1) if return_sequences else h
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': sigmoid,
+    'tanh': np.tanh
+}
+
+RNNS = {'lstm': lstm, 'gru': gru}
+
+
+class NumpyModel(InferenceModel):
+
+    """ The forecasting model, run with NumPy from exported weights. """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: The .npz file written by export_model.py --numpy.
+        """
+        with np.load(path) as arrays:
+            weights = {name: arrays[name] for name in arrays.files}
+        self.hash_table = weights['hash_table']
+        self.num_categories = len(self.hash_table)
+        self.num_hash_bins = int(weights['num_hash_bins'])
+        self.bin_boundaries = weights['bin_boundaries']
+        self.rnns = []
+        for i in range(int(weights['num_rnns'])):
+            prefix = 'rnn_{}_'.format(i)
+            self.rnns.append((
+                RNNS[str(weights[prefix + 'cell'])],
+                weights[prefix + 'kernel'],
+                weights[prefix + 'recurrent_kernel'],
+                weights[prefix + 'bias']
+            ))
+        self.denses = []
+        for i in range(int(weights['num_denses'])):
+            prefix = 'dense_{}_'.format(i)
+            self.denses.append((
+                weights[prefix + 'kernel'],
+                weights[prefix + 'bias'],
+                ACTIVATIONS[str(weights[prefix + 'activation'])]
+            ))
+
+    def _predict(self, inputs):
+        x = one_hot(self.hash_table[inputs['categories'][:, 0]], self.num_hash_bins)
+        bins = np.searchsorted(self.bin_boundaries, inputs['prices'][:, 0], side='right')
+        y = one_hot(bins, len(self.bin_boundaries) + 1)
+        z = inputs['sequences']
+        for i, (rnn, kernel, recurrent_kernel, bias) in enumerate(self.rnns):
+            z = rnn(
+                z,
+                kernel,
+                recurrent_kernel,
+                bias,
+                return_sequences=i < len(self.rnns) - 1
+            )
+        w = np.concatenate([x, y, z], axis=-1)
+        for kernel, bias, activation in self.denses:
+            w = activation(w @ kernel + bias)
+        return w.reshape(-1)
@@ -0,0 +1,258 @@
+"""
+Fine-tunes the current forecasting model when new date blocks land in the
+sales database, instead of retraining it from scratch.
+
+Features are built only for the pairs with sales in the new date blocks,
+plus a replay sample of other pairs, so the model keeps what it learned
+from history. The Hashing and Discretization layers have no trainable
+weights, so they keep their saved state, which is checked after
+fine-tuning, and training stops after a bounded number of epochs, steps or
+minutes. The validation loss on new and replayed samples is measured
+before and after fine-tuning, and the run is recorded with the checkpoint.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import tensorflow as tf
+from dotenv import load_dotenv
+
+from export_model import model_layers
+from inference import model_inputs
+
+load_dotenv()
+sys.path.append(os.getenv('SALES_DB_DIR'))
+from database import SalesDB
+from features import build_features, lookup_rows
+from splits import split_indices
+from tf_dataset import make_dataset
+from windows import SlidingWindows
+
+
+class TimeBudget(tf.keras.callbacks.Callback):
+
+    """ Stops training once a number of seconds has passed. """
+
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+        self.start = None
+
+    def on_train_begin(self, logs=None):
+        self.start = time.monotonic()
+
+    def on_train_batch_end(self, batch, logs=None):
+        if (time.monotonic() - self.start > self.seconds):
+            self.model.stop_training = True
+
+
+def replay_ids(all_ids, changed_ids, num_pairs, seed=0):
+    """ Returns a random sample of num_pairs pairs that did not change. """
+    changed = set(map(tuple, changed_ids))
+    others = [tuple(pair) for pair in all_ids if (tuple(pair) not in changed)]
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(others), min(num_pairs, len(others)), replace=False)
+    return [others[i] for i in np.sort(rows)]
+
+
+def build_samples(sales_db, changed_ids, replay, date_block, seq_len):
+    """
+    Builds the sliding windows of the changed and replayed pairs, and picks
+    their samples: the window of each changed pair that forecasts
+    date_block from the seq_len months before it, and every window of the
+    replayed pairs since their first sale.
+
+    Returns:
+        The SlidingWindows, and arrays of new and replayed samples.
+    """
+    ids = list(changed_ids) + list(replay)
+    features = build_features(sales_db, ids, date_block + 1, targets=False)
+    windows = SlidingWindows(features, date_block + 1, seq_len, horizon=1)
+    changed_rows = lookup_rows(features['ids'], changed_ids)
+    new = changed_rows * windows.num_windows + (date_block - seq_len)
+    replayed = windows.samples(lookup_rows(features['ids'], replay))
+    return windows, new, replayed
+
+
+def dataset(windows, samples, batch_size, shuffle, seed=0):
+    """ Returns a tf.data.Dataset of the samples' batches. """
+    return make_dataset(
+        lambda positions: windows.gather(samples[positions]),
+        len(samples),
+        windows.window,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        seed=seed
+    )
+
+
+def evaluate(model, windows, samples, batch_size=1024):
+    """ Returns the mean squared error of the model on the samples. """
+    if (len(samples) == 0):
+        return None
+    errors = []
+    for low in range(0, len(samples), batch_size):
+        x_batch, y_batch = windows.gather(samples[low:low + batch_size])
+        predictions = np.asarray(model(model_inputs(x_batch), training=False)).reshape(-1)
+        errors.append((predictions - y_batch) ** 2)
+    return float(np.mean(np.concatenate(errors)))
+
+
+def preprocessing_state(model):
+    """
+    Returns the number of hash bins and the price bin boundaries of the
+    model. Neither layer has trainable weights, so fit leaves them as saved
+    without freezing them, and the state is compared after fine-tuning to
+    catch anything that adapts them again.
+    """
+    layers = model_layers(model)
+    state = {}
+    if (layers['hashing'] is not None):
+        state['num_hash_bins'] = int(layers['hashing'].num_bins)
+    if (layers['discretization'] is not None):
+        state['bin_boundaries'] = [
+            float(bound) for bound in layers['discretization'].bin_boundaries]
+    return state
+
+
+def deltas(before, after):
+    """ Returns the validation loss before and after, and their change. """
+    return {
+        name: {
+            'before': before[name],
+            'after': after[name],
+            'delta': None if before[name] is None else after[name] - before[name]
+        }
+        for name in before
+    }
+
+
+def promote(path, model_path):
+    """ Replaces the model at model_path with the checkpoint at path. """
+    tmp_path = model_path.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    shutil.copytree(path, tmp_path)
+    shutil.rmtree(model_path)
+    os.replace(tmp_path, model_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fine-tune the forecasting model on new date blocks.'
+    )
+    parser.add_argument('--model', default='../callbacks/best-model')
+    parser.add_argument('--output', default='../callbacks/retrained')
+    parser.add_argument('--history', default='../callbacks/retrain_history.jsonl')
+    parser.add_argument('--date-block', type=int, help='defaults to the last date block')
+    parser.add_argument(
+        '--since',
+        type=int,
+        help='pairs with sales after this date block are new. '
+        'Defaults to the date block before --date-block.'
+    )
+    parser.add_argument('--seq-len', type=int, default=33)
+    parser.add_argument('--replay', type=int, default=20000, help='the number of replayed pairs')
+    parser.add_argument('--validation', type=float, default=0.1)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--steps', type=int, help='the maximum steps per epoch')
+    parser.add_argument('--minutes', type=float, default=15)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--promote',
+        action='store_true',
+        help='replace --model if the new validation loss improved and the '
+        'replay validation loss did not worsen by more than --tolerance'
+    )
+    parser.add_argument('--tolerance', type=float, default=0.05)
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    db = SalesDB(os.getenv('POSTGRES_USER'), os.getenv('POSTGRES_PASSWORD'))
+    date_block = db.getLastDateBlock() if args.date_block is None else args.date_block
+    since = date_block - 1 if args.since is None else args.since
+    if (date_block < args.seq_len):
+        sys.exit('date block {} has fewer than --seq-len months before it'.format(date_block))
+
+    # Build features of the changed pairs and a replay sample only
+    changed_ids = db.getChangedIds(range(since + 1, date_block + 1))
+    replay = replay_ids(db.getIds(), changed_ids, args.replay, args.seed)
+    if (len(changed_ids) == 0 and len(replay) == 0):
+        sys.exit('no pairs with sales after date block {}, and none to replay'.format(since))
+    windows, new, replayed = build_samples(db, changed_ids, replay, date_block, args.seq_len)
+    rng = np.random.default_rng(args.seed)
+    new_train, new_val = split_indices(len(new), (1 - args.validation, args.validation), True, args.seed)
+    replay_train, replay_val = split_indices(
+        len(replayed), (1 - args.validation, args.validation), True, args.seed)
+    train = rng.permutation(np.concatenate([new[new_train], replayed[replay_train]]))
+    validation = {'new': new[new_val], 'replay': replayed[replay_val]}
+    print('{} changed pairs, {} replayed pairs, {} training samples'.format(
+        len(changed_ids), len(replay), len(train)))
+    if (len(train) == 0):
+        sys.exit('no training samples')
+
+    model = tf.keras.models.load_model(args.model)
+    preprocessing = preprocessing_state(model)
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate),
+        loss='mse'
+    )
+    before = {name: evaluate(model, windows, samples) for name, samples in validation.items()}
+
+    validation_data = None
+    if (len(validation['new'])):
+        validation_data = dataset(windows, validation['new'], args.batch_size, False)
+    history = model.fit(
+        dataset(windows, train, args.batch_size, True, args.seed),
+        epochs=args.epochs,
+        steps_per_epoch=args.steps,
+        validation_data=validation_data,
+        callbacks=[TimeBudget(args.minutes * 60)],
+        verbose=2
+    )
+    after = {name: evaluate(model, windows, samples) for name, samples in validation.items()}
+    if (preprocessing_state(model) != preprocessing):
+        sys.exit('fine-tuning changed the Hashing or Discretization bins')
+
+    output = os.path.join(args.output, 'date-block-{}'.format(date_block))
+    model.save(output)
+    report = {
+        'model': args.model,
+        'output': output,
+        'date_block': date_block,
+        'since': since,
+        'changed_pairs': len(changed_ids),
+        'replayed_pairs': len(replay),
+        'training_samples': len(train),
+        'validation_samples': {name: len(samples) for name, samples in validation.items()},
+        'epochs': len(history.history.get('loss', [])),
+        'validation': deltas(before, after),
+        'seconds': time.monotonic() - start,
+        'promoted': False
+    }
+
+    if (args.promote):
+        new_loss = report['validation']['new']
+        replay_loss = report['validation']['replay']
+        improved = new_loss['delta'] is not None and new_loss['delta'] < 0
+        kept = replay_loss['delta'] is None \
+            or replay_loss['after'] <= replay_loss['before'] * (1 + args.tolerance)
+        if (improved and kept):
+            promote(output, args.model)
+            report['promoted'] = True
+
+    with open(os.path.join(output, 'report.json'), 'w') as file:
+        json.dump(report, file, indent=2)
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, 'a') as file:
+        file.write(json.dumps(report) + '\n')
+    for name, row in report['validation'].items():
+        if (row['before'] is not None):
+            print('{:<8} val mse {:.4f} -> {:.4f} ({:+.4f})'.format(
+                name, row['before'], row['after'], row['delta']))
+    print('saved {}{}'.format(output, ', promoted' if report['promoted'] else ''))
@@ -0,0 +1,60 @@
+import os
+import sys
+import importlib.util
+import pytest
+
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+SALES_DB_DIR = os.path.join(os.path.dirname(os.path.dirname(MODEL_DIR)), 'sales-db', 'src')
+
+# The .env paths are relative to src, so point them at the source trees
+os.environ['SALES_DB_DIR'] = SALES_DB_DIR
+for path in (MODEL_DIR, SALES_DB_DIR):
+    if (path not in sys.path):
+        sys.path.append(path)
+
+
+def load_module(name, path):
+    """
+    Imports a module by path, under a name that does not clash with the
+    sales-db module of the same file name.
+    """
+    if (name not in sys.modules):
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture(scope='session')
+def data_generator():
+    """ The sales-model data_generator module. """
+    return load_module('model_data_generator', os.path.join(MODEL_DIR, 'data_generator.py'))
+
+
+@pytest.fixture
+def sales_files(tmp_path):
+    """
+    Writes a small sales and items csv file: two shops, three items and
+    four months.
+    """
+    sales_path = tmp_path / 'sales_train.csv'
+    items_path = tmp_path / 'items.csv'
+    sales_path.write_text(
+        'date,date_block_num,shop_id,item_id,item_price,item_cnt_day\n'
+        '02.01.2013,0,1,10,100.0,1.0\n'
+        '03.01.2013,0,1,10,120.0,2.0\n'
+        '05.02.2013,1,1,10,110.0,1.0\n'
+        '06.03.2013,2,1,20,50.0,3.0\n'
+        '10.04.2013,3,1,20,50.0,4.0\n'
+        '11.02.2013,1,2,30,10.0,1.0\n'
+        '12.04.2013,3,2,10,90.0,2.0\n'
+    )
+    items_path.write_text(
+        'item_name,item_id,item_category_id\n'
+        'a,10,5\n'
+        'b,20,6\n'
+        'c,30,7\n'
+    )
+    return str(sales_path), str(items_path)
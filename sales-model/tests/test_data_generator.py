@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+
+def test_build_features_keeps_pair_names(data_generator, sales_files):
+    generator = data_generator.DataGenerator(*sales_files, seq_len=3, shuffle=False)
+    data = generator.load_data(*sales_files, engine='c')
+    features = generator.build_features(data)
+
+    # Categories and prices are looked up by the shop_id and item_id levels
+    np.testing.assert_array_equal(features['ids'], [[1, 10], [1, 20], [2, 10], [2, 30]])
+    np.testing.assert_array_equal(features['categories'], [5, 6, 5, 7])
+    np.testing.assert_allclose(features['prices'], [110.0, 50.0, 90.0, 10.0])
+    np.testing.assert_array_equal(features['offsets'], [0, 2, 3, 3, 4])
+    np.testing.assert_array_equal(features['date_blocks'], [0, 1, 2, 1])
+    np.testing.assert_array_equal(features['targets'], [0.0, 4.0, 2.0, 0.0])
+
+
+def test_eager_and_lazy_price_boundaries_match(data_generator, sales_files):
+    lazy = data_generator.DataGenerator(*sales_files, seq_len=3, batch_size=2, lazy=True)
+    eager = data_generator.DataGenerator(*sales_files, seq_len=3, batch_size=2)
+    assert not eager.lazy
+    assert sorted(np.concatenate(list(eager.iter_prices()))) == [10.0, 50.0, 90.0, 110.0]
+    assert eager.price_boundaries(num_bins=4) == lazy.price_boundaries(num_bins=4)
+
+
+def test_lazy_and_eager_batches_match(data_generator, sales_files):
+    lazy = data_generator.DataGenerator(
+        *sales_files, seq_len=3, batch_size=3, shuffle=False, lazy=True)
+    eager = data_generator.DataGenerator(
+        *sales_files, seq_len=3, batch_size=3, shuffle=False)
+    assert len(lazy) == len(eager) == 2
+    for i in range(len(lazy)):
+        x_lazy, y_lazy = lazy[i]
+        (sequences, categories, prices), y_eager = eager[i]
+        np.testing.assert_allclose(x_lazy['sequences'], sequences)
+        np.testing.assert_array_equal(x_lazy['categories'], categories)
+        np.testing.assert_allclose(x_lazy['prices'], prices)
+        np.testing.assert_allclose(y_lazy, y_eager)
+
+
+def test_cached_features_match(data_generator, sales_files, tmp_path):
+    built = data_generator.DataGenerator(*sales_files, seq_len=3, shuffle=False, lazy=True)
+    cached = data_generator.DataGenerator(
+        *sales_files, seq_len=3, shuffle=False, lazy=True, cache_dir=str(tmp_path / 'features'))
+    for name, array in built.features.items():
+        np.testing.assert_array_equal(cached.features[name], array)
+
+
+def test_splits_share_features(data_generator, sales_files):
+    generator = data_generator.DataGenerator(*sales_files, seq_len=3, shuffle=False, lazy=True)
+    by_shop = generator.split((0.5, 0.5), by='shop', shuffle=False)
+    assert [list(gen.indices) for gen in by_shop] == [[0, 1], [2, 3]]
+    assert all(gen.features is generator.features for gen in by_shop)
+    # Pairs first sold before date block 1 train, the rest validate
+    train, val = generator.split(cutoffs=[1])
+    assert list(train.indices) == [0] and list(val.indices) == [1, 2, 3]
+
+
+def test_windowed_generator(data_generator, sales_files):
+    generator = data_generator.DataGenerator(
+        *sales_files, seq_len=3, batch_size=8, shuffle=False, lazy=True, window=2)
+    # Windows of months 0-1 and 1-2 forecast months 2 and 3. Shop 2 first
+    # sold item 10 in month 3, so its first window is skipped
+    assert generator.windows.num_windows == 2
+    np.testing.assert_array_equal(generator.indices, [0, 1, 2, 3, 5, 6, 7])
+    x_batch, y_batch = generator[0]
+    assert x_batch['sequences'].shape == (7, 2, 12)
+    np.testing.assert_allclose(y_batch, [0.0, 0.0, 3.0, 4.0, 2.0, 0.0, 0.0])
+    with pytest.raises(ValueError):
+        data_generator.DataGenerator(*sales_files, seq_len=3, window=2)
+
+
+def test_tf_dataset_serves_every_sample(data_generator, sales_files):
+    generator = data_generator.DataGenerator(*sales_files, seq_len=3, batch_size=3, seed=1, lazy=True)
+    targets = np.concatenate([y_batch.numpy() for _, y_batch in generator.to_tf_dataset()])
+    assert sorted(targets) == [0.0, 0.0, 2.0, 4.0]
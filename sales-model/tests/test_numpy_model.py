@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from export_model import export_numpy, forward_function
+from numpy_model import NumpyModel
+
+SEQ_LEN = 6
+NUM_CATEGORIES = 32
+
+
+def build_model(cell):
+    """ A tiny randomly initialized model with the layers of sales_model.ipynb. """
+    tf.keras.utils.set_random_seed(0)
+    category_input = tf.keras.Input(shape=(1,), name='categories', dtype='int64')
+    x = tf.keras.layers.Hashing(num_bins=8, output_mode='one_hot')(category_input)
+    price_input = tf.keras.Input(shape=(1,), name='prices')
+    y = tf.keras.layers.Discretization(
+        bin_boundaries=[10.0, 100.0, 1000.0], output_mode='one_hot')(price_input)
+    sequence_input = tf.keras.Input(shape=(None, 12), name='sequences')
+    z = cell(6, return_sequences=True)(sequence_input)
+    z = cell(4)(z)
+    w = tf.keras.layers.Concatenate()([x, y, z])
+    w = tf.keras.layers.Dense(8, activation='relu')(w)
+    pred = tf.keras.layers.Dense(1)(w)
+    return tf.keras.Model(
+        inputs=[category_input, price_input, sequence_input],
+        outputs=pred
+    )
+
+
+@pytest.fixture
+def samples():
+    rng = np.random.default_rng(0)
+    return {
+        'categories': rng.integers(0, NUM_CATEGORIES, (16, 1)).astype('int64'),
+        'prices': rng.lognormal(4.0, 2.0, (16, 1)).astype('float32'),
+        'sequences': rng.poisson(1.0, (16, SEQ_LEN, 12)).astype('float32')
+    }
+
+
+@pytest.mark.parametrize('cell', [tf.keras.layers.LSTM, tf.keras.layers.GRU])
+def test_numpy_model_matches_keras(tmp_path, samples, cell):
+    model = build_model(cell)
+    path = str(tmp_path / 'model.npz')
+    export_numpy(model, path, NUM_CATEGORIES)
+
+    expected = np.asarray(model(samples, training=False)).reshape(-1)
+    forward, _ = forward_function(model, SEQ_LEN, NUM_CATEGORIES)
+    reference = np.asarray(forward(**samples)).reshape(-1)
+    predictions = NumpyModel(path).predict(samples)
+    np.testing.assert_allclose(reference, expected, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(predictions, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_categories_outside_the_hash_table_are_rejected(tmp_path, samples):
+    model = build_model(tf.keras.layers.LSTM)
+    path = str(tmp_path / 'model.npz')
+    export_numpy(model, path, NUM_CATEGORIES)
+    samples['categories'][3] = NUM_CATEGORIES
+    with pytest.raises(ValueError, match='--num-categories'):
+        NumpyModel(path).predict(samples)
+
+    forward, _ = forward_function(model, SEQ_LEN, NUM_CATEGORIES)
+    predictions = np.asarray(forward(**samples)).reshape(-1)
+    assert np.isnan(predictions[3])
+    assert not np.isnan(np.delete(predictions, 3)).any()
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import retrain
+
+
+class FakeSalesDB():
+
+    """ Answers getBatchFeatures from an in-memory monthly rollup. """
+
+    def __init__(self, monthly):
+        self.monthly = monthly
+
+    def getBatchFeatures(self, pairs):
+        rows = []
+        for idx, pair in enumerate(pairs):
+            blocks = self.monthly.get(tuple(pair), {})
+            for date_block in sorted(blocks):
+                rows.append((idx, 5, 100.0, date_block, blocks[date_block]))
+        return rows
+
+
+@pytest.fixture
+def sales_db():
+    return FakeSalesDB({
+        (1, 10): {0: 1.0, 1: 2.0, 3: 3.0},
+        (1, 20): {2: 4.0, 3: 1.0},
+        (2, 30): {1: 5.0}
+    })
+
+
+def test_replay_ids_sample_unchanged_pairs():
+    all_ids = [(1, 10), (1, 20), (2, 30), (2, 40), (3, 10)]
+    changed = [(1, 20), (2, 40)]
+    replay = retrain.replay_ids(all_ids, changed, 2, seed=1)
+    assert len(replay) == 2
+    assert not set(replay) & set(changed)
+    assert replay == sorted(replay, key=all_ids.index)
+    assert replay == retrain.replay_ids(all_ids, changed, 2, seed=1)
+    assert retrain.replay_ids(all_ids, changed, 10) == [(1, 10), (2, 30), (3, 10)]
+
+
+def test_build_samples_forecast_the_date_block(sales_db):
+    windows, new, replayed = retrain.build_samples(
+        sales_db, [(1, 10), (1, 20)], [(2, 30)], date_block=3, seq_len=2)
+    x_batch, y_batch = windows.gather(new)
+    # The changed pairs forecast date block 3 from months 1 and 2
+    np.testing.assert_allclose(y_batch, [3.0, 1.0])
+    np.testing.assert_allclose(x_batch['sequences'].sum(axis=-1), [[2.0, 0.0], [0.0, 4.0]])
+    # Replayed samples only come from the replayed pair, the last row
+    assert len(replayed) > 0
+    assert set(replayed // windows.num_windows) == {2}
+
+
+def test_evaluate_without_samples_is_none():
+    assert retrain.evaluate(None, None, np.array([], dtype='int64')) is None
+
+
+def test_preprocessing_state_has_no_trainable_weights():
+    category_input = tf.keras.Input(shape=(1,), name='categories', dtype='int64')
+    x = tf.keras.layers.Hashing(num_bins=8, output_mode='one_hot')(category_input)
+    price_input = tf.keras.Input(shape=(1,), name='prices')
+    discretization = tf.keras.layers.Discretization(
+        bin_boundaries=[10.0, 100.0], output_mode='one_hot')
+    y = discretization(price_input)
+    pred = tf.keras.layers.Dense(1)(tf.keras.layers.Concatenate()([x, y]))
+    model = tf.keras.Model(inputs=[category_input, price_input], outputs=pred)
+    model.compile(optimizer='adam', loss='mse')
+
+    state = retrain.preprocessing_state(model)
+    assert state == {'num_hash_bins': 8, 'bin_boundaries': [10.0, 100.0]}
+    assert not model.layers[2].trainable_weights and not discretization.trainable_weights
+    model.fit(
+        {'categories': np.arange(16).reshape(-1, 1), 'prices': np.linspace(1, 500, 16).reshape(-1, 1)},
+        np.ones(16),
+        epochs=1,
+        verbose=0
+    )
+    assert retrain.preprocessing_state(model) == state
+
+
+def test_deltas():
+    before = {'new': 2.0, 'replay': None}
+    after = {'new': 1.5, 'replay': 1.0}
+    assert retrain.deltas(before, after) == {
+        'new': {'before': 2.0, 'after': 1.5, 'delta': -0.5},
+        'replay': {'before': None, 'after': 1.0, 'delta': None}
+    }
+
+
+def test_promote_replaces_the_model(tmp_path):
+    checkpoint = tmp_path / 'retrained'
+    model = tmp_path / 'best-model'
+    checkpoint.mkdir()
+    model.mkdir()
+    (checkpoint / 'weights').write_text('new')
+    (model / 'weights').write_text('old')
+    (model / 'stale').write_text('old')
+    retrain.promote(str(checkpoint), str(model))
+    assert sorted(os.listdir(model)) == ['weights']
+    assert (model / 'weights').read_text() == 'new'
+    assert (checkpoint / 'weights').exists()
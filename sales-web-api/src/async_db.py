@@ -0,0 +1,40 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncSalesDB():
+
+    """
+    AsyncSalesDB runs the blocking queries of a SalesDB instance on a thread
+    pool, so they can be awaited from the event loop. Each thread checks out
+    its own connection from the SalesDB connection pool, which is sized to
+    the number of threads.
+    """
+
+    def __init__(self, sales_db, max_connections=8):
+        """
+        Args:
+            sales_db: The SalesDB instance.
+            max_connections: The maximum number of concurrent queries.
+        """
+        self.sales_db = sales_db
+        pool = sales_db.pool
+        pool.resize(max(pool.max_size, max_connections))
+        self._executor = ThreadPoolExecutor(
+            max_connections,
+            thread_name_prefix='sales-db'
+        )
+
+    async def run(self, method, *args):
+        """ Awaits a SalesDB method called with args. """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, method, *args)
+
+    async def getBatchFeatures(self, pairs):
+        """ Awaits SalesDB.getBatchFeatures. """
+        return await self.run(self.sales_db.getBatchFeatures, pairs)
+
+    async def close(self):
+        """ Waits for running queries, and closes every connection. """
+        self._executor.shutdown(wait=True)
+        self.sales_db.close()
@@ -0,0 +1,175 @@
+import asyncio
+
+
+class MicroBatcher():
+
+    """
+    MicroBatcher coalesces concurrent requests into batches. Requests are
+    queued, and a single task drains the queue into a batch once it holds
+    max_batch items or the oldest request has waited max_wait seconds. A
+    request that does not fit is split, and the rest of it starts the next
+    batch. Up to max_in_flight batches are processed at once, so the next
+    batch can be fetched while the previous one is predicted.
+    """
+
+    def __init__(self, process, max_batch=256, max_wait=0.005, max_in_flight=2):
+        """
+        Args:
+            process: A coroutine function that takes a list of items and
+                returns a list of results in the same order.
+            max_batch: The maximum number of items in a batch. Larger
+                requests are split across batches.
+            max_wait: The maximum number of seconds a request waits for
+                other requests to join its batch.
+            max_in_flight: The maximum number of batches processed at once.
+        """
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self._queue = asyncio.Queue()
+        self._carry = None
+        self._task = None
+        self._tasks = set()
+
+    async def start(self):
+        """ Starts the batching task. """
+        if (self._task is None):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the batching task, waits for the batches in flight, and fails
+        any queued requests.
+        """
+        if (self._task is not None):
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if (self._tasks):
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        requests = []
+        if (self._carry is not None):
+            requests.append(self._carry)
+            self._carry = None
+        while (not self._queue.empty()):
+            requests.append(self._queue.get_nowait())
+        for _, future in requests:
+            if (not future.done()):
+                future.set_exception(RuntimeError("batcher stopped"))
+
+    async def submit(self, items):
+        """
+        Queues a request, and waits for its results.
+
+        Args:
+            items: A list of items.
+
+        Returns:
+            A list of results, one for each item.
+        """
+        if (not items):
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((items, future))
+        return await future
+
+    def _split(self, request, size):
+        """
+        Splits a request after its first size items. The request's future
+        gets the results of both parts once they are done.
+        """
+        loop = asyncio.get_running_loop()
+        items, future = request
+        head = (items[:size], loop.create_future())
+        tail = (items[size:], loop.create_future())
+
+        def join(parts):
+            if (future.done()):
+                return
+            head_results, tail_results = parts.result()
+            for results in (head_results, tail_results):
+                if (isinstance(results, BaseException)):
+                    future.set_exception(results)
+                    return
+            future.set_result(head_results + tail_results)
+
+        asyncio.gather(head[1], tail[1], return_exceptions=True).add_done_callback(join)
+        return head, tail
+
+    async def _next_batch(self):
+        """ Waits for a batch of at most max_batch items. """
+        loop = asyncio.get_running_loop()
+        requests = []
+        size = 0
+        deadline = None
+        while (size < self.max_batch):
+            try:
+                if (self._carry is not None):
+                    request, self._carry = self._carry, None
+                elif (not requests):
+                    request = await self._queue.get()
+                else:
+                    timeout = deadline - loop.time()
+                    if (timeout <= 0):
+                        break
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            except asyncio.CancelledError:
+                for _, future in requests:
+                    if (not future.done()):
+                        future.set_exception(RuntimeError("batcher stopped"))
+                raise
+            if (deadline is None):
+                deadline = loop.time() + self.max_wait
+
+            # Carry the part that does not fit over to the next batch
+            room = self.max_batch - size
+            if (len(request[0]) > room):
+                request, self._carry = self._split(request, room)
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    async def _run(self):
+        """ Starts batches of requests until cancelled. """
+        slots = asyncio.Semaphore(self.max_in_flight)
+
+        def done(task):
+            self._tasks.discard(task)
+            slots.release()
+
+        while True:
+            await slots.acquire()
+            try:
+                requests = await self._next_batch()
+            except BaseException:
+                slots.release()
+                raise
+            task = asyncio.create_task(self._process(requests))
+            self._tasks.add(task)
+            task.add_done_callback(done)
+
+    async def _process(self, requests):
+        """ Processes a batch of requests, and hands each its results. """
+        items = [item for request_items, _ in requests for item in request_items]
+        try:
+            results = await self.process(items)
+        except Exception as error:
+            for _, future in requests:
+                if (not future.done()):
+                    future.set_exception(error)
+            return
+
+        # Hand each request its slice of the results
+        low = 0
+        for request_items, future in requests:
+            high = low + len(request_items)
+            if (not future.done()):
+                future.set_result(results[low:high])
+            low = high
@@ -1,9 +1,257 @@
 import os
 import sys
+import asyncio
+from aiohttp import web
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+
+from async_db import AsyncSalesDB
+from batcher import MicroBatcher
 
 load_dotenv()
 sys.path.append(os.getenv("SALES_DB_DIR"))
+sys.path.append(os.getenv("SALES_MODEL_DIR"))
+from cache import PairCache, SQLiteBackend
 from database import SalesDB
+from features import fill_batch
+from inference import load_model
+from metrics import PrometheusSink
+
+USER = os.getenv("POSTGRES_USER", "admin")
+PASSWORD = os.getenv("POSTGRES_PASSWORD", "root")
+MODEL_DIR = os.getenv("MODEL_DIR")
+SEQ_LEN = int(os.getenv("SEQ_LEN", 34))
+MAX_BATCH = int(os.getenv("MAX_BATCH", 256))
+MAX_WAIT_MS = float(os.getenv("MAX_WAIT_MS", 5))
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 2))
+MAX_PAIRS = int(os.getenv("MAX_PAIRS", 10000))
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", 8))
+PORT = int(os.getenv("PORT", 8080))
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", 100000))
+CACHE_TTL = float(os.getenv("CACHE_TTL", 60))
+CACHE_PATH = os.getenv("CACHE_PATH")
+CACHE_CHECK_SECONDS = float(os.getenv("CACHE_CHECK_SECONDS", 5))
+SLOW_QUERY_MS = os.getenv("SLOW_QUERY_MS")
+
+
+class ForecastService():
+
+    """
+    ForecastService forecasts next month sales for shop and item pairs.
+    Concurrent requests are coalesced by a MicroBatcher, so a single
+    database query and a single model call serve every request in a batch.
+    Forecasts are cached per pair until the sales rollup changes.
+    """
+
+    def __init__(
+            self,
+            db,
+            model_dir,
+            seq_len=34,
+            max_batch=256,
+            max_wait=0.005,
+            max_in_flight=2,
+            max_pairs=10000,
+            cache=None
+        ):
+        """
+        Args:
+            db: The AsyncSalesDB instance.
+            model_dir: The path of the saved model, or of an artifact
+                exported by export_model.py.
+            seq_len: The length of each sequence of monthly sales data.
+            max_batch: The maximum number of pairs in a batch.
+            max_wait: The maximum number of seconds a request waits for
+                other requests to join its batch.
+            max_in_flight: The maximum number of batches processed at once.
+            max_pairs: The maximum number of pairs in a request.
+            cache: An optional PairCache of forecasts.
+        """
+        self.db = db
+        self.cache = cache
+        self.model_dir = model_dir
+        self.seq_len = seq_len
+        self.max_pairs = max_pairs
+        self.model = None
+        self.batcher = MicroBatcher(self._predict, max_batch, max_wait, max_in_flight)
+
+        # Model calls run one at a time off the event loop
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='model')
+
+    async def start(self):
+        """ Loads the model once, and starts batching requests. """
+        loop = asyncio.get_running_loop()
+        self.model = await loop.run_in_executor(
+            self._executor,
+            load_model,
+            self.model_dir
+        )
+        await self.batcher.start()
+
+    async def stop(self):
+        """ Stops batching requests, and closes the database. """
+        await self.batcher.stop()
+        self._executor.shutdown(wait=True)
+        await self.db.close()
+
+    async def forecast(self, pairs):
+        """
+        Forecasts next month sales.
+
+        Args:
+            pairs: A list of shop and item id pairs.
+
+        Returns:
+            A list of forecasts, one for each pair.
+
+        Raises:
+            ValueError: If there are more than max_pairs pairs.
+        """
+        if (len(pairs) > self.max_pairs):
+            raise ValueError("expected at most {} pairs, got {}".format(self.max_pairs, len(pairs)))
+        forecasts = [None] * len(pairs)
+        if (self.cache is not None):
+            # The cache may query the database or a sqlite file, so it is
+            # read and written on the database threads
+            forecasts = await self.db.run(self._cached, pairs)
+        missing = [i for i, forecast in enumerate(forecasts) if (forecast is None)]
+
+        if (missing):
+            results = await self.batcher.submit([pairs[i] for i in missing])
+            for i, (forecast, _) in zip(missing, results):
+                forecasts[i] = forecast
+            if (self.cache is not None):
+                await self.db.run(self._cache, [pairs[i] for i in missing], results)
+        return forecasts
+
+    def _cached(self, pairs):
+        """
+        Returns the cached forecast of each pair, or None if it is missing.
+        Forecasts cached before the rollup was refreshed are missing.
+        """
+        self.db.sales_db.checkCache()
+        return [self.cache.get("forecast", shop_id, item_id) for shop_id, item_id in pairs]
+
+    def _cache(self, pairs, results):
+        """ Caches the forecast of each pair with its latest date block. """
+        for (shop_id, item_id), (forecast, date_block) in zip(pairs, results):
+            self.cache.set("forecast", shop_id, item_id, forecast, date_block)
+
+    async def _predict(self, pairs):
+        """
+        Forecasts a batch of pairs with one query and one model call, and
+        returns each forecast with the latest date block it was based on.
+        """
+        rows = await self.db.getBatchFeatures(pairs)
+        x_batch, _ = fill_batch(rows, len(pairs), self.seq_len, targets=False)
+        date_blocks = [None] * len(pairs)
+        for idx, _, _, date_block, _ in rows:
+            if (date_block is not None):
+                date_blocks[idx] = date_block
+
+        loop = asyncio.get_running_loop()
+        predictions = await loop.run_in_executor(
+            self._executor,
+            self.model.predict,
+            x_batch
+        )
+        return list(zip(predictions.tolist(), date_blocks))
+
+
+async def forecast(request):
+    """
+    Forecasts next month sales for a list of shop and item id pairs.
+
+    Request body:
+        {"pairs": [[shop_id, item_id], ...]}
+
+    Response body:
+        {"forecasts": [{"shop_id": ..., "item_id": ..., "forecast": ...}]}
+    """
+    try:
+        body = await request.json()
+        pairs = [(int(shop_id), int(item_id)) for shop_id, item_id in body["pairs"]]
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(
+            text='expected a body of {"pairs": [[shop_id, item_id], ...]}'
+        )
+
+    service = request.app["service"]
+    if (len(pairs) > service.max_pairs):
+        raise web.HTTPRequestEntityTooLarge(
+            max_size=service.max_pairs,
+            actual_size=len(pairs),
+            text="expected at most {} pairs, got {}".format(service.max_pairs, len(pairs))
+        )
+    predictions = await service.forecast(pairs)
+    return web.json_response({
+        "forecasts": [
+            {"shop_id": shop_id, "item_id": item_id, "forecast": prediction}
+            for (shop_id, item_id), prediction in zip(pairs, predictions)
+        ]
+    })
+
+
+async def health(request):
+    """ Reports whether the model has been loaded. """
+    return web.json_response({"ready": request.app["service"].model is not None})
+
+
+async def stats(request):
+    """ Reports the hit and miss counters of the forecast cache. """
+    cache = request.app["service"].cache
+    return web.json_response(cache.stats() if cache is not None else {})
+
+
+async def metrics(request):
+    """ Reports the database metrics in the Prometheus text format. """
+    return web.Response(text=request.app["metrics"].render(), content_type="text/plain")
+
+
+async def on_startup(app):
+    await app["service"].start()
+
+
+async def on_cleanup(app):
+    await app["service"].stop()
+
+
+def create_app():
+    """ Creates the web application. """
+    backend = SQLiteBackend(CACHE_PATH) if CACHE_PATH else None
+    cache = PairCache(CACHE_MAXSIZE, CACHE_TTL, backend)
+    sink = PrometheusSink()
+    db = AsyncSalesDB(
+        SalesDB(
+            USER,
+            PASSWORD,
+            cache=cache,
+            cache_check_seconds=CACHE_CHECK_SECONDS,
+            metrics=sink,
+            slow_query_seconds=float(SLOW_QUERY_MS) / 1000 if SLOW_QUERY_MS else None
+        ),
+        max_connections=MAX_CONNECTIONS
+    )
+    app = web.Application()
+    app["metrics"] = sink
+    app["service"] = ForecastService(
+        db,
+        MODEL_DIR,
+        seq_len=SEQ_LEN,
+        max_batch=MAX_BATCH,
+        max_wait=MAX_WAIT_MS / 1000,
+        max_in_flight=MAX_IN_FLIGHT,
+        max_pairs=MAX_PAIRS,
+        cache=cache
+    )
+    app.router.add_post("/forecast", forecast)
+    app.router.add_get("/health", health)
+    app.router.add_get("/stats", stats)
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
 
-db = SalesDB("admin", "root")
\ No newline at end of file
+if __name__ == "__main__":
+    web.run_app(create_app(), port=PORT)
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+
+load_dotenv()
+sys.path.append(os.getenv("SALES_DB_DIR"))
+sys.path.append(os.getenv("SALES_MODEL_DIR"))
+from database import SalesDB
+from features import build_features, gather_batch
+from inference import load_model
+
+
+"""
+Scores every shop and item pair in the sales database, and writes the next
+month forecasts to the forecasts table. Pairs are streamed in chunks, and
+the features of the next chunk are fetched and the forecasts of the previous
+chunk are written while the current chunk is scored. Each written chunk is
+recorded in a checkpoint file, so a crashed run resumes after the last
+written chunk.
+"""
+
+USER = os.getenv("POSTGRES_USER", "admin")
+PASSWORD = os.getenv("POSTGRES_PASSWORD", "root")
+MODEL_DIR = os.getenv("MODEL_DIR")
+
+FORECAST_COLUMNS = ["shop_id", "item_id", "date_block_num", "forecast", "run_id"]
+ON_CONFLICT = \
+    "(shop_id, item_id, date_block_num) DO UPDATE SET \
+        forecast = EXCLUDED.forecast \
+        ,run_id = EXCLUDED.run_id \
+        ,created_at = now()"
+
+
+def load_checkpoint(path, date_block):
+    """
+    Returns the checkpoint of a run forecasting date_block, or a new
+    checkpoint if there is none.
+    """
+    if (path and os.path.exists(path)):
+        with open(path) as file:
+            checkpoint = json.load(file)
+        if (checkpoint["date_block"] == date_block):
+            return checkpoint
+    return {
+        "date_block": date_block,
+        "run_id": uuid.uuid4().hex,
+        "last_pair": None,
+        "chunks": 0,
+        "rows": 0
+    }
+
+
+def save_checkpoint(path, checkpoint):
+    """ Atomically writes a checkpoint. """
+    if (not path):
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, path)
+
+
+def score(db, model, checkpoint, checkpoint_path, chunk_rows=50000, batch_size=4096):
+    """
+    Scores every pair after the checkpoint's last pair.
+
+    Args:
+        db: The SalesDB instance.
+        model: The forecasting model, loaded with inference.load_model.
+        checkpoint: The checkpoint to resume from.
+        checkpoint_path: The filepath the checkpoint is saved to.
+        chunk_rows: The number of pairs in each chunk.
+        batch_size: The number of pairs in each model call.
+
+    Returns:
+        The final checkpoint.
+    """
+    date_block = checkpoint["date_block"]
+    chunks = db.streamIds(chunk_rows, after=checkpoint["last_pair"])
+
+    def fetch(ids):
+        """ Builds the features of a chunk of pairs. """
+        return build_features(db, ids.tolist(), date_block, targets=False)
+
+    def finish(write):
+        """ Waits for a chunk to be written, and records it. """
+        ids, future = write
+        report = future.result()
+        checkpoint["last_pair"] = [int(ids[-1][0]), int(ids[-1][1])]
+        checkpoint["chunks"] += 1
+        checkpoint["rows"] += report["rows"]
+        save_checkpoint(checkpoint_path, checkpoint)
+        print("chunk {chunks}: {rows} pairs scored".format(**checkpoint))
+
+    with ThreadPoolExecutor(2) as executor:
+        def submit_next():
+            """ Starts fetching the features of the next chunk. """
+            chunk = next(chunks, None)
+            if (chunk is None):
+                return None
+            ids = np.stack([chunk["shop_id"], chunk["item_id"]], axis=1)
+            return ids, executor.submit(fetch, ids)
+
+        pending = submit_next()
+        write = None
+        while (pending is not None):
+            ids, future = pending
+            features = future.result()
+            pending = submit_next()
+
+            # Score the chunk while the next chunk is fetched, expanding
+            # the compact sequences one batch at a time
+            num_samples = len(features["ids"])
+            predictions = np.concatenate([
+                model.predict(gather_batch(
+                    features,
+                    np.arange(low, min(low + batch_size, num_samples)),
+                    date_block
+                )[0])
+                for low in range(0, num_samples, batch_size)
+            ])
+
+            if (write is not None):
+                finish(write)
+            rows = [
+                (int(shop_id), int(item_id), date_block, float(prediction), checkpoint["run_id"])
+                for (shop_id, item_id), prediction in zip(features["ids"], predictions)
+            ]
+            write = (ids, executor.submit(
+                db.copyRows, "forecasts", FORECAST_COLUMNS, rows, ON_CONFLICT))
+        if (write is not None):
+            finish(write)
+    return checkpoint
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Forecast next month sales for every shop and item pair."
+    )
+    parser.add_argument("--chunk-rows", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--checkpoint", default="score_checkpoint.json")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the checkpoint, and score every pair again"
+    )
+    args = parser.parse_args()
+
+    db = SalesDB(USER, PASSWORD)
+    date_block = db.getLastDateBlock() + 1
+    if (args.restart and os.path.exists(args.checkpoint)):
+        os.remove(args.checkpoint)
+    checkpoint = load_checkpoint(args.checkpoint, date_block)
+    if (checkpoint["last_pair"] is not None):
+        print("resuming after pair {}".format(checkpoint["last_pair"]))
+
+    model = load_model(MODEL_DIR)
+    start = time.perf_counter()
+    checkpoint = score(
+        db,
+        model,
+        checkpoint,
+        args.checkpoint,
+        chunk_rows=args.chunk_rows,
+        batch_size=args.batch_size
+    )
+    print("scored {} pairs for date block {} in {:.1f}s".format(
+        checkpoint["rows"], date_block, time.perf_counter() - start))
+    db.close()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+
+SALES_WEB_API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+if (SALES_WEB_API_DIR not in sys.path):
+    sys.path.append(SALES_WEB_API_DIR)
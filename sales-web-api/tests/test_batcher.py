@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+
+from batcher import MicroBatcher
+
+
+class FakeProcess():
+
+    """
+    FakeProcess records the batches it is called with, and doubles each
+    item. Batches wait on release, if it is given, before they finish.
+    """
+
+    def __init__(self, release=None, error=None):
+        self.batches = []
+        self.running = 0
+        self.max_running = 0
+        self.release = release
+        self.error = error
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            if (self.release is not None):
+                await self.release.wait()
+            else:
+                await asyncio.sleep(0)
+            if (self.error is not None):
+                raise self.error
+            return [item * 2 for item in items]
+        finally:
+            self.running -= 1
+
+
+def run(main):
+    return asyncio.run(main())
+
+
+def test_concurrent_requests_share_a_batch():
+    process = FakeProcess()
+
+    async def main():
+        batcher = MicroBatcher(process, max_batch=10, max_wait=0.05)
+        await batcher.start()
+        results = await asyncio.gather(
+            batcher.submit([1, 2]),
+            batcher.submit([3]),
+            batcher.submit([4, 5, 6])
+        )
+        await batcher.stop()
+        return results
+
+    assert run(main) == [[2, 4], [6], [8, 10, 12]]
+    assert process.batches == [[1, 2, 3, 4, 5, 6]]
+
+
+def test_batches_are_split_at_max_batch():
+    process = FakeProcess()
+
+    async def main():
+        batcher = MicroBatcher(process, max_batch=4, max_wait=0.05)
+        await batcher.start()
+        results = await asyncio.gather(
+            batcher.submit([1, 2, 3]),
+            batcher.submit([4, 5, 6, 7, 8, 9, 10])
+        )
+        await batcher.stop()
+        return results
+
+    assert run(main) == [[2, 4, 6], [8, 10, 12, 14, 16, 18, 20]]
+    assert [len(batch) for batch in process.batches] == [4, 4, 2]
+    assert sum(process.batches, []) == list(range(1, 11))
+
+
+def test_batches_are_processed_in_flight_up_to_the_limit():
+    async def main():
+        release = asyncio.Event()
+        process = FakeProcess(release)
+        batcher = MicroBatcher(process, max_batch=1, max_wait=0, max_in_flight=2)
+        await batcher.start()
+        requests = [asyncio.create_task(batcher.submit([i])) for i in range(4)]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        in_flight = process.running
+        release.set()
+        results = await asyncio.gather(*requests)
+        await batcher.stop()
+        return in_flight, process.max_running, results
+
+    in_flight, max_running, results = run(main)
+    assert in_flight == 2
+    assert max_running == 2
+    assert results == [[0], [2], [4], [6]]
+
+
+def test_errors_fail_every_request_of_the_batch():
+    process = FakeProcess(error=ValueError('model failed'))
+
+    async def main():
+        batcher = MicroBatcher(process, max_batch=2, max_wait=0.05)
+        await batcher.start()
+        results = await asyncio.gather(
+            batcher.submit([1]),
+            batcher.submit([2, 3]),
+            return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+
+    results = run(main)
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_stop_waits_for_batches_in_flight_and_fails_queued_requests():
+    async def main():
+        release = asyncio.Event()
+        process = FakeProcess(release)
+        batcher = MicroBatcher(process, max_batch=2, max_wait=0, max_in_flight=1)
+        await batcher.start()
+        first = asyncio.create_task(batcher.submit([1, 2]))
+        queued = asyncio.create_task(batcher.submit([3, 4, 5]))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        stopping = asyncio.create_task(batcher.stop())
+        await asyncio.sleep(0)
+        release.set()
+        await stopping
+        return await first, queued
+
+    first, queued = run(main)
+    assert first == [2, 4]
+    with pytest.raises(RuntimeError):
+        queued.result()